@@ -0,0 +1,57 @@
+# bench_auth.py - shift-start login storm: KDF logins, cached re-logins and token checks
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "easyPark"))
+from database import Database
+from parking_engine import ParkingEngine
+from parking_spot import ParkingLot
+from passwords import PasswordHasher
+
+def storm(pool, fn, args_list):
+    start = time.perf_counter()
+    results = list(pool.map(lambda args: fn(*args), args_list))
+    return results, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark logins under the salted password scheme")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--scheme", default="scrypt")
+    parser.add_argument("--cost", type=int)
+    args = parser.parse_args()
+    tmp = tempfile.mkdtemp()
+    try:
+        db = Database(os.path.join(tmp, "auth.db"), pool_size=args.workers + 1)
+        users = [f"user{i}" for i in range(args.users)]
+        # everyone starts on the legacy unsalted sha256 hash
+        with db.connection() as conn, conn:
+            conn.executemany("INSERT INTO users (username, password_hash, balance) VALUES (?, ?, ?)",
+                             [(u, hashlib.sha256(b"pw").hexdigest(), 0) for u in users])
+        engine = ParkingEngine(ParkingLot(10), db, hasher=PasswordHasher(args.scheme, args.cost))
+        credentials = [(u, "pw") for u in users]
+        with ThreadPoolExecutor(args.workers) as pool:
+            _, upgrade = storm(pool, engine.authenticate, credentials)
+            engine.verified.clear()
+            _, cold = storm(pool, engine.authenticate, credentials)
+            _, warm = storm(pool, engine.authenticate, credentials)
+            logins, _ = storm(pool, engine.login, credentials)
+            _, tokens = storm(pool, engine.authenticate_token, [(token,) for _, token in logins])
+        upgraded = sum(not engine.hasher.needs_upgrade(db.get_user(u).password_hash) for u in users)
+        print(f"{args.users} users, {args.workers} workers, {engine.hasher.scheme} cost {engine.hasher.cost}")
+        for name, elapsed in (("legacy login + rehash", upgrade), ("KDF login", cold),
+                              ("cached re-login", warm), ("token check", tokens)):
+            print(f"  {name:22s} {elapsed * 1000:8.0f} ms  {args.users / elapsed:10.0f} logins/s")
+        print(f"  hashes upgraded: {upgraded}/{args.users}")
+        db.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
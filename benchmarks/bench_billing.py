@@ -0,0 +1,107 @@
+# bench_billing.py - pricing many open sessions: per-spot loop vs the batch fee engine
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from array import array
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "easyPark"))
+import billing
+from database import Database
+from parking_engine import ParkingEngine
+from parking_spot import ParkingLot
+from tariff import Tariff, load_tariff
+from user import User
+from vehicle import Vehicle
+
+RATES = {"car": 5, "motorcycle": 3}
+
+def per_spot(start_times, types, now):
+    # what calculate_exit_fee does for one spot, repeated for every session
+    now = datetime.fromtimestamp(now)
+    return [RATES[t] * (now - datetime.fromtimestamp(s)).total_seconds() / 3600 for s, t in zip(start_times, types)]
+
+def pricing(sessions, tariff, seed=0):
+    rng = random.Random(seed)
+    now = time.time()
+    start_times = array('d', (now - rng.random() * 36000 for _ in range(sessions)))
+    type_codes = bytearray(rng.choice((1, 2)) for _ in range(sessions))
+    types = [("car", "motorcycle")[c - 1] for c in type_codes]
+    type_names = [None, "car", "motorcycle"]
+    results = {}
+    start = time.perf_counter()
+    per_spot(start_times, types, now)
+    results["per-spot loop"] = time.perf_counter() - start
+    numpy = billing.np
+    for name, module in (("batch, array fallback", None), ("batch, numpy", numpy)):
+        if name.endswith("numpy") and numpy is None:
+            continue
+        billing.np = module
+        start = time.perf_counter()
+        fees = billing.compute_fees(tariff, type_names, start_times, type_codes, now)
+        results[name] = time.perf_counter() - start
+        expected = [tariff.fee(types[i], start_times[i], now) for i in range(1000)]
+        assert max(abs(a - b) for a, b in zip(fees[:1000], expected)) < 1e-6
+    billing.np = numpy
+    return results
+
+def settlement(sessions, num_users, tariff, seed=0):
+    # end-of-day checkout of every open session, charged through the database
+    rng = random.Random(seed)
+    tmp = tempfile.mkdtemp()
+    try:
+        db = Database(os.path.join(tmp, "billing.db"))
+        users = [User(f"user{i}", "x") for i in range(num_users)]
+        with db.connection() as conn, conn:
+            conn.executemany("INSERT INTO users (username, password_hash, balance) VALUES (?, ?, ?)",
+                             [(u.username, "x", 1e6) for u in users])
+        lot = ParkingLot(sessions)
+        engine = ParkingEngine(lot, db, tariff=tariff)
+        now = time.time()
+        for i in range(sessions):
+            lot.occupy_spot(lot.spot_id(i), Vehicle(rng.choice(("car", "motorcycle")), f"P{i}"), 1,
+                            users[rng.randrange(num_users)], now - rng.random() * 36000)
+        start = time.perf_counter()
+        engine.batch_fees()
+        priced = time.perf_counter() - start
+        settle_exits = db.settle_exits
+        def timed_settle(charges):
+            nonlocal charged_at
+            before = time.perf_counter()
+            try:
+                return settle_exits(charges)
+            finally:
+                charged_at = time.perf_counter() - before
+        charged_at = 0.0
+        db.settle_exits = timed_settle
+        start = time.perf_counter()
+        exited, charged, unpaid = engine.checkout_batch()
+        elapsed = time.perf_counter() - start
+        assert len(exited) == sessions and not unpaid
+        db.close()
+        return priced, charged_at, elapsed
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batch fee computation")
+    parser.add_argument("--sessions", type=int, default=1000000)
+    parser.add_argument("--settle-sessions", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--tariff", help="tariff config to price with; defaults to the linear hourly rates")
+    args = parser.parse_args()
+    tariff = load_tariff(args.tariff) if args.tariff else Tariff()
+    print(f"pricing {args.sessions} sessions (numpy {'available' if billing.np is not None else 'not installed'})")
+    for name, elapsed in pricing(args.sessions, tariff).items():
+        print(f"  {name:22s} {elapsed * 1000:8.0f} ms  {args.sessions / elapsed:12.0f} sessions/s")
+    priced, charged, elapsed = settlement(args.settle_sessions, args.users, tariff)
+    print(f"settling {args.settle_sessions} sessions for {args.users} accounts: {elapsed * 1000:.0f} ms")
+    print(f"  fees {priced * 1000:6.0f} ms  debits + exit journal {charged * 1000:6.0f} ms  "
+          f"vacating spots {(elapsed - priced - charged) * 1000:6.0f} ms")
+
+if __name__ == "__main__":
+    main()
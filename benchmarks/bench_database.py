@@ -0,0 +1,71 @@
+# bench_database.py - concurrent get_user/update_balance throughput
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "easyPark"))
+from database import Database
+
+CONFIGS = {
+    # one connection shared under a lock with SQLite's default journaling, like the original Database
+    "legacy": dict(pool_size=1, journal_mode="DELETE", synchronous="FULL"),
+    "pooled": dict(pool_size=8, journal_mode="WAL", synchronous="NORMAL"),
+}
+
+def populate(db, users):
+    with db.connection() as conn, conn:
+        conn.executemany("INSERT INTO users (username, password_hash, balance) VALUES (?, ?, ?)",
+                         [(u, "x", 100.0) for u in users])
+
+def worker(db, users, seed, write_ratio, deadline, counts, errors):
+    rng = random.Random(seed)
+    done = 0
+    while time.perf_counter() < deadline:
+        username = users[rng.randrange(len(users))]
+        try:
+            if rng.random() < write_ratio:
+                db.update_balance(username, rng.random() * 100)
+            else:
+                db.get_user(username)
+            done += 1
+        except Exception as e:
+            errors.append(repr(e))
+    counts.append(done)
+
+def run(name, threads, seconds, write_ratio, num_users):
+    tmp = tempfile.mkdtemp()
+    try:
+        db = Database(os.path.join(tmp, "bench.db"), **CONFIGS[name])
+        users = [f"user{i}" for i in range(num_users)]
+        populate(db, users)
+        counts, errors = [], []
+        deadline = time.perf_counter() + seconds
+        pool = [threading.Thread(target=worker, args=(db, users, seed, write_ratio, deadline, counts, errors))
+                for seed in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        db.close()
+        return sum(counts) / seconds, len(errors)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent Database access")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    parser.add_argument("--users", type=int, default=10000)
+    args = parser.parse_args()
+    for name in CONFIGS:
+        ops, errors = run(name, args.threads, args.seconds, args.write_ratio, args.users)
+        print(f"{name:8s} {args.threads} threads, {args.write_ratio:.0%} writes: {ops:9.0f} ops/s  errors {errors}")
+
+if __name__ == "__main__":
+    main()
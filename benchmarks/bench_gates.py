@@ -0,0 +1,224 @@
+# bench_gates.py - entry gates claiming spots from many threads: throughput and double allocations
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "easyPark"))
+from database import Database
+from errors import DuplicatePlateError, ParkingError, SpotUnavailableError
+from parking_engine import ParkingEngine
+from parking_spot import ParkingLot
+from passwords import PasswordHasher
+from topology import load_topology
+from user import User
+from vehicle import Vehicle
+
+def claim_any(lot, vehicle, user):
+    spot = lot.claim_any(vehicle, 1, user)
+    return spot.id if spot is not None else None
+
+def check_then_act(lot, vehicle, user):
+    # how gates picked a spot before claim_any: look for a free spot, then take it
+    spot = lot.first_available_spot(vehicle.type)
+    if spot is None:
+        return None
+    spot_id = spot.id
+    lot.occupy_spot(spot_id, vehicle, 1, user)
+    return spot_id
+
+STRATEGIES = {"claim_any": claim_any, "check-then-act": check_then_act}
+
+def lot_gate(lot, claim, user, seed, hold, deadline, results):
+    # each gate keeps up to `hold` vehicles parked, letting a random one out to make room
+    rng = random.Random(seed)
+    held, claims, n = [], 0, 0
+    while time.perf_counter() < deadline:
+        if len(held) >= hold:
+            lot.vacate_spot(held.pop(rng.randrange(len(held))))
+        spot_id = claim(lot, Vehicle("car", f"{user.username}X{n}"), user)
+        n += 1
+        if spot_id is not None:
+            held.append(spot_id)
+            claims += 1
+    results.append((user, held, claims))
+
+def engine_gate(engine, user, seed, hold, deadline, results):
+    # the same loop through the engine: every park and exit is journaled and every exit debited
+    rng = random.Random(seed)
+    held, claims, n = [], 0, 0
+    while time.perf_counter() < deadline:
+        if len(held) >= hold:
+            engine.exit_and_charge(user, held.pop(rng.randrange(len(held))))
+        try:
+            spot = engine.park_any(user, "car", f"{user.username}X{n}", 1)
+        except SpotUnavailableError:
+            spot = None
+        n += 1
+        if spot is not None:
+            held.append(spot.id)
+            claims += 1
+    results.append((user, held, claims))
+
+def double_allocations(lot, results):
+    # a spot a gate believes it holds but the lot shows someone else (or no one) parked in
+    return sum(not lot.is_owner(spot_id, user.username) for user, held, _ in results for spot_id in held)
+
+def run_threads(target, args_for, gates, seconds):
+    results = []
+    deadline = time.perf_counter() + seconds
+    pool = [threading.Thread(target=target, args=args_for(g) + (deadline, results)) for g in range(gates)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return results
+
+def make_lot(args):
+    return load_topology(args.topology) if args.topology else ParkingLot(args.spots)
+
+def run_lot(args, strategy, gates):
+    lot = make_lot(args)
+    claim = STRATEGIES[strategy]
+    results = run_threads(lot_gate, lambda g: (lot, claim, User(f"gate{g}", None), g, args.hold),
+                          gates, args.seconds)
+    return sum(claims for _, _, claims in results) / args.seconds, double_allocations(lot, results)
+
+def make_engine(args, tmp, gates, users):
+    db = Database(os.path.join(tmp, "gates.db"), pool_size=gates + 2, group_commit=True)
+    with db.connection() as conn, conn:
+        conn.executemany("INSERT INTO users (username, password_hash, balance) VALUES (?, ?, ?)",
+                         [(u, "x", 1e9) for u in users])
+    return ParkingEngine(make_lot(args), db, hasher=PasswordHasher("pbkdf2_sha256", 1))
+
+def run_engine(args, gates):
+    tmp = tempfile.mkdtemp()
+    try:
+        users = [f"gate{g}" for g in range(gates)]
+        engine = make_engine(args, tmp, gates, users)
+        results = run_threads(engine_gate, lambda g: (engine, engine.db.get_user(users[g]), g, args.hold),
+                              gates, args.seconds)
+        engine.db.close()
+        return sum(claims for _, _, claims in results) / args.seconds, double_allocations(engine.parking_lot, results)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def race(gates, attempt):
+    # every gate runs attempt(g) at the same moment; returns what each returned
+    barrier, results = threading.Barrier(gates), [None] * gates
+    def gate(g):
+        barrier.wait()
+        results[g] = attempt(g)
+    pool = [threading.Thread(target=gate, args=(g,)) for g in range(gates)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return results
+
+def run_exit_race(args, gates):
+    # one driver's vehicles exited from every gate at once, with the last gate settling them all in a
+    # checkout batch as enforce() does: each vehicle must be charged exactly once. Returns
+    # (rounds, vehicles exited more than once, balance debited beyond the fees the exits returned)
+    tmp = tempfile.mkdtemp()
+    try:
+        engine = make_engine(args, tmp, gates, ["driver"])
+        db, lot = engine.db, engine.parking_lot
+        user = db.get_user("driver")
+        rounds, doubles, overcharge, n = 0, 0, 0.0, 0
+        deadline = time.perf_counter() + args.seconds
+        while time.perf_counter() < deadline:
+            spot_ids = []
+            for _ in range(args.racers):
+                spot_ids.append(engine.park_any(user, "car", f"R{n}", 1).id)
+                n += 1
+            before = db.get_user("driver").balance
+
+            def attempt(g):
+                # (spot ids this gate exited, amount it charged for them)
+                if g == gates - 1:
+                    exited, charged, _ = engine.checkout_batch([lot.index_of(spot_id) for spot_id in spot_ids])
+                    return exited, charged
+                exited, charged = [], 0.0
+                for spot_id in spot_ids:
+                    try:
+                        charged += engine.exit_and_charge(user, spot_id)
+                        exited.append(spot_id)
+                    except ParkingError:
+                        pass
+                return exited, charged
+            results = race(gates, attempt)
+            exited = [spot_id for gate_exits, _ in results for spot_id in gate_exits]
+            doubles += len(exited) - len(set(exited))
+            overcharge += before - db.get_user("driver").balance - sum(charged for _, charged in results)
+            rounds += 1
+        db.close()
+        return rounds, doubles, overcharge
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def run_plate_race(args, gates):
+    # every gate parks the same plate at once, half by spot and half anywhere; returns (rounds, plates parked
+    # more than once)
+    tmp = tempfile.mkdtemp()
+    try:
+        users = [f"gate{g}" for g in range(gates)]
+        engine = make_engine(args, tmp, gates, users)
+        gate_users = [engine.db.get_user(u) for u in users]
+        lot = engine.parking_lot
+        rounds, duplicates = 0, 0
+        deadline = time.perf_counter() + args.seconds
+        while time.perf_counter() < deadline:
+            plate, free = f"DUP{rounds}", lot.free_spot_ids(gates)
+
+            def attempt(g):
+                try:
+                    if g % 2:
+                        return engine.park(gate_users[g], free[g], "car", plate, 1).id
+                    return engine.park_any(gate_users[g], "car", plate, 1).id
+                except (DuplicatePlateError, SpotUnavailableError):
+                    return None
+            parked = [spot_id for spot_id in race(gates, attempt) if spot_id is not None]
+            duplicates += max(len(parked) - 1, 0)
+            for spot_id in parked:
+                lot.vacate_spot(spot_id)
+            rounds += 1
+        engine.db.close()
+        return rounds, duplicates
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress concurrent spot allocation from many gate threads")
+    parser.add_argument("--gates", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--seconds", type=float, default=2)
+    parser.add_argument("--spots", type=int, default=10000)
+    parser.add_argument("--hold", type=int, default=100, help="vehicles each gate keeps parked")
+    parser.add_argument("--racers", type=int, default=20, help="vehicles exited at once in the exit race")
+    parser.add_argument("--topology", help="claim across the zones of a site/level/zone layout (JSON)")
+    parser.add_argument("--switch-interval", type=float,
+                        help="thread switch interval in seconds; small values make races show up sooner")
+    args = parser.parse_args()
+    if args.switch_interval:
+        sys.setswitchinterval(args.switch_interval)
+    lot = make_lot(args)
+    print(f"{lot.num_spots} spots, {args.hold} vehicles held per gate, {args.seconds:g} s per run")
+    for gates in args.gates:
+        for strategy in STRATEGIES:
+            rate, doubles = run_lot(args, strategy, gates)
+            print(f"{gates:3d} gates  lot, {strategy:15s} {rate:10.0f} claims/s  double allocations: {doubles}")
+        rate, doubles = run_engine(args, gates)
+        print(f"{gates:3d} gates  engine park/exit     {rate:10.0f} parks/s   double allocations: {doubles}")
+        if gates > 1:
+            rounds, doubles, overcharge = run_exit_race(args, gates)
+            print(f"{gates:3d} gates  same-vehicle exits   {rounds:10d} rounds    charged twice: {doubles}"
+                  f"  overcharge: {overcharge:.2f}")
+            rounds, duplicates = run_plate_race(args, gates)
+            print(f"{gates:3d} gates  same-plate parks     {rounds:10d} rounds    duplicate plates: {duplicates}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# bench_group_commit.py - durable balance writes per second with and without group commit
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "easyPark"))
+from database import Database
+
+CONFIGS = {
+    # every config below acknowledges a write only once it is fsynced
+    "per-call commit, FULL": dict(synchronous="FULL"),
+    "group commit": dict(group_commit=True),
+    "group commit, 2ms linger": dict(group_commit=True, group_commit_interval=0.002),
+}
+
+def writer(db, users, seed, deadline, counts):
+    rng = random.Random(seed)
+    done = 0
+    while time.perf_counter() < deadline:
+        db.update_balance(users[rng.randrange(len(users))], rng.random() * 100)
+        done += 1
+    counts.append(done)
+
+def run(config, threads, seconds, num_users):
+    tmp = tempfile.mkdtemp()
+    try:
+        db = Database(os.path.join(tmp, "bench.db"), pool_size=threads, **config)
+        users = [f"user{i}" for i in range(num_users)]
+        with db.connection() as conn, conn:
+            conn.executemany("INSERT INTO users (username, password_hash, balance) VALUES (?, ?, ?)",
+                             [(u, "x", 100.0) for u in users])
+        counts = []
+        deadline = time.perf_counter() + seconds
+        pool = [threading.Thread(target=writer, args=(db, users, seed, deadline, counts)) for seed in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        db.close()
+        return sum(counts) / seconds
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark group commit of balance writes")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 64])
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--users", type=int, default=10000)
+    args = parser.parse_args()
+    for threads in args.threads:
+        for name, config in CONFIGS.items():
+            print(f"{threads:3d} writers  {name:24s} {run(config, threads, args.seconds, args.users):9.0f} tx/s")
+
+if __name__ == "__main__":
+    main()
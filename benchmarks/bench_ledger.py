@@ -0,0 +1,100 @@
+# bench_ledger.py - append rate of the event ledger and restart time with and without snapshots
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "easyPark"))
+import ledger
+from ledger import CHARGE, EXIT, PARK, TOP_UP, Ledger
+
+def workload(num_events, num_users, num_spots, seed):
+    # top-ups, then parks and exits (each exit a charge plus the exit) cycling through the spots
+    rng = random.Random(seed)
+    users = [f"user{i}" for i in range(num_users)]
+    spots = [f"A{i+1}" for i in range(num_spots)]
+    parked = {}
+    now = 1.7e9
+    n = 0
+    while n < num_events:
+        now += rng.random()
+        spot = spots[rng.randrange(num_spots)]
+        if rng.random() < 0.1:
+            yield (TOP_UP, now, users[rng.randrange(num_users)], None, None, ("GCash", "Card")[n & 1], 100.0)
+            n += 1
+        elif spot in parked:
+            user = parked.pop(spot)
+            yield (CHARGE, now, user, spot, None, None, rng.random() * 20)
+            yield (EXIT, now, user, spot, None, None, 0.0)
+            n += 2
+        else:
+            user = parked[spot] = users[rng.randrange(num_users)]
+            yield (PARK, now, user, spot, f"P{rng.randrange(1000000)}", ("car", "motorcycle")[n & 1], 2.0)
+            n += 1
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the event ledger")
+    parser.add_argument("--events", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--spots", type=int, default=10_000)
+    parser.add_argument("--synced", type=int, default=2_000, help="events appended one call at a time, fsynced")
+    parser.add_argument("--single", type=int, default=100_000, help="events appended one call at a time")
+    parser.add_argument("--batch", type=int, default=10_000, help="events per call for the rest")
+    parser.add_argument("--snapshot-interval", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, "ledger.bin")
+        log = Ledger(path, snapshot_interval=args.snapshot_interval)
+        events = workload(args.events, args.users, args.spots, args.seed)
+        start = time.perf_counter()
+        for _ in range(args.synced):
+            log.record(*next(events))
+        synced = time.perf_counter() - start
+        # the rest as a bulk load, without an fsync per call
+        log.sync = False
+        start = time.perf_counter()
+        for _ in range(args.single):
+            log.record(*next(events))
+        single = time.perf_counter() - start
+        batch = []
+        start = time.perf_counter()
+        for event in events:
+            batch.append(event)
+            if len(batch) == args.batch:
+                log.record_many(batch)
+                batch = []
+        log.record_many(batch)
+        batched = time.perf_counter() - start
+        log.close()
+        count, size = log.count, os.path.getsize(path)
+        print(f"{count} events, {size / count:.0f} bytes/event, {size / 2**20:.0f} MiB "
+              f"(+{os.path.getsize(path + '.strings') / 2**20:.0f} MiB string table); "
+              f"numpy {'on' if ledger.np is not None else 'off'}")
+        print(f"  append, one per call     {args.synced / synced:10.0f} events/s fsynced")
+        print(f"  append, one per call     {args.single / single:10.0f} events/s")
+        print(f"  append, {args.batch} per call {(count - args.synced - args.single) / batched:10.0f} events/s")
+        restarted, elapsed = timed(lambda: Ledger(path))
+        print(f"  restart from snapshot    {elapsed:8.2f} s  ({count - restarted.snapshot_count} events replayed)")
+        restarted.close()
+        os.remove(path + ".snapshot")
+        replayed, elapsed = timed(lambda: Ledger(path, snapshot_interval=0))
+        print(f"  full replay              {elapsed:8.2f} s  ({count / elapsed:.0f} events/s)")
+        replayed.close()
+        balances_match = all(abs(replayed.balances[u] - b) < 1e-6 for u, b in log.balances.items())
+        print(f"  replayed state matches the live state: "
+              f"{balances_match and len(replayed.balances) == len(log.balances) and replayed.sessions == log.sessions}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
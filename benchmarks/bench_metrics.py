@@ -0,0 +1,86 @@
+# bench_metrics.py - cost of the instrumentation on a gate transaction (log in, park, exit)
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "easyPark"))
+import metrics
+from database import Database
+from parking_engine import ParkingEngine
+from parking_spot import ParkingLot
+from passwords import PasswordHasher
+
+def transactions(engine, count, offset):
+    # a driver checking in and out at a gate: the re-login hits the verified-password cache
+    for k in range(count):
+        user = engine.authenticate("driver", "pw")
+        spot = engine.park_any(user, "car", f"P{offset + k}", 1)
+        engine.exit_and_charge(user, spot.id)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark instrumentation overhead")
+    parser.add_argument("--transactions", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=6, help="alternating off/on rounds; medians are reported")
+    parser.add_argument("--synchronous", default="NORMAL", help="SQLite synchronous setting for the temp database")
+    args = parser.parse_args()
+    tmp = tempfile.mkdtemp()
+    try:
+        db = Database(os.path.join(tmp, "metrics.db"), synchronous=args.synchronous)
+        hasher = PasswordHasher("pbkdf2_sha256", 1000)
+        db.add_user("driver", hasher.hash("pw"))
+        db.credit("driver", 1e9)
+        engine = ParkingEngine(ParkingLot(1000), db, hasher=hasher)
+        transactions(engine, 100, 0)  # warm-up
+        times = {False: [], True: []}
+        for r in range(args.rounds):
+            # the second run of a round tends to be slower, so the order swaps every round
+            for on in (False, True) if r % 2 == 0 else (True, False):
+                metrics.enable() if on else metrics.disable()
+                start = time.perf_counter()
+                transactions(engine, args.transactions, (2 * r + on) * args.transactions)
+                times[on].append((time.perf_counter() - start) / args.transactions)
+        off, on = statistics.median(times[False]), statistics.median(times[True])
+        calls = sum(stat["count"] for stat in metrics.summary().values())
+        # the inner calls left unwrapped: count them once with nested timing on
+        per_transaction = calls / (args.transactions * args.rounds)
+        metrics.reset()
+        metrics.enable(nested_calls=True)
+        transactions(engine, 100, 2 * args.rounds * args.transactions)
+        skipped = sum(stat["count"] for stat in metrics.summary().values()) / 100 - per_transaction
+        metrics.enable(nested_calls=False)
+        metrics.disable()
+        print(f"{args.transactions} transactions x {args.rounds} rounds, synchronous={args.synchronous}")
+        print(f"  metrics off  {off * 1e6:9.1f} us/transaction")
+        print(f"  metrics on   {on * 1e6:9.1f} us/transaction  ({(on - off) / off * 100:+.2f}%, "
+              f"{per_transaction:.0f} timed calls per transaction, "
+              f"{skipped:.0f} nested ones not timed)")
+
+        # the wrapper alone, on a method that does nothing
+        class Probe:
+            def noop(self):
+                pass
+        metrics.instrument(Probe, "probe", ("noop",))
+        probe = Probe()
+        per_call = {}
+        for on in (False, True):
+            metrics.enable() if on else metrics.disable()
+            start = time.perf_counter()
+            for _ in range(1_000_000):
+                probe.noop()
+            per_call[on] = (time.perf_counter() - start) / 1_000_000
+            print(f"  empty method, metrics {'on ' if on else 'off'} {per_call[on] * 1e9:7.1f} ns/call")
+        metrics.disable()
+        # the end-to-end delta above is within run-to-run noise on a busy machine; this bound is not
+        wrapper = per_call[True] - per_call[False]
+        print(f"  estimated overhead {per_transaction * wrapper / off * 100:.2f}% "
+              f"({wrapper * 1e9:.0f} ns per timed call)")
+        db.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
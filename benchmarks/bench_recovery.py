@@ -0,0 +1,70 @@
+# bench_recovery.py - cold-start time to rebuild a lot from persisted sessions
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "easyPark"))
+from database import Database, JOURNAL_EXIT, JOURNAL_PARK
+from parking_engine import ParkingEngine
+from parking_spot import ParkingLot
+
+def populate(path, num_spots, sessions, num_users, journal_fraction, seed=0):
+    # checkpoint most sessions, leave the rest (plus churn) in the journal like a crash would
+    rng = random.Random(seed)
+    db = Database(path, checkpoint_interval=0)
+    users = [f"user{i}" for i in range(num_users)]
+    spots = rng.sample(range(num_spots), sessions)
+    split = int(sessions * (1 - journal_fraction))
+    now = time.time()
+    with db.connection() as conn, conn:
+        conn.executemany("INSERT INTO users (username, password_hash, balance) VALUES (?, ?, ?)",
+                         [(u, "x", 100.0) for u in users])
+        conn.executemany("INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?)",
+                         [(f"A{i+1}", rng.choice(users), rng.choice(("car", "motorcycle")), f"P{i}",
+                           now - rng.random() * 36000, rng.randint(1, 24)) for i in spots[:split]])
+        journal = []
+        for i in spots[split:]:
+            journal.append((JOURNAL_PARK, (f"A{i+1}", rng.choice(users), "car", f"P{i}", now, 2)))
+            if rng.random() < 0.2:
+                journal.append((JOURNAL_EXIT, (f"A{i+1}",)))
+                journal.append((JOURNAL_PARK, (f"A{i+1}", rng.choice(users), "car", f"Q{i}", now, 2)))
+        for sql, params in journal:
+            conn.execute(sql, params)
+    db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold-start session recovery")
+    parser.add_argument("--spots", type=int, default=60000)
+    parser.add_argument("--sessions", type=int, default=50000)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--journal-fraction", type=float, default=0.2)
+    args = parser.parse_args()
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, "recovery.db")
+        populate(path, args.spots, args.sessions, args.users, args.journal_fraction)
+        start = time.perf_counter()
+        db = Database(path)
+        lot = ParkingLot(args.spots)
+        engine = ParkingEngine(lot, db)
+        opened = time.perf_counter()
+        sessions = db.load_sessions()
+        loaded = time.perf_counter()
+        db.load_sessions = lambda: sessions
+        restored = engine.restore_sessions()
+        total = time.perf_counter() - start
+        print(f"restored {restored} sessions into a {args.spots}-spot lot in {total * 1000:.0f} ms")
+        print(f"  open db + lot {(opened - start) * 1000:6.0f} ms")
+        print(f"  load + replay {(loaded - opened) * 1000:6.0f} ms")
+        print(f"  occupy + checkpoint {(total - (loaded - start)) * 1000:6.0f} ms")
+        assert restored == args.sessions, restored
+        db.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
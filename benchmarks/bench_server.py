@@ -0,0 +1,117 @@
+# bench_server.py - keep-alive load generator for the gate API in easyPark/server.py
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+EASYPARK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "easyPark")
+sys.path.insert(0, EASYPARK)
+from parking_engine import hash_password
+
+def request_bytes(method, path, payload=None):
+    body = json.dumps(payload).encode() if payload is not None else b""
+    return b"%s %s HTTP/1.1\r\nHost: bench\r\nContent-Length: %d\r\n\r\n%s" % (
+        method.encode(), path.encode(), len(body), body)
+
+async def read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = 0
+    for line in head.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":", 1)[1])
+    body = await reader.readexactly(length)
+    return int(head.split(b" ", 2)[1]), body
+
+async def client(host, port, requests, deadline, latencies, statuses):
+    # requests is this connection's own sequence, replayed in a loop
+    reader, writer = await asyncio.open_connection(host, port)
+    i = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        writer.write(requests[i % len(requests)])
+        status, _ = await read_response(reader)
+        latencies.append(time.perf_counter() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+        i += 1
+    writer.close()
+
+async def run_load(host, port, sequences, connections, seconds):
+    latencies, statuses = [], {}
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, sequences[k % len(sequences)], deadline, latencies, statuses)
+                           for k in range(connections)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "statuses": statuses,
+    }
+
+def workloads(users):
+    # one request sequence per user; connection k replays sequence k
+    credentials = [{"username": u, "password": "pw"} for u in users]
+    return {
+        "quote": [[request_bytes("GET", "/quote?vehicle_type=car&duration=2")]],
+        "spots": [[request_bytes("GET", "/spots")]],
+        "balance": [[request_bytes("POST", "/balance", c)] for c in credentials],
+        "topup": [[request_bytes("POST", "/topup", dict(c, amount=1, method="Card"))] for c in credentials],
+        "park_exit": [[
+            request_bytes("POST", "/park", dict(c, spot_id=f"A{i+1}", license_plate=f"B{i}", duration=1)),
+            request_bytes("POST", "/exit", dict(c, spot_id=f"A{i+1}"))] for i, c in enumerate(credentials)],
+    }
+
+async def wait_for_port(host, port, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the EasyPark gate API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, "bench.db")
+    users = [f"user{i}" for i in range(args.users)]
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE users (username TEXT PRIMARY KEY, password_hash TEXT, balance REAL)")
+    conn.executemany("INSERT INTO users VALUES (?, ?, ?)", [(u, hash_password("pw"), 1e9) for u in users])
+    conn.commit()
+    conn.close()
+
+    server = subprocess.Popen([sys.executable, os.path.join(EASYPARK, "server.py"), "--port", str(args.port),
+                               "--spots", str(max(args.users, 10)), "--db", db_path],
+                              stdout=subprocess.DEVNULL, cwd=EASYPARK)
+    try:
+        asyncio.run(wait_for_port("127.0.0.1", args.port))
+        for name, sequences in workloads(users).items():
+            result = asyncio.run(run_load("127.0.0.1", args.port, sequences, args.connections, args.seconds))
+            print(f"{name:10s} {result['rps']:9.0f} req/s  p50 {result['p50_ms']:6.2f} ms  "
+                  f"p99 {result['p99_ms']:6.2f} ms  {result['statuses']}")
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
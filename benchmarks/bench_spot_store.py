@@ -0,0 +1,85 @@
+# bench_spot_store.py - memory and scan speed of the array-backed ParkingLot
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from itertools import compress
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "easyPark"))
+from parking_spot import ParkingLot
+from user import User
+from vehicle import Vehicle
+
+class LegacyParkingSpot:
+    # the per-object spot the array store replaced
+    def __init__(self, id):
+        self.id = id
+        self.is_occupied = False
+        self.vehicle = None
+        self.start_time = None
+        self.duration = None
+        self.user = None
+
+def build_legacy(n, users):
+    spots = [LegacyParkingSpot(f"A{i+1}") for i in range(n)]
+    for i in range(0, n, 2):
+        spot = spots[i]
+        spot.is_occupied = True
+        spot.vehicle = Vehicle("car", f"P{i}")
+        spot.start_time = datetime.now()
+        spot.duration = 2
+        spot.user = users[i % len(users)]
+    return spots
+
+def build_lot(n, users):
+    lot = ParkingLot(n)
+    for i in range(0, n, 2):
+        lot.occupy_spot(f"A{i+1}", Vehicle("car", f"P{i}"), 2, users[i % len(users)])
+    return lot
+
+def measure(build, n, users):
+    tracemalloc.start()
+    start = time.perf_counter()
+    store = build(n, users)
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return store, size, elapsed
+
+def best_of(fn, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main(n=1_000_000):
+    users = [User(f"user{i}", "x") for i in range(1000)]
+    legacy, legacy_bytes, legacy_build = measure(build_legacy, n, users)
+    lot, lot_bytes, lot_build = measure(build_lot, n, users)
+    print(f"spots: {n}")
+    empty_bytes = measure(lambda n, users: ParkingLot(n), n, users)[1]
+    print(f"memory  empty array store {empty_bytes / 2**20:8.1f} MiB")
+    print(f"memory  legacy {legacy_bytes / 2**20:8.1f} MiB   array store {lot_bytes / 2**20:8.1f} MiB")
+    print(f"build   legacy {legacy_build:8.3f} s     array store {lot_build:8.3f} s")
+    legacy_scan = best_of(lambda: sum(1 for spot in legacy if not spot.is_occupied))
+    lot_scan = best_of(lambda: lot.occupied.count(0))
+    print(f"count free       legacy {legacy_scan * 1000:8.1f} ms  array store {lot_scan * 1000:8.3f} ms")
+    legacy_scan = best_of(lambda: [spot for spot in legacy if not spot.is_occupied])
+    lot_scan = best_of(lot.free_positions)
+    print(f"list free spots  legacy {legacy_scan * 1000:8.1f} ms  array store {lot_scan * 1000:8.1f} ms")
+    legacy_scan = best_of(lambda: [spot.id for spot in legacy if not spot.is_occupied])
+    lot_scan = best_of(lot.free_spot_ids)
+    print(f"list free ids    legacy {legacy_scan * 1000:8.1f} ms  array store {lot_scan * 1000:8.1f} ms")
+    legacy_scan = best_of(lambda: [spot.id for spot in legacy if not spot.is_occupied][:50])
+    lot_scan = best_of(lambda: lot.free_spot_ids(50))
+    print(f"first 50 free    legacy {legacy_scan * 1000:8.1f} ms  array store {lot_scan * 1000:8.3f} ms")
+    legacy_scan = best_of(lambda: sum(1 for spot in legacy if spot.is_occupied and spot.duration > 1))
+    # bulk filters read the arrays through the occupancy map instead of position by position
+    lot_scan = best_of(lambda: sum(1 for duration in compress(lot.durations, lot.occupied) if duration > 1))
+    print(f"overstay filter  legacy {legacy_scan * 1000:8.1f} ms  array store {lot_scan * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,84 @@
+# bench_startup.py - import time of the model modules and the GUI's time to first window, each in a fresh
+# interpreter. The window needs a display; without one only the import times are reported.
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+EASYPARK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "easyPark")
+MODULES = ["parking_spot", "database", "parking_engine", "topology", "ledger", "simulator", "parking_system"]
+
+IMPORT = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start, "tkinter" in sys.modules, "numpy" in sys.modules)
+"""
+
+# times from interpreter start: the window mapped, and the deferred start-up (engine, database, restore) done
+WINDOW = """
+import json, time
+start = time.perf_counter()
+import tkinter
+from parking_system import ParkingSystem
+try:
+    app = ParkingSystem(num_spots={spots}, db_path={db_path!r})
+except tkinter.TclError as e:
+    print(json.dumps({{"skipped": str(e)}}))
+    raise SystemExit
+marks = {{"constructed": time.perf_counter() - start}}
+app.bind("<Map>", lambda event: marks.setdefault("window", time.perf_counter() - start), add="+")
+while app.engine is None or "window" not in marks:
+    app.update()
+marks["ready"] = time.perf_counter() - start
+app.destroy()
+print(json.dumps(marks))
+"""
+
+def run(code):
+    return subprocess.run([sys.executable, "-c", code], cwd=EASYPARK, capture_output=True, text=True,
+                          check=True).stdout
+
+def seed_sessions(path, spots, sessions):
+    # parked vehicles for the restore at start-up
+    sys.path.insert(0, EASYPARK)
+    from database import Database
+    db = Database(path)
+    for i in range(min(sessions, spots)):
+        db.record_park(f"A{i + 1}", f"user{i % 100}", "car", f"P{i}", 1.7e9, 1)
+    db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark start-up")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per measurement; medians are reported")
+    parser.add_argument("--spots", type=int, default=10_000)
+    parser.add_argument("--sessions", type=int, default=5_000, help="parked vehicles restored at start-up")
+    args = parser.parse_args()
+
+    print(f"import time, median of {args.repeat} fresh interpreters")
+    for module in MODULES:
+        results = [run(IMPORT.format(module=module)).split() for _ in range(args.repeat)]
+        seconds = statistics.median(float(r[0]) for r in results)
+        print(f"  {module:16s} {seconds * 1000:7.1f} ms  tkinter {'loaded' if results[0][1] == 'True' else 'not loaded'}"
+              f", numpy {'loaded' if results[0][2] == 'True' else 'not loaded'}")
+
+    tmp = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(tmp, "startup.db")
+        seed_sessions(db_path, args.spots, args.sessions)
+        runs = [json.loads(run(WINDOW.format(spots=args.spots, db_path=db_path))) for _ in range(args.repeat)]
+        if "skipped" in runs[0]:
+            print(f"time to first window: skipped ({runs[0]['skipped']})")
+            return
+        print(f"time to first window, {args.spots} spots, {min(args.sessions, args.spots)} restored sessions")
+        for mark in ("constructed", "window", "ready"):
+            print(f"  {mark:16s} {statistics.median(r[mark] for r in runs) * 1000:7.1f} ms")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
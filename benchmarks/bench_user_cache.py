@@ -0,0 +1,79 @@
+# bench_user_cache.py - the lookup-heavy login path with and without the user cache
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "easyPark"))
+from database import Database
+from parking_engine import ParkingEngine
+from parking_spot import ParkingLot
+from passwords import PasswordHasher
+
+def populate(path, users):
+    db = Database(path)
+    # a cheap hash so the benchmark measures lookups, not the KDF
+    stored = PasswordHasher("pbkdf2_sha256", 1).hash("pw")
+    with db.connection() as conn, conn:
+        conn.executemany("INSERT INTO users (username, password_hash, balance) VALUES (?, ?, ?)",
+                         [(u, stored, 100.0) for u in users])
+    db.close()
+
+def worker(engine, users, weights, seed, deadline, write_ratio, counts):
+    rng = random.Random(seed)
+    done = 0
+    while time.perf_counter() < deadline:
+        # staff and pass holders log in over and over; a few accounts are far more active than the rest
+        for username in rng.choices(users, cum_weights=weights, k=100):
+            engine.authenticate(username, "pw")
+            engine.db.get_user(username)  # balance display after login
+            if rng.random() < write_ratio:
+                engine.db.credit(username, 1)
+            done += 1
+    counts.append(done)
+
+def run(path, users, weights, cache_size, threads, seconds, write_ratio):
+    db = Database(path, pool_size=threads, user_cache_size=cache_size)
+    engine = ParkingEngine(ParkingLot(10), db, hasher=PasswordHasher("pbkdf2_sha256", 1))
+    counts = []
+    deadline = time.perf_counter() + seconds
+    pool = [threading.Thread(target=worker, args=(engine, users, weights, seed, deadline, write_ratio, counts))
+            for seed in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    stats = db.user_cache.stats()
+    db.close()
+    return sum(counts) / seconds, stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark get_user with and without the user cache")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--cache-size", type=int, default=10000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--write-ratio", type=float, default=0.01)
+    args = parser.parse_args()
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, "users.db")
+        users = [f"user{i}" for i in range(args.users)]
+        populate(path, users)
+        total, weights = 0.0, []
+        for rank in range(1, args.users + 1):  # Zipf-like popularity
+            total += 1 / rank
+            weights.append(total)
+        for name, size in (("no cache", 0), (f"cache {args.cache_size}", args.cache_size)):
+            rate, stats = run(path, users, weights, size, args.threads, args.seconds, args.write_ratio)
+            print(f"{name:12s} {rate:9.0f} logins/s  hit rate {stats['hit_rate']:.1%}  "
+                  f"evictions {stats['evictions']}  invalidations {stats['invalidations']}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
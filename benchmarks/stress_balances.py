@@ -0,0 +1,99 @@
+# stress_balances.py - many processes hammering a few balances; checks nothing is lost
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "easyPark"))
+from database import Database
+
+def atomic_worker(path, users, seed, ops, results):
+    db = Database(path, pool_size=1)
+    rng = random.Random(seed)
+    credited = {u: 0 for u in users}
+    debited = {u: 0 for u in users}
+    for _ in range(ops):
+        username = users[rng.randrange(len(users))]
+        amount = rng.randint(1, 20)
+        if rng.random() < 0.5:
+            db.credit(username, amount)
+            credited[username] += amount
+        elif db.debit_if_sufficient(username, amount) is not None:
+            debited[username] += amount
+    db.close()
+    results.put((credited, debited))
+
+def read_modify_write_worker(path, users, seed, ops, results):
+    # the pattern add_funds/pay_and_exit used before: read, change in Python, write back
+    db = Database(path, pool_size=1)
+    rng = random.Random(seed)
+    credited = {u: 0 for u in users}
+    debited = {u: 0 for u in users}
+    for _ in range(ops):
+        username = users[rng.randrange(len(users))]
+        amount = rng.randint(1, 20)
+        user = db.get_user(username)
+        if rng.random() < 0.5:
+            db.update_balance(username, user.balance + amount)
+            credited[username] += amount
+        elif user.balance >= amount:
+            db.update_balance(username, user.balance - amount)
+            debited[username] += amount
+    db.close()
+    results.put((credited, debited))
+
+WORKERS = {"atomic": atomic_worker, "read-modify-write": read_modify_write_worker}
+
+def run(mode, processes, ops, num_users, initial):
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, "stress.db")
+        db = Database(path)
+        users = [f"user{i}" for i in range(num_users)]
+        for username in users:
+            db.add_user(username, "x")
+            db.update_balance(username, initial)
+        results = multiprocessing.Queue()
+        start = time.perf_counter()
+        workers = [multiprocessing.Process(target=WORKERS[mode], args=(path, users, seed, ops, results))
+                   for seed in range(processes)]
+        for p in workers:
+            p.start()
+        totals = [results.get() for _ in workers]
+        for p in workers:
+            p.join()
+        elapsed = time.perf_counter() - start
+        lost, negative = 0, 0
+        for username in users:
+            expected = initial + sum(c[username] for c, _ in totals) - sum(d[username] for _, d in totals)
+            actual = db.get_user(username).balance
+            lost += abs(actual - expected)
+            negative += actual < 0
+        db.close()
+        return processes * ops / elapsed, lost, negative
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-process balance stress test")
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--initial", type=float, default=50)
+    args = parser.parse_args()
+    failed = False
+    for mode in WORKERS:
+        rate, lost, negative = run(mode, args.processes, args.ops, args.users, args.initial)
+        print(f"{mode:18s} {rate:8.0f} ops/s  balance drift {lost:10.2f}  negative balances {negative}")
+        if mode == "atomic" and (lost or negative):
+            failed = True
+    if failed:
+        print("FAIL: atomic credit/debit lost or corrupted updates")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
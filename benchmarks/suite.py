@@ -0,0 +1,290 @@
+# suite.py - seeded benchmarks for the parking core, database, fees and UI refresh paths.
+# Prints a table and writes JSON; --compare reports each case as a percentage change against a
+# saved run and exits non-zero when any case got slower than --threshold.
+#
+#   python benchmarks/suite.py --output baseline.json
+#   python benchmarks/suite.py --compare baseline.json
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "easyPark"))
+import billing
+from database import Database
+from parking_engine import ParkingEngine
+from parking_spot import ParkingLot
+from passwords import PasswordHasher
+from user import User
+from vehicle import Vehicle
+
+SIZES = [10, 1000, 100_000, 1_000_000]
+OPS = 10_000  # operations per timed run of the spot and database cases
+HASHER = PasswordHasher("pbkdf2_sha256", 1)  # login cost is bench_auth's business, not this suite's
+
+class Skip(Exception):
+    pass
+
+def filled_lot(n, rng, users, fraction=0.5):
+    lot = ParkingLot(n)
+    for i in rng.sample(range(n), int(n * fraction)):
+        lot.occupy_spot(lot.spot_id(i), Vehicle(rng.choice(("car", "motorcycle")), f"P{i}"), 1,
+                        users[i % len(users)], 1.7e9 + rng.random() * 86400)
+    return lot
+
+# each case takes (rng, tmp) and returns (ops per run, run); run() must leave the state as it
+# found it, or at least in an equivalent one, so repeated runs time the same work
+
+def lot_toggle(n):
+    def case(rng, tmp):
+        users = [User(f"user{i}", None) for i in range(100)]
+        lot = filled_lot(n, rng, users)
+        spot_ids = [lot.spot_id(rng.randrange(n)) for _ in range(OPS)]
+        vehicles = [Vehicle("car", f"Q{k}") for k in range(OPS)]
+        def run():
+            # every spot is flipped an even number of times across two runs
+            for spot_id, vehicle in zip(spot_ids, vehicles):
+                if not lot.vacate_spot(spot_id):
+                    lot.try_occupy(spot_id, vehicle, 1, users[0])
+        return OPS, run
+    return case
+
+def lot_lookup(n):
+    def case(rng, tmp):
+        users = [User(f"user{i}", None) for i in range(100)]
+        lot = filled_lot(n, rng, users)
+        probes = [(lot.spot_id(i), f"P{i}", users[i % 100].username) for i in (rng.randrange(n) for _ in range(OPS))]
+        def run():
+            for spot_id, plate, username in probes:
+                lot.get_spot(spot_id)
+                lot.find_plate(plate)
+                lot.is_owner(spot_id, username)
+        return OPS, run
+    return case
+
+def lot_claim(n):
+    def case(rng, tmp):
+        users = [User(f"user{i}", None) for i in range(100)]
+        lot = filled_lot(n, rng, users)
+        vehicle = Vehicle("car", "CLAIM")
+        def run():
+            for _ in range(OPS):
+                spot = lot.claim_any(vehicle, 1, users[0])
+                lot.vacate_spot(spot.id)
+        return OPS, run
+    return case
+
+def lot_build(n):
+    def case(rng, tmp):
+        return 1, lambda: ParkingLot(n)
+    return case
+
+def seeded_db(tmp, rng, num_users=10_000, **kwargs):
+    db = Database(os.path.join(tmp, "suite.db"), **kwargs)
+    users = [f"user{i}" for i in range(num_users)]
+    with db.connection() as conn, conn:
+        conn.executemany("INSERT INTO users (username, password_hash, balance) VALUES (?, ?, ?)",
+                         [(u, HASHER.hash("pw"), rng.random() * 100) for u in users])
+    return db, users
+
+def db_get_user(cached):
+    def case(rng, tmp):
+        db, users = seeded_db(tmp, rng, user_cache_size=10_000 if cached else 0)
+        names = [users[rng.randrange(len(users))] for _ in range(OPS)]
+        def run():
+            for name in names:
+                db.get_user(name)
+        return OPS, run
+    return case
+
+def db_update_balance(rng, tmp):
+    db, users = seeded_db(tmp, rng)
+    updates = [(users[rng.randrange(len(users))], rng.random() * 100) for _ in range(OPS // 10)]
+    def run():
+        for name, balance in updates:
+            db.update_balance(name, balance)
+    return len(updates), run
+
+def db_add_user(rng, tmp):
+    db, _ = seeded_db(tmp, rng)
+    batch = [0]
+    def run():
+        # fresh names every run; the table only grows by OPS // 10 rows per run
+        batch[0] += 1
+        for k in range(OPS // 10):
+            db.add_user(f"new{batch[0]}-{k}", "x")
+    return OPS // 10, run
+
+def fee_engine(rng, tmp, n):
+    users = [User(f"user{i}", None) for i in range(100)]
+    db = Database(os.path.join(tmp, "fees.db"))
+    return ParkingEngine(filled_lot(n, rng, users), db, hasher=HASHER)
+
+def fees_per_spot(rng, tmp):
+    engine = fee_engine(rng, tmp, 100_000)
+    spots = [engine.parking_lot.spots[i] for i in engine.parking_lot.occupied_positions()[:OPS]]
+    now = 1.7e9 + 2 * 86400
+    def run():
+        for spot in spots:
+            engine.fee_for(spot, now)
+    return len(spots), run
+
+def fees_batch(rng, tmp):
+    engine = fee_engine(rng, tmp, 1_000_000)
+    now = 1.7e9 + 2 * 86400
+    return engine.parking_lot.num_spots - engine.parking_lot.free_count, lambda: engine.batch_fees(now=now)
+
+def fees_quote(rng, tmp):
+    engine = fee_engine(rng, tmp, 10)
+    requests = [(rng.choice(("car", "motorcycle")), rng.randrange(1, 25)) for _ in range(OPS)]
+    def run():
+        for vehicle_type, hours in requests:
+            engine.quote(vehicle_type, hours)
+    return OPS, run
+
+def ui_app(tmp, n, rng):
+    # needs a display: a real one, or Xvfb through pyvirtualdisplay when that is installed
+    import tkinter
+    try:
+        tkinter.Tk().destroy()
+    except tkinter.TclError:
+        try:
+            from pyvirtualdisplay import Display
+        except ImportError:
+            raise Skip("no display and pyvirtualdisplay is not installed")
+        Display(visible=False, size=(1024, 768)).start()
+    from parking_system import ParkingSystem
+    app = ParkingSystem(num_spots=n, db_path=os.path.join(tmp, f"ui{n}.db"))
+    app.wait_visibility()
+    app.update()  # the lot and engine come up after the first paint
+    for tab in app.notebook.tabs():
+        app.build_tab(tab)
+    app.current_user = User("user0", None)
+    users = [app.current_user] + [User(f"user{i}", None) for i in range(1, 100)]
+    for i in rng.sample(range(n), n // 2):
+        app.parking_lot.occupy_spot(app.parking_lot.spot_id(i), Vehicle("car", f"P{i}"), 1, users[i % 100])
+    app.update()
+    return app
+
+def ui_watch_list(n):
+    def case(rng, tmp):
+        app = ui_app(tmp, n, rng)
+        rows = max(1, n - 20)
+        offsets = [rng.randrange(rows) for _ in range(100)]
+        def run():
+            for offset in offsets:
+                app.watch_offset = offset
+                app.update_watch_list()
+                app.update_idletasks()
+        return len(offsets), run
+    return case
+
+def ui_comboboxes(n):
+    def case(rng, tmp):
+        app = ui_app(tmp, n, rng)
+        def run():
+            for _ in range(100):
+                app.update_available_spots()
+                app.fill_available_spots()
+                app.update_exit_spots()
+                app.fill_exit_spots()
+                app.update_idletasks()
+        return 100, run
+    return case
+
+def cases(sizes):
+    registry = {}
+    for n in sizes:
+        registry[f"lot/toggle/{n}"] = lot_toggle(n)
+        registry[f"lot/lookup/{n}"] = lot_lookup(n)
+        registry[f"lot/claim_any/{n}"] = lot_claim(n)
+        registry[f"lot/build/{n}"] = lot_build(n)
+    registry["db/get_user/cached"] = db_get_user(True)
+    registry["db/get_user/uncached"] = db_get_user(False)
+    registry["db/update_balance"] = db_update_balance
+    registry["db/add_user"] = db_add_user
+    registry["fees/quote"] = fees_quote
+    registry["fees/fee_for"] = fees_per_spot
+    registry["fees/batch/1000000"] = fees_batch
+    for n in sizes:
+        registry[f"ui/update_watch_list/{n}"] = ui_watch_list(n)
+        registry[f"ui/comboboxes/{n}"] = ui_comboboxes(n)
+    return registry
+
+def run_case(case, seed, repeat):
+    tmp = tempfile.mkdtemp()
+    try:
+        ops, run = case(random.Random(seed), tmp)
+        run()  # warm-up
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        seconds = statistics.median(times)
+        return {"ops": ops, "seconds": seconds, "us_per_op": seconds / ops * 1e6, "ops_per_s": ops / seconds,
+                "min_seconds": min(times)}
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def compare(results, baseline, threshold):
+    # positive deltas are slowdowns (more time per op than the baseline)
+    regressions = []
+    print(f"\n{'case':34s} {'baseline us/op':>15s} {'now us/op':>12s} {'delta':>9s}")
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if base is None or "us_per_op" not in base or "us_per_op" not in result:
+            continue
+        delta = (result["us_per_op"] - base["us_per_op"]) / base["us_per_op"] * 100
+        flag = ""
+        if delta > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:34s} {base['us_per_op']:15.3f} {result['us_per_op']:12.3f} {delta:+8.1f}%{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="EasyPark benchmark suite")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="lot sizes for the spot and UI cases")
+    parser.add_argument("--only", nargs="+", help="glob patterns of cases to run, e.g. 'lot/*' 'db/*'")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case; the median is reported")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --output")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    results = {}
+    for name, case in cases(args.sizes).items():
+        if args.only and not any(fnmatch.fnmatch(name, pattern) for pattern in args.only):
+            continue
+        try:
+            result = run_case(case, args.seed, args.repeat)
+        except Skip as e:
+            result = {"skipped": str(e)}
+            print(f"{name:34s} skipped: {e}")
+        else:
+            print(f"{name:34s} {result['us_per_op']:12.3f} us/op {result['ops_per_s']:14.0f} ops/s")
+        results[name] = result
+    report = {"python": platform.python_version(), "platform": platform.platform(),
+              "numpy": billing.np is not None, "seed": args.seed, "repeat": args.repeat,
+              "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) slower than the baseline by more than {args.threshold:g}%")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#billing.py
+# fees for many sessions at once; uses NumPy when it is installed and plain arrays otherwise
+from array import array
+from bisect import bisect_right
+from tariff import MINUTES_PER_DAY, SECONDS_PER_DAY
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def compute_fees(tariff, type_names, start_times, type_codes, now, positions=None, zones=None):
+    # start_times: epoch seconds, type_codes: vehicle type code per session, type_names: code -> vehicle
+    # type (code 0 is no vehicle and free); positions optionally picks the sessions to price out of the
+    # full arrays; zones is (zone_starts, zone_names) when zone multipliers should apply
+    if np is not None:
+        return numpy_fees(tariff, type_names, start_times, type_codes, now, positions, zones)
+    if positions is None:
+        positions = range(len(start_times))
+    grace, utc_offset = tariff.grace, tariff.utc_offset
+    day1, second1 = divmod(now + utc_offset, SECONDS_PER_DAY)
+    # per type code: the vehicle tariff plus everything about "now" that every session shares
+    flat_rates, tables = [], []
+    for vehicle_type in type_names:
+        vehicle = tariff.vehicles.get(vehicle_type) if vehicle_type is not None else None
+        flat_rates.append(vehicle.rate if vehicle is not None and vehicle.flat else None)
+        if vehicle is None or vehicle.flat:
+            tables.append(None)
+            continue
+        day = vehicle.cumulative[MINUTES_PER_DAY]
+        tables.append((vehicle.cumulative, vehicle.rates, vehicle.cap, day, min(day, vehicle.cap),
+                       vehicle.cost_to(second1)))
+    multipliers = None
+    if zones and tariff.zone_multipliers:
+        multipliers = [tariff.zone_multipliers.get(name, 1) for name in zones[1]]
+    fees = array('d', bytes(8 * len(positions)))
+    for k, i in enumerate(positions):
+        code, start = type_codes[i], start_times[i]
+        if now - start <= grace or now <= start:
+            continue
+        rate = flat_rates[code]
+        if rate is not None:
+            fee = rate * (now - start) / 3600
+            if multipliers is not None:
+                fee *= multipliers[bisect_right(zones[0], i) - 1]
+            fees[k] = fee
+        elif tables[code] is not None:
+            cumulative, rates, cap, day, capped_day, cost1 = tables[code]
+            day0, second0 = divmod(start + utc_offset, SECONDS_PER_DAY)
+            m = int(second0 // 60)
+            cost0 = cumulative[m] + rates[m] * (second0 - m * 60)
+            if day0 == day1:
+                fee = round(min(cost1 - cost0, cap) / 3600, 10)
+            else:
+                fee = round((min(day - cost0, cap) + (day1 - day0 - 1) * capped_day + min(cost1, cap)) / 3600, 10)
+            if multipliers is not None:
+                fee *= multipliers[bisect_right(zones[0], i) - 1]
+            fees[k] = fee
+    return fees
+
+def numpy_fees(tariff, type_names, start_times, type_codes, now, positions, zones):
+    starts = np.frombuffer(start_times, dtype=np.float64)
+    codes = np.frombuffer(type_codes, dtype=np.uint8)
+    if positions is not None:
+        positions = np.asarray(positions, dtype=np.intp)
+        starts, codes = starts[positions], codes[positions]
+    vehicles = [tariff.vehicles.get(vehicle_type) if vehicle_type is not None else None for vehicle_type in type_names]
+    flat_rates = np.array([vehicle.rate if vehicle is not None else 0 for vehicle in vehicles], dtype=np.float64)
+    if all(vehicle is None or vehicle.flat for vehicle in vehicles):
+        fees = flat_rates[codes] * (now - starts) / 3600
+    else:
+        # the per-minute tables of every vehicle type stacked into one array, indexed by type code;
+        # everything that only depends on "now" is worked out once per type code
+        rates = np.zeros((len(vehicles), MINUTES_PER_DAY))
+        cumulative = np.zeros((len(vehicles), MINUTES_PER_DAY + 1))
+        caps = np.full(len(vehicles), np.inf)
+        for code, vehicle in enumerate(vehicles):
+            if vehicle is not None:
+                rates[code], cumulative[code], caps[code] = vehicle.rates, vehicle.cumulative, vehicle.cap
+        day1, second1 = divmod(now + tariff.utc_offset, SECONDS_PER_DAY)
+        minute1 = int(second1 // 60)
+        cost1 = cumulative[:, minute1] + rates[:, minute1] * (second1 - minute1 * 60)
+        day = cumulative[:, MINUTES_PER_DAY]
+        to_midnight = np.minimum(cost1, caps)
+        capped_day = np.minimum(day, caps)
+
+        # floor/multiply instead of np.divmod, which is several times slower on floats
+        local = starts + tariff.utc_offset
+        day0 = np.floor(local / SECONDS_PER_DAY)
+        second0 = local - day0 * SECONDS_PER_DAY
+        minute0 = np.minimum((second0 / 60).astype(np.intp), MINUTES_PER_DAY - 1)
+        codes = codes.astype(np.intp)  # gathers with intp indexes are much faster than with uint8
+        flat_index = codes * (MINUTES_PER_DAY + 1) + minute0
+        cost0 = cumulative.ravel()[flat_index] + rates.ravel()[flat_index - codes] * (second0 - minute0 * 60)
+        cap = caps[codes]
+        fees = np.where(day0 == day1, np.minimum(cost1[codes] - cost0, cap),
+                        np.minimum(day[codes] - cost0, cap) + (day1 - day0 - 1) * capped_day[codes]
+                        + to_midnight[codes])
+        fees = np.round(fees / 3600, 10)
+        flat = np.array([vehicle is not None and vehicle.flat for vehicle in vehicles])[codes]
+        fees[flat] = flat_rates[codes[flat]] * (now - starts[flat]) / 3600
+    if zones and tariff.zone_multipliers:
+        zone_starts, zone_names = zones
+        multipliers = np.array([tariff.zone_multipliers.get(name, 1) for name in zone_names], dtype=np.float64)
+        fees *= multipliers[np.searchsorted(zone_starts, positions if positions is not None
+                                            else np.arange(len(starts)), side="right") - 1]
+    fees[(now - starts <= tariff.grace) | (now <= starts)] = 0.0
+    return fees
+
+def totals_by_owner(owner_ids, fees, num_owners):
+    # sums fees per owner id (ids are small interned integers)
+    if np is not None:
+        return np.bincount(np.asarray(owner_ids, dtype=np.intp), weights=fees, minlength=num_owners).tolist()
+    totals = [0.0] * num_owners
+    for owner, fee in zip(owner_ids, fees):
+        totals[owner] += fee
+    return totals
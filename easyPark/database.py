@@ -1,37 +1,465 @@
 # database.py
+import queue
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+import metrics
 from user import User
 
+JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+# statements are kept as constants so each pooled connection's statement cache reuses them
+CREATE_USERS = '''
+        CREATE TABLE IF NOT EXISTS users
+        (username TEXT PRIMARY KEY, password_hash TEXT, balance REAL)
+        '''
+INSERT_USER = 'INSERT INTO users (username, password_hash, balance) VALUES (?, ?, ?)'
+SELECT_USER = 'SELECT * FROM users WHERE username = ?'
+UPDATE_BALANCE = 'UPDATE users SET balance = ? WHERE username = ?'
+UPDATE_PASSWORD = 'UPDATE users SET password_hash = ? WHERE username = ?'
+# single-statement balance changes (RETURNING needs SQLite 3.35+)
+CREDIT = 'UPDATE users SET balance = balance + ? WHERE username = ? RETURNING balance'
+DEBIT = 'UPDATE users SET balance = balance - ? WHERE username = ? AND balance >= ? RETURNING balance'
+
+# active parking sessions: a checkpointed table plus an append-only journal of parks and exits
+CREATE_SESSIONS = '''
+        CREATE TABLE IF NOT EXISTS sessions
+        (spot_id TEXT PRIMARY KEY, username TEXT, vehicle_type TEXT, license_plate TEXT,
+         start_time REAL, duration INTEGER)
+        '''
+CREATE_SESSION_JOURNAL = '''
+        CREATE TABLE IF NOT EXISTS session_journal
+        (seq INTEGER PRIMARY KEY, op TEXT, spot_id TEXT, username TEXT, vehicle_type TEXT,
+         license_plate TEXT, start_time REAL, duration INTEGER)
+        '''
+JOURNAL_PARK = '''INSERT INTO session_journal (op, spot_id, username, vehicle_type, license_plate, start_time, duration)
+                  VALUES ('park', ?, ?, ?, ?, ?, ?)'''
+JOURNAL_EXIT = "INSERT INTO session_journal (op, spot_id) VALUES ('exit', ?)"
+SELECT_SESSIONS = 'SELECT spot_id, username, vehicle_type, license_plate, start_time, duration FROM sessions'
+SELECT_JOURNAL = '''SELECT seq, op, spot_id, username, vehicle_type, license_plate, start_time, duration
+                    FROM session_journal ORDER BY seq'''
+# fold the journal into sessions: the last journal entry per spot wins
+CHECKPOINT_DELETE = 'DELETE FROM sessions WHERE spot_id IN (SELECT spot_id FROM session_journal WHERE seq <= ?)'
+CHECKPOINT_INSERT = '''INSERT INTO sessions (spot_id, username, vehicle_type, license_plate, start_time, duration)
+                       SELECT spot_id, username, vehicle_type, license_plate, start_time, duration
+                       FROM session_journal
+                       WHERE op = 'park' AND seq IN (SELECT MAX(seq) FROM session_journal
+                                                     WHERE seq <= ? GROUP BY spot_id)'''
+CHECKPOINT_TRUNCATE = 'DELETE FROM session_journal WHERE seq <= ?'
+
+def checkpoint(conn):
+    last_seq = conn.execute('SELECT MAX(seq) FROM session_journal').fetchone()[0]
+    if last_seq is not None:
+        conn.execute(CHECKPOINT_DELETE, (last_seq,))
+        conn.execute(CHECKPOINT_INSERT, (last_seq,))
+        conn.execute(CHECKPOINT_TRUNCATE, (last_seq,))
+
+class UserCache:
+    # bounded LRU of user rows with a TTL; the TTL caps staleness from writes made by other processes
+    def __init__(self, capacity=10000, ttl=5.0):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict()  # username -> (row, expiry)
+        self.lock = threading.Lock()
+        self.generation = 0  # bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, username):
+        with self.lock:
+            entry = self.entries.get(username)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self.entries.move_to_end(username)
+                    self.hits += 1
+                    return entry[0]
+                del self.entries[username]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, username, row, generation):
+        # a row read before a concurrent write committed is dropped rather than cached
+        if not self.capacity:
+            return
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[username] = (row, time.monotonic() + self.ttl)
+            self.entries.move_to_end(username)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, username=None):
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            if username is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(username, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self.entries), "capacity": self.capacity, "ttl": self.ttl, "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions, "expirations": self.expirations, "invalidations": self.invalidations}
+
+class PooledConnection:
+    # a pooled connection as handed out by Database.connection(). `with conn:` commits or rolls back
+    # like sqlite3's own; a block nested inside another one on the same connection is a savepoint, so it
+    # never ends the outer transaction halfway through
+    def __init__(self, conn):
+        self.conn = conn
+        self.execute = conn.execute
+        self.executemany = conn.executemany
+        self.depth = 0
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def begin_immediate(self):
+        # takes the write lock up front instead of on the first write; inside an outer transaction
+        # that has already begun this is a no-op
+        if not self.conn.in_transaction:
+            self.conn.execute('BEGIN IMMEDIATE')
+
+    def __enter__(self):
+        self.depth += 1
+        if self.depth > 1:
+            # the savepoint must sit inside a real transaction, or releasing it would commit
+            if not self.conn.in_transaction:
+                self.conn.execute('BEGIN')
+            self.conn.execute(f'SAVEPOINT nested{self.depth}')
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        depth = self.depth
+        self.depth -= 1
+        if depth > 1:
+            if exc_type is not None:
+                self.conn.execute(f'ROLLBACK TO nested{depth}')
+            self.conn.execute(f'RELEASE nested{depth}')
+        elif exc_type is None:
+            self.conn.commit()
+        else:
+            self.conn.rollback()
+        return False
+
 class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect('parking_system.db') #connect to db
+    def __init__(self, path='parking_system.db', pool_size=8, journal_mode='WAL', synchronous='NORMAL',
+                 cached_statements=128, timeout=10.0, group_commit=False, group_commit_size=256,
+                 group_commit_interval=0.0, checkpoint_interval=10000, user_cache_size=10000, user_cache_ttl=5.0):
+        journal_mode, synchronous = journal_mode.upper(), synchronous.upper()
+        if journal_mode not in JOURNAL_MODES:
+            raise ValueError(f"unknown journal_mode: {journal_mode}")
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"unknown synchronous setting: {synchronous}")
+        if group_commit and path == ':memory:':
+            raise ValueError("group commit needs a file database shared by its writer thread")
+        self.path = path
+        self.pool_size = 1 if path == ':memory:' else pool_size  # every :memory: connection is its own database
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self.pool = queue.LifoQueue()
+        self.connections = []
+        self.pool_lock = threading.Lock()
+        self.local = threading.local()
+        self.checkpoint_interval = checkpoint_interval
+        self.journal_appends = 0
+        self.user_cache = UserCache(user_cache_size, user_cache_ttl)
+        self.closed = False
+        self.write_lock = threading.Lock()  # orders submits against close()
         self.create_tables()
+        # group commit: writes from all callers are funnelled to one thread and committed together
+        self.group_commit_size = group_commit_size
+        self.group_commit_interval = group_commit_interval
+        self.write_queue = None
+        self.writer = None
+        if group_commit:
+            self.write_queue = queue.Queue()
+            self.writer = threading.Thread(target=self.group_commit_loop, name="easypark-group-commit", daemon=True)
+            self.writer.start()
+
+    def connect(self, synchronous=None):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.execute(f'PRAGMA journal_mode={self.journal_mode}')
+        conn.execute(f'PRAGMA synchronous={synchronous or self.synchronous}')
+        return conn
+
+    def acquire(self):
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self.pool_lock:
+            if len(self.connections) < self.pool_size:
+                conn = PooledConnection(self.connect())
+                self.connections.append(conn)
+                return conn
+        return self.pool.get(timeout=self.timeout)
+
+    @contextmanager
+    def connection(self):
+        # a thread keeps the connection it checked out until its outermost block ends; `with conn:`
+        # inside a nested block is a savepoint of the outer transaction
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        conn = self.acquire()
+        self.local.conn = conn
+        try:
+            yield conn
+        finally:
+            self.local.conn = None
+            if self.closed:
+                self.discard(conn)
+            else:
+                self.pool.put(conn)
+
+    def discard(self, conn):
+        with self.pool_lock:
+            self.connections.remove(conn)
+        conn.close()
+
+    def submit_write(self, sql, params=()):
+        # returns a Future that resolves to the statement's rows once its batch is committed. sql may also
+        # be a function of a connection, run as one unit (its statements commit together or not at all),
+        # whose return value the Future resolves to
+        future = Future()
+        with self.write_lock:
+            if self.closed:
+                future.set_exception(sqlite3.ProgrammingError("Cannot operate on a closed database."))
+                return future
+            if self.write_queue is not None:
+                self.write_queue.put((sql, params, future))
+                return future
+        try:
+            with self.connection() as conn, conn:
+                if callable(sql):
+                    conn.begin_immediate()
+                    value = sql(conn)
+                else:
+                    value = conn.execute(sql, params).fetchall()
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(value)
+        return future
+
+    def group_commit_loop(self):
+        # synchronous=FULL so a resolved Future really means the batch is on disk
+        conn = self.connect(synchronous='FULL')
+        running = True
+        while running:
+            item = self.write_queue.get()
+            if item is None:
+                break
+            batch = [item]
+            # take whatever queued up behind the last commit; a non-zero interval lingers for more
+            deadline = time.monotonic() + self.group_commit_interval
+            while len(batch) < self.group_commit_size:
+                try:
+                    item = self.write_queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            self.commit_batch(conn, batch)
+        conn.close()
+
+    def commit_batch(self, conn, batch):
+        results = []
+        try:
+            with conn:
+                for sql, params, future in batch:
+                    # SQLite undoes only the failing statement (e.g. a constraint error) and keeps the rest of
+                    # the transaction, so only its caller fails. Errors that end the whole transaction, such
+                    # as a full disk, fail the batch instead
+                    try:
+                        if callable(sql):
+                            results.append((future, True, self.run_unit(conn, sql)))
+                        else:
+                            results.append((future, True, conn.execute(sql, params).fetchall()))
+                    except Exception as e:
+                        if not conn.in_transaction:
+                            raise
+                        results.append((future, False, e))
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for future, ok, value in results:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def run_unit(self, conn, fn):
+        # a unit runs in a savepoint of the batch, so one that fails part way leaves none of its writes behind
+        if not conn.in_transaction:
+            conn.execute('BEGIN')
+        conn.execute('SAVEPOINT unit')
+        try:
+            value = fn(conn)
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK TO unit')
+                conn.execute('RELEASE unit')
+            raise
+        conn.execute('RELEASE unit')
+        return value
+
+    def close(self):
+        # writes already queued are committed; later ones fail instead of waiting for a writer that is gone
+        with self.write_lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.write_queue is not None:
+                self.write_queue.put(None)
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+            # anything the writer never took (it only stops early if its own connection failed)
+            while True:
+                try:
+                    item = self.write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item[2].set_exception(sqlite3.ProgrammingError("Cannot operate on a closed database."))
+        # idle connections are closed now; one still in use is closed by its thread when its block ends,
+        # since closing it under a running statement would crash the interpreter
+        while True:
+            try:
+                conn = self.pool.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(conn)
 
     def create_tables(self):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users
-        (username TEXT PRIMARY KEY, password_hash TEXT, balance REAL)
-        ''')
-        self.conn.commit()
+        with self.connection() as conn, conn:
+            conn.execute(CREATE_USERS)
+            conn.execute(CREATE_SESSIONS)
+            conn.execute(CREATE_SESSION_JOURNAL)
 
     def add_user(self, username, password_hash):
-        cursor = self.conn.cursor()
-        cursor.execute('INSERT INTO users (username, password_hash, balance) VALUES (?, ?, ?)',
-                       (username, password_hash, 0))
-        self.conn.commit()
+        try:
+            with self.connection() as conn, conn:
+                conn.execute(INSERT_USER, (username, password_hash, 0))
+        finally:
+            self.user_cache.invalidate(username)
 
     def get_user(self, username):
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
-        user_data = cursor.fetchone()
+        # rows come from the user cache when fresh; callers always get their own User object
+        user_data = self.user_cache.get(username)
+        if user_data is None:
+            generation = self.user_cache.generation
+            with self.connection() as conn:
+                user_data = conn.execute(SELECT_USER, (username,)).fetchone()
+            if user_data:
+                self.user_cache.put(username, user_data, generation)
         if user_data:
             user = User(user_data[0], user_data[1])
             user.balance = user_data[2]
             return user
         return None
 
+    def submit_user_write(self, username, sql, params):
+        # every write to a user row drops its cache entry, again once the write has committed
+        self.user_cache.invalidate(username)
+        future = self.submit_write(sql, params)
+        future.add_done_callback(lambda _: self.user_cache.invalidate(username))
+        return future
+
+    def update_password(self, username, password_hash):
+        self.submit_user_write(username, UPDATE_PASSWORD, (password_hash, username)).result()
+
+    def submit_balance_update(self, username, new_balance):
+        return self.submit_user_write(username, UPDATE_BALANCE, (new_balance, username))
+
     def update_balance(self, username, new_balance):
-        cursor = self.conn.cursor()
-        cursor.execute('UPDATE users SET balance = ? WHERE username = ?', (new_balance, username))
-        self.conn.commit()
+        # blocks until the change is committed; under group commit that is its batch's commit
+        self.submit_balance_update(username, new_balance).result()
+
+    def credit(self, username, amount):
+        # returns the new balance, or None for an unknown user
+        rows = self.submit_user_write(username, CREDIT, (amount, username)).result()
+        return rows[0][0] if rows else None
+
+    def debit_if_sufficient(self, username, amount):
+        # returns the new balance, or None if the user is unknown or cannot cover the amount
+        rows = self.submit_user_write(username, DEBIT, (amount, username, amount)).result()
+        return rows[0][0] if rows else None
+
+    def record_park(self, spot_id, username, vehicle_type, license_plate, start_time, duration):
+        self.submit_write(JOURNAL_PARK, (spot_id, username, vehicle_type, license_plate, start_time, duration)).result()
+        self.journal_appended()
+
+    def settle_exits(self, charges):
+        # charges: (username, amount, spot_ids) per account. Each account is debited once and its
+        # exits journaled only if it can cover the amount, all in one transaction; exits are only ever
+        # journaled here, so none is recorded apart from its debit.
+        # Returns username -> new balance for the accounts that paid. Under group commit it runs on the
+        # writer, so it is as durable as a single debit
+        def settle(conn):
+            balances, exits = {}, []
+            for username, amount, spot_ids in charges:
+                rows = conn.execute(DEBIT, (amount, username, amount)).fetchall()
+                if rows:
+                    balances[username] = rows[0][0]
+                    exits.extend((spot_id,) for spot_id in spot_ids)
+            conn.executemany(JOURNAL_EXIT, exits)
+            return balances, len(exits)
+        try:
+            balances, exited = self.submit_write(settle).result()
+        finally:
+            for username, _, _ in charges:
+                self.user_cache.invalidate(username)
+        self.journal_appended(exited)
+        return balances
+
+    def journal_appended(self, count=1):
+        self.journal_appends += count
+        if self.checkpoint_interval and self.journal_appends >= self.checkpoint_interval:
+            self.checkpoint_sessions()
+
+    def checkpoint_sessions(self):
+        # a write like any other, so under group commit the writer commits it
+        self.journal_appends = 0
+        self.submit_write(checkpoint).result()
+
+    def load_sessions(self):
+        # checkpointed sessions with the journal replayed on top, keyed by spot id; each value is
+        # (username, vehicle_type, license_plate, start_time, duration)
+        with self.connection() as conn:
+            sessions = {row[0]: row[1:] for row in conn.execute(SELECT_SESSIONS)}
+            for row in conn.execute(SELECT_JOURNAL):
+                if row[1] == 'park':
+                    sessions[row[2]] = row[3:]
+                else:
+                    sessions.pop(row[2], None)
+        return sessions
+
+# every operation callers use, plus the group commit of a batch; the plumbing underneath (acquire,
+# submit_write, ...) is left out so a call is not timed twice
+metrics.instrument(Database, "db", ("commit_batch", "close", "create_tables", "checkpoint_sessions", "load_sessions"))
+# the queries of one engine transaction each
+metrics.instrument(Database, "db", ("add_user", "get_user", "update_password", "submit_balance_update",
+                                    "update_balance", "credit", "debit_if_sufficient", "record_park", "settle_exits"),
+                   inner=True)
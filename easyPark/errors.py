@@ -0,0 +1,26 @@
+#errors.py
+# the engine's exceptions, in a module of their own so front ends can catch them without importing the engine
+
+class ParkingError(Exception):
+    pass
+
+class NotLoggedInError(ParkingError):
+    pass
+
+class InvalidInputError(ParkingError):
+    pass
+
+class SpotUnavailableError(ParkingError):
+    pass
+
+class InsufficientFundsError(ParkingError):
+    pass
+
+class PermissionDeniedError(ParkingError):
+    pass
+
+class AuthenticationError(ParkingError):
+    pass
+
+class DuplicatePlateError(ParkingError):
+    pass
@@ -0,0 +1,112 @@
+#expiry.py
+# session deadlines on a min-heap. A session overstays when its booked hours run out, its grace period
+# expires grace seconds later and, when charge_after is set, it is auto-charged that many seconds after
+# that. The scheduler follows the lot through its change events. Entries of a vacated or replaced session
+# are not searched for; they are skipped when they reach the top of the heap, so occupy, vacate and every
+# fired event cost O(log n) and nothing ever scans the lot after start-up.
+import heapq
+import itertools
+import threading
+import metrics
+
+OVERSTAY, GRACE_EXPIRED, AUTO_CHARGE, UNPAID = "overstay", "grace_expired", "auto_charge", "unpaid"
+NEXT_STAGE = {OVERSTAY: GRACE_EXPIRED, GRACE_EXPIRED: AUTO_CHARGE}
+COMPACT_AFTER = 1024  # stale heap entries tolerated before the heap is rebuilt without them
+
+class ExpiryScheduler:
+    def __init__(self, lot, grace=900, charge_after=None):
+        self.lot = lot
+        self.grace = grace
+        self.charge_after = charge_after  # None: overstayers are charged when they exit, as usual
+        self.heap = []  # (when, generation, stage, spot id)
+        # spot id -> (generation, plate, username) of the session parked there while it has an entry
+        # in the heap; heap entries of any other generation are stale
+        self.sessions = {}
+        self.stale = 0
+        self.live = {}  # spot id -> overstay record, for the UI and enforcement staff
+        self.generations = itertools.count(1)
+        self.lock = threading.Lock()
+        with self.lock:
+            # vehicles already parked go in with one heapify instead of a push each
+            for shard, positions in lot.partition():
+                for i in positions:
+                    entry = self.session_entry(shard, i, shard.spot_id(i))
+                    if entry is not None:
+                        self.heap.append(entry)
+            heapq.heapify(self.heap)
+        lot.subscribe(self.on_spot_changed)
+
+    def session_entry(self, shard, i, spot_id):
+        # registers the session at position i of a lot (or topology shard) and returns its first heap
+        # entry; sessions without a booked duration (e.g. restored from an old journal) never overstay
+        duration = shard.durations[i]
+        if not duration:
+            return None
+        generation = next(self.generations)
+        user = shard.users.values[shard.user_ids[i]]
+        self.sessions[spot_id] = (generation, shard.plates.values[shard.plate_ids[i]], user.username if user else None)
+        return (shard.start_times[i] + duration * 3600, generation, OVERSTAY, spot_id)
+
+    def on_spot_changed(self, spot_id, occupied):
+        # runs under the lot's lock, so the spot's arrays are consistent while it is read
+        with self.lock:
+            if self.sessions.pop(spot_id, None) is not None:
+                self.stale += 1
+            self.live.pop(spot_id, None)
+            if occupied:
+                spot = self.lot.get_spot(spot_id)
+                entry = self.session_entry(spot.lot, spot.index, spot_id)
+                if entry is not None:
+                    heapq.heappush(self.heap, entry)
+            if self.stale > COMPACT_AFTER and self.stale > len(self.heap) // 2:
+                self.compact()
+
+    def compact(self):
+        sessions = self.sessions
+        self.heap = [entry for entry in self.heap if entry[3] in sessions and sessions[entry[3]][0] == entry[1]]
+        heapq.heapify(self.heap)
+        self.stale = 0
+
+    def poll(self, now):
+        # fires every event due by now, in deadline order; returns [(stage, spot id, when), ...]
+        events = []
+        with self.lock:
+            heap, sessions = self.heap, self.sessions
+            while heap and heap[0][0] <= now:
+                when, generation, stage, spot_id = heapq.heappop(heap)
+                session = sessions.get(spot_id)
+                if session is None or session[0] != generation:
+                    self.stale -= 1
+                    continue
+                if stage == OVERSTAY:
+                    self.live[spot_id] = {"spot": spot_id, "plate": session[1], "user": session[2],
+                                          "deadline": when, "stage": stage}
+                else:
+                    self.live[spot_id]["stage"] = stage
+                following = when + self.grace if stage == OVERSTAY else (
+                    when + self.charge_after if stage == GRACE_EXPIRED and self.charge_after is not None else None)
+                if following is None:
+                    del sessions[spot_id]  # last stage; the record stays listed until the vehicle leaves
+                else:
+                    heapq.heappush(heap, (following, generation, NEXT_STAGE[stage], spot_id))
+                events.append((stage, spot_id, when))
+        return events
+
+    def mark_unpaid(self, spot_ids):
+        # auto-charged sessions whose owner could not pay stay parked and listed
+        with self.lock:
+            for spot_id in spot_ids:
+                if spot_id in self.live:
+                    self.live[spot_id]["stage"] = UNPAID
+
+    def overstays(self, limit=None):
+        # the live list, longest overdue first
+        with self.lock:
+            records = sorted(self.live.values(), key=lambda record: record["deadline"])[:limit]
+            return [dict(record) for record in records]
+
+    def close(self):
+        self.lot.unsubscribe(self.on_spot_changed)
+
+metrics.instrument(ExpiryScheduler, "expiry", ("overstays",))
+metrics.instrument(ExpiryScheduler, "expiry", ("poll",), inner=True)
@@ -0,0 +1,285 @@
+#ledger.py
+# append-only history of top-ups, parks, exits and charges. Events are fixed-size binary records
+# written one after another; names (users, spots, plates, ...) go once into a string table beside
+# them. Snapshots of the derived state let a restart replay only the events written since.
+# The database is authoritative for balances and sessions, and restarts rebuild the lot from it; the
+# ledger is the audit trail, appended after the database change it records. Every append is synced
+# to disk before it returns, so a crash can only lose the events of operations still in flight.
+import json
+import os
+import struct
+import sys
+import threading
+from array import array
+from itertools import compress
+import metrics
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# appends only grow the files, so the data and their length are all that must reach the disk
+fdatasync = getattr(os, "fdatasync", os.fsync)
+
+TOP_UP, PARK, EXIT, CHARGE = 1, 2, 3, 4
+KIND_NAMES = {TOP_UP: "top_up", PARK: "park", EXIT: "exit", CHARGE: "charge"}
+# head is kind | tag << 8, tag being the top-up method or the vehicle type; head, user, spot and
+# plate are string table ids (0 is none). value is the amount, or the booked hours for a park.
+RECORD = struct.Struct("<IIIIdd")
+NUMPY_RECORD = [("head", "<u4"), ("user", "<u4"), ("spot", "<u4"), ("plate", "<u4"), ("value", "<f8"), ("time", "<f8")]
+READ_CHUNK = 65536  # records per read when scanning the log
+# translate tables turning a string of record kinds into 0/1 selection masks
+TOP_UPS, CHARGES, MOVES = (bytes(kind in kinds for kind in range(256))
+                           for kinds in ((TOP_UP,), (CHARGE,), (PARK, EXIT)))
+
+class Ledger:
+    def __init__(self, path, snapshot_interval=100000, sync=True):
+        self.path = path
+        self.strings_path = path + ".strings"
+        self.snapshot_path = path + ".snapshot"
+        self.snapshot_interval = snapshot_interval
+        self.lock = threading.Lock()
+        self.snapshot_lock = threading.Lock()
+        self.sync = sync  # sync each append to disk; off only for bulk loads that can be redone
+        self.sync_lock = threading.Lock()
+        self.synced = 0  # events known to be on disk
+        self.strings = [None]  # id -> string
+        self.string_ids = {}
+        self.balances = {}  # username -> top-ups minus charges
+        self.sessions = {}  # spot id -> (username, vehicle type, plate, start time, hours)
+        self.count = 0
+        self.snapshot_count = 0
+        self.load()
+        self.events_file = open(path, "ab")
+        self.strings_file = open(self.strings_path, "ab")
+
+    def load(self):
+        self.strings.extend(self.read_strings())
+        self.string_ids = {s: i for i, s in enumerate(self.strings) if i}
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size % RECORD.size:
+            # a record torn by a crash mid-write; nothing after it can have been acknowledged
+            size -= size % RECORD.size
+            os.truncate(self.path, size)
+        self.count = size // RECORD.size
+        start = 0
+        snapshot = self.read_snapshot()
+        if snapshot is not None and snapshot["events"] <= self.count:
+            start = self.snapshot_count = snapshot["events"]
+            self.balances = snapshot["balances"]
+            self.sessions = {spot_id: tuple(session) for spot_id, session in snapshot["sessions"].items()}
+        if start < self.count:
+            with open(self.path, "rb") as f:
+                f.seek(start * RECORD.size)
+                data = f.read((self.count - start) * RECORD.size)
+            valid = self.valid_length(data)
+            if valid < len(data):
+                # records that reached the disk before the strings they name; never acknowledged
+                os.truncate(self.path, start * RECORD.size + valid)
+                self.count = start + valid // RECORD.size
+                data = data[:valid]
+            self.replay(data)
+
+    def read_strings(self):
+        if not os.path.exists(self.strings_path):
+            return []
+        with open(self.strings_path, "rb") as f:
+            data = f.read()
+        end = data.rfind(b"\0") + 1
+        if end < len(data):
+            os.truncate(self.strings_path, end)
+        return data[:end].decode().split("\0")[:-1]
+
+    def valid_length(self, data):
+        # bytes of data before the first record naming a string id past the end of the string table.
+        # A record's tag sits above its kind in head, so the largest head carries the largest tag
+        words = array('I', data)
+        if sys.byteorder == "big":
+            words.byteswap()
+        limit = len(self.strings)
+        if not words or max(max(words[0::8]) >> 8, max(words[1::8]), max(words[2::8]), max(words[3::8])) < limit:
+            return len(data)
+        for k in range(len(words) // 8):
+            if max(words[8 * k] >> 8, words[8 * k + 1], words[8 * k + 2], words[8 * k + 3]) >= limit:
+                return k * RECORD.size
+        return len(data)
+
+    def read_snapshot(self):
+        try:
+            with open(self.snapshot_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def replay(self, data):
+        # applies a run of records to the balances and sessions; works on string ids throughout
+        # and turns them back into names once at the end
+        totals, parked, exited = (self.replay_numpy if np is not None else self.replay_columns)(data)
+        strings, balances, sessions = self.strings, self.balances, self.sessions
+        for user, total in totals.items():
+            balances[strings[user]] = balances.get(strings[user], 0.0) + total
+        for spot in exited:
+            sessions.pop(strings[spot], None)
+        for spot, (user, tag, plate, when, hours) in parked.items():
+            sessions[strings[spot]] = (strings[user], strings[tag], strings[plate], when, hours)
+
+    def replay_columns(self, data):
+        # slices the records into columns with C-level slicing, so the Python loops only touch
+        # the money events and one entry per spot
+        kinds = data[0::RECORD.size]  # the low byte of head
+        words, floats = array('I', data), array('d', data)
+        if sys.byteorder == "big":
+            words.byteswap()
+            floats.byteswap()
+        users, values = words[1::8], floats[2::4]
+        totals = {}
+        for mask, sign in ((TOP_UPS, 1.0), (CHARGES, -1.0)):
+            selected = kinds.translate(mask)
+            for user, value in zip(compress(users, selected), compress(values, selected)):
+                totals[user] = totals.get(user, 0.0) + sign * value
+        # a spot's state after the run is decided by its last park or exit
+        selected = kinds.translate(MOVES)
+        last = dict(zip(compress(words[2::8], selected), compress(range(len(kinds)), selected)))
+        parked, exited = {}, set()
+        for spot, k in last.items():
+            if kinds[k] == PARK:
+                parked[spot] = (users[k], words[8 * k] >> 8, words[8 * k + 3], floats[4 * k + 3], floats[4 * k + 2])
+            else:
+                exited.add(spot)
+        return totals, parked, exited
+
+    def replay_numpy(self, data):
+        records = np.frombuffer(data, dtype=NUMPY_RECORD)
+        kinds = records["head"] & 0xFF
+        money = (kinds == TOP_UP) | (kinds == CHARGE)
+        users = records["user"][money]
+        amounts = np.where(kinds[money] == CHARGE, -records["value"][money], records["value"][money])
+        sums = np.bincount(users, weights=amounts)
+        touched = np.unique(users)
+        totals = dict(zip(touched.tolist(), sums[touched].tolist()))
+        # a spot's state after the run is decided by its last park or exit
+        moves = np.flatnonzero((kinds == PARK) | (kinds == EXIT))
+        spots = records["spot"][moves][::-1]
+        last_spots, first = np.unique(spots, return_index=True)
+        last = moves[::-1][first]
+        is_park = kinds[last] == PARK
+        parks = records[last[is_park]]
+        parked = dict(zip(last_spots[is_park].tolist(),
+                          zip(parks["user"].tolist(), (parks["head"] >> 8).tolist(), parks["plate"].tolist(),
+                              parks["time"].tolist(), parks["value"].tolist())))
+        return totals, parked, set(last_spots[~is_park].tolist())
+
+    def intern(self, s):
+        # caller holds the lock; new strings are appended to the string table
+        if s is None:
+            return 0
+        if "\0" in s:
+            s = s.replace("\0", "\ufffd")  # NUL ends a string in the table
+        i = self.string_ids.get(s)
+        if i is None:
+            i = self.string_ids[s] = len(self.strings)
+            self.strings.append(s)
+            self.strings_file.write(s.encode() + b"\0")
+        return i
+
+    def record(self, kind, when, user=None, spot=None, plate=None, tag=None, value=0.0):
+        self.record_many([(kind, when, user, spot, plate, tag, value)])
+
+    def record_many(self, events):
+        # events: (kind, time, user, spot, plate, tag, value) tuples, written in one go
+        with self.lock:
+            records = []
+            for kind, when, user, spot, plate, tag, value in events:
+                tag_id = self.intern(tag)
+                if tag_id >= 1 << 24:
+                    raise ValueError(f"no room left in the record header for a new tag: {tag}")
+                head = kind | tag_id << 8
+                user_id, spot_id, plate_id = self.intern(user), self.intern(spot), self.intern(plate)
+                records.append(RECORD.pack(head, user_id, spot_id, plate_id, value, when))
+                self.apply(kind, when, user, spot, plate, tag, value)
+            # the string table reaches the file before any record that refers to it
+            self.strings_file.flush()
+            self.events_file.write(b"".join(records))
+            self.events_file.flush()
+            self.count += len(records)
+            count = self.count
+            due = self.snapshot_interval and self.count - self.snapshot_count >= self.snapshot_interval
+            if due:
+                self.snapshot_count = self.count
+        if self.sync:
+            self.sync_to(count)
+        if due:
+            self.snapshot()
+
+    def sync_to(self, count):
+        # fsync outside the append lock: one fsync covers every record flushed before it, so appends
+        # that queued up behind it return without one of their own. The string table goes first, so an
+        # acknowledged record never refers to a string lost in a crash (load drops any that do)
+        with self.sync_lock:
+            if self.synced >= count:
+                return
+            with self.lock:
+                flushed = self.count
+            fdatasync(self.strings_file.fileno())
+            fdatasync(self.events_file.fileno())
+            self.synced = flushed
+
+    def apply(self, kind, when, user, spot, plate, tag, value):
+        if kind == TOP_UP:
+            self.balances[user] = self.balances.get(user, 0.0) + value
+        elif kind == CHARGE:
+            self.balances[user] = self.balances.get(user, 0.0) - value
+        elif kind == PARK:
+            self.sessions[spot] = (user, tag, plate, when, value)
+        elif kind == EXIT:
+            self.sessions.pop(spot, None)
+
+    def top_up(self, username, amount, method, when):
+        self.record(TOP_UP, when, user=username, tag=method, value=amount)
+
+    def park(self, spot_id, username, vehicle_type, license_plate, start_time, duration):
+        self.record(PARK, start_time, user=username, spot=spot_id, plate=license_plate, tag=vehicle_type,
+                    value=duration)
+
+    def exits(self, exits, when):
+        # exits: (spot id, username, fee) per vehicle leaving; each is a charge followed by the exit
+        self.record_many(event for spot_id, username, fee in exits
+                         for event in ((CHARGE, when, username, spot_id, None, None, fee),
+                                       (EXIT, when, username, spot_id, None, None, 0.0)))
+
+    def snapshot(self):
+        # the state is copied under the lock and written outside it, so appends are not held up
+        with self.lock:
+            state = {"events": self.count, "balances": dict(self.balances), "sessions": dict(self.sessions)}
+        with self.snapshot_lock:
+            tmp = self.snapshot_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.snapshot_path)
+
+    def events(self, start=0):
+        # yields (kind, time, user, spot, plate, tag, value) for every event from position start
+        with self.lock:
+            self.events_file.flush()
+            stop, strings = self.count, list(self.strings)
+        with open(self.path, "rb") as f:
+            f.seek(start * RECORD.size)
+            for k in range(start, stop, READ_CHUNK):
+                data = f.read(min(READ_CHUNK, stop - k) * RECORD.size)
+                for head, user, spot, plate, value, when in RECORD.iter_unpack(data):
+                    yield (KIND_NAMES[head & 0xFF], when, strings[user], strings[spot], strings[plate],
+                           strings[head >> 8], value)
+
+    def history(self, username):
+        return [event for event in self.events() if event[2] == username]
+
+    def close(self):
+        with self.sync_lock, self.lock:
+            self.events_file.close()
+            self.strings_file.close()
+
+metrics.instrument(Ledger, "ledger", ("snapshot", "load"))
+metrics.instrument(Ledger, "ledger", ("record_many",), inner=True)
@@ -1,6 +1,8 @@
 #easypark main.py
+import logging
 from parking_system import ParkingSystem
 
 if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     app = ParkingSystem()
     app.mainloop()
\ No newline at end of file
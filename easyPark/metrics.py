@@ -0,0 +1,231 @@
+#metrics.py
+# latency histograms and error counts for the hot paths, a Prometheus text exporter and opt-in
+# profiling. Modules register the methods worth timing with instrument(); nothing is wrapped until
+# enable() is called (or EASYPARK_METRICS=1 is set), so while metrics are off the calls are untouched.
+# Calls registered as inner (the queries and password checks inside an engine transaction) are only
+# wrapped with EASYPARK_METRICS_NESTED=1 or enable(nested_calls=True), so by default a transaction
+# pays for one timer rather than one per query inside it.
+# EASYPARK_PROFILE=<path> starts the sampling profiler and writes its stacks there on exit.
+import atexit
+import cProfile
+import functools
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+# upper bounds in seconds, 10us .. 2.5s
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5)
+
+SUM, ERRORS = len(BUCKETS) + 1, len(BUCKETS) + 2  # slots after the bucket counts (the last bucket is +Inf)
+
+class Histogram:
+    # every thread counts into its own shard, so recording takes no lock; reads add the shards up
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []
+        self.lock = threading.Lock()
+
+    def new_shard(self):
+        shard = self.local.shard = [0] * (len(BUCKETS) + 1) + [0.0, 0]
+        with self.lock:
+            self.shards.append(shard)
+        return shard
+
+    def observe(self, seconds, failed=False):
+        try:
+            shard = self.local.shard
+        except AttributeError:
+            shard = self.new_shard()
+        shard[bisect_left(BUCKETS, seconds)] += 1
+        shard[SUM] += seconds
+        if failed:
+            shard[ERRORS] += 1
+
+    def read(self):
+        with self.lock:
+            shards = [list(shard) for shard in self.shards]
+        totals = [sum(column) for column in zip(*shards)] or [0] * (len(BUCKETS) + 1) + [0.0, 0]
+        return totals[:SUM], totals[SUM], totals[ERRORS]
+
+    def clear(self):
+        with self.lock:
+            for shard in self.shards:
+                shard[:] = [0] * (len(BUCKETS) + 1) + [0.0, 0]
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th observation
+        counts, _, _ = self.read()
+        rank, seen = q * sum(counts), 0
+        for bound, count in zip(BUCKETS + (float("inf"),), counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return 0.0
+
+enabled = False
+nested = False  # whether inner calls are timed too
+histograms = {}  # call name -> Histogram
+targets = []  # (class, prefix, method names, inner) registered by the instrumented modules
+originals = {}  # (class, method name) -> the unwrapped function, while enabled
+registry_lock = threading.Lock()
+
+def histogram(name):
+    with registry_lock:
+        h = histograms.get(name)
+        if h is None:
+            h = histograms[name] = Histogram()
+        return h
+
+def timed(fn, name):
+    # the success path records inline rather than through observe(): this wrapper runs on every call
+    h = histogram(name)
+    local, new_shard, clock = h.local, h.new_shard, time.perf_counter
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            h.observe(clock() - start, True)
+            raise
+        elapsed = clock() - start
+        try:
+            shard = local.shard
+        except AttributeError:
+            shard = new_shard()
+        shard[bisect_left(BUCKETS, elapsed)] += 1
+        shard[SUM] += elapsed
+        return result
+    return wrapper
+
+def wrap(cls, prefix, names, inner):
+    if inner and not nested:
+        return
+    for name in names:
+        if (cls, name) not in originals:
+            originals[cls, name] = cls.__dict__[name]
+            setattr(cls, name, timed(originals[cls, name], f"{prefix}.{name}"))
+
+def instrument(cls, prefix, names, inner=False):
+    # methods of cls to time as "<prefix>.<name>" whenever metrics are on; inner ones only run inside
+    # calls that are timed already, and are left unwrapped unless nested timing is on
+    with registry_lock:
+        targets.append((cls, prefix, names, inner))
+    if enabled:
+        wrap(cls, prefix, names, inner)
+
+def enable(nested_calls=None):
+    # bound methods taken before this call (e.g. Tk button commands) keep calling the unwrapped method,
+    # so front ends enable metrics before building their widgets
+    global enabled, nested
+    if nested_calls is not None and nested_calls != nested:
+        disable()
+        nested = nested_calls
+    enabled = True
+    for cls, prefix, names, inner in list(targets):
+        wrap(cls, prefix, names, inner)
+
+def disable():
+    global enabled
+    enabled = False
+    for (cls, name), fn in list(originals.items()):
+        setattr(cls, name, fn)
+        del originals[cls, name]
+
+def reset():
+    with registry_lock:
+        for h in histograms.values():
+            h.clear()
+
+def summary():
+    # call name -> count, total seconds, errors and bucket-resolution p50/p99, for JSON endpoints
+    result = {}
+    for name, h in sorted(histograms.items()):
+        counts, total, errors = h.read()
+        if sum(counts):
+            result[name] = {"count": sum(counts), "seconds": total, "errors": errors,
+                            "p50": h.quantile(0.5), "p99": h.quantile(0.99)}
+    return result
+
+def label(value):
+    # a label value as the text format quotes it
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render(gauges=None):
+    # Prometheus text exposition format (version 0.0.4)
+    lines = ["# HELP easypark_call_seconds Time spent in instrumented calls.",
+             "# TYPE easypark_call_seconds histogram"]
+    errors = []
+    for name, h in sorted(histograms.items()):
+        counts, total, failed = h.read()
+        call = label(name)
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'easypark_call_seconds_bucket{{call="{call}",le="{le}"}} {cumulative}')
+        lines.append(f'easypark_call_seconds_sum{{call="{call}"}} {total!r}')
+        lines.append(f'easypark_call_seconds_count{{call="{call}"}} {cumulative}')
+        errors.append(f'easypark_call_errors_total{{call="{call}"}} {failed}')
+    lines += ["# HELP easypark_call_errors_total Instrumented calls that raised.",
+              "# TYPE easypark_call_errors_total counter"] + errors
+    for name, value in sorted((gauges or {}).items()):
+        lines += [f"# TYPE {name} gauge", f"{name} {value!r}"]
+    return "\n".join(lines) + "\n"
+
+class Sampler:
+    # statistical profiler: every interval it records the stack of every other thread. The output is
+    # one "frame;frame;... count" line per distinct stack, the input flamegraph tools expect
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="easypark-sampler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self, path=None):
+        self.stopped.set()
+        self.thread.join()
+        if path:
+            with open(path, "w") as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        return self.stacks
+
+@contextmanager
+def profile(path):
+    # deterministic cProfile of the calling thread for the duration of the block; read it with pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+if os.environ.get("EASYPARK_METRICS", "") not in ("", "0"):
+    enable(os.environ.get("EASYPARK_METRICS_NESTED", "") not in ("", "0"))
+if os.environ.get("EASYPARK_PROFILE"):
+    atexit.register(Sampler().start().stop, os.environ["EASYPARK_PROFILE"])
@@ -0,0 +1,403 @@
+#parking_engine.py
+import hmac
+import math
+import secrets
+import time
+import metrics
+from billing import compute_fees, totals_by_owner
+from errors import (ParkingError, NotLoggedInError, InvalidInputError, SpotUnavailableError, InsufficientFundsError,
+                    PermissionDeniedError, AuthenticationError, DuplicatePlateError)
+from expiry import AUTO_CHARGE
+from passwords import PasswordHasher
+from quote_cache import QuoteCache
+from tariff import Tariff
+from user import User
+from vehicle import Vehicle
+
+DEFAULT_HASHER = PasswordHasher()
+
+def hash_password(password):
+    return DEFAULT_HASHER.hash(password)
+
+PREVIEW_BUCKET = 10  # seconds; exit previews within the same bucket share one cached price
+MAX_DURATION = 24  # hours; the longest booking, as the window's duration Spinbox allows
+
+class ParkingEngine:
+    # headless parking logic; the Tk window and other front ends call into this
+    def __init__(self, parking_lot, db, rates=None, tariff=None, quote_cache_size=4096, hasher=None,
+                 token_ttl=900, verified_ttl=300, ledger=None, clock=time.time, expiry=None):
+        self.parking_lot = parking_lot
+        self.clock = clock  # epoch seconds for session starts, fees and the ledger; simulators pass their own
+        self.db = db
+        self.ledger = ledger  # optional audit trail of every top-up, park, exit and charge
+        self.expiry = expiry  # optional ExpiryScheduler following parking_lot, see enforce()
+        self.hasher = hasher or DEFAULT_HASHER
+        # repeat logins within verified_ttl skip the KDF; passwords are only kept as keyed digests
+        self.verify_key = secrets.token_bytes(32)
+        self.verified = {}  # username -> (password digest, stored hash, expiry)
+        self.verified_ttl = verified_ttl
+        self.tokens = {}  # session token -> (username, expiry)
+        self.token_ttl = token_ttl
+        self.next_token_sweep = 0
+        self.quote_cache = QuoteCache(quote_cache_size)
+        self.tariff_version = 0
+        self.set_tariff(tariff if tariff is not None else Tariff.from_rates(rates) if rates is not None else Tariff())
+
+    def set_tariff(self, tariff):
+        # cache keys carry the tariff version, and the cache is dropped so old prices don't linger
+        if self.tariff_version:
+            self.quote_cache.clear()
+        self.tariff = tariff
+        self.rates = tariff.rates
+        self.tariff_version += 1
+
+    def authenticate(self, username, password):
+        # runs the slow KDF; callers on a UI or event-loop thread should hand this to a worker
+        user = self.db.get_user(username)
+        if user is None:
+            raise AuthenticationError("Invalid username or password")
+        digest = hmac.new(self.verify_key, (password or "").encode(), "sha256").digest()
+        now = time.monotonic()
+        cached = self.verified.get(username)
+        if (cached is not None and cached[2] > now and cached[1] == user.password_hash
+                and hmac.compare_digest(cached[0], digest)):
+            return user
+        if not self.hasher.verify(password, user.password_hash):
+            raise AuthenticationError("Invalid username or password")
+        if self.hasher.needs_upgrade(user.password_hash):
+            user.password_hash = self.hasher.hash(password)
+            self.db.update_password(username, user.password_hash)
+        self.verified[username] = (digest, user.password_hash, now + self.verified_ttl)
+        return user
+
+    def register(self, username, password):
+        if not username or not password:
+            raise InvalidInputError("Username and password are required")
+        if self.db.get_user(username):
+            raise InvalidInputError("Username already exists")
+        self.db.add_user(username, self.hasher.hash(password))
+
+    def login(self, username, password):
+        # returns (user, token); the token stands in for the password until it expires
+        user = self.authenticate(username, password)
+        now = time.monotonic()
+        if now >= self.next_token_sweep:
+            for token, (_, expiry) in list(self.tokens.items()):
+                if expiry <= now:
+                    self.tokens.pop(token, None)
+            self.next_token_sweep = now + self.token_ttl
+        token = secrets.token_urlsafe(32)
+        self.tokens[token] = (username, now + self.token_ttl)
+        return user, token
+
+    def authenticate_token(self, token):
+        entry = self.tokens.get(token)
+        if entry is None or entry[1] <= time.monotonic():
+            self.tokens.pop(token, None)
+            raise AuthenticationError("Session expired. Please log in again.")
+        user = self.db.get_user(entry[0])
+        if user is None:
+            raise AuthenticationError("Invalid username or password")
+        return user
+
+    def logout(self, token):
+        self.tokens.pop(token, None)
+
+    def restore_sessions(self):
+        # rebuild lot occupancy from the database after a restart; returns how many spots were restored
+        # restored spots only need to know who parked, so owners are username-only User records
+        users = {}
+        restored = 0
+        occupy_spot = self.parking_lot.occupy_spot
+        for spot_id, (username, vehicle_type, license_plate, start_time,
+                      duration) in self.db.load_sessions().items():
+            user = users.get(username)
+            if user is None:
+                user = users[username] = User(username, None)
+            if occupy_spot(spot_id, Vehicle(vehicle_type, license_plate), duration, user, start_time):
+                restored += 1
+        self.db.checkpoint_sessions()
+        return restored
+
+    def rate_for(self, vehicle_type):
+        if vehicle_type not in self.rates:
+            raise InvalidInputError(f"Unknown vehicle type: {vehicle_type}")
+        return self.rates[vehicle_type]
+
+    def parse_duration(self, duration):
+        # whole hours, 1 to MAX_DURATION: a 0-hour park would be free and never overstay
+        try:
+            duration = int(duration)
+        except (TypeError, ValueError, OverflowError):
+            raise InvalidInputError("Please enter a valid duration.")
+        if not 1 <= duration <= MAX_DURATION:
+            raise InvalidInputError(f"Please enter a duration of 1 to {MAX_DURATION} hours.")
+        return duration
+
+    def quote(self, vehicle_type, duration, zone=None, start=None):
+        # price of parking for duration hours from start (default: now); time-of-day tariffs are
+        # per-minute tables, so quotes are cached per starting minute (flat rates ignore the start)
+        self.rate_for(vehicle_type)
+        hours = self.parse_duration(duration)
+        start = self.clock() if start is None else start
+        start = start - start % 60
+        tariff = self.tariff
+        key = ("quote", vehicle_type, hours, zone, None if tariff.vehicles[vehicle_type].flat else start,
+               self.tariff_version)
+        return self.quote_cache.get_or_compute(key, lambda: tariff.fee(vehicle_type, start, start + hours * 3600, zone))
+
+    def fee_for(self, spot, now=None):
+        # spot.lot is the lot (or topology shard) that holds the spot
+        return self.tariff.fee(spot.vehicle.type, spot.lot.start_times[spot.index], now or self.clock(), spot.zone)
+
+    def occupied_spot(self, spot_id):
+        if not spot_id:
+            raise InvalidInputError("Please select an occupied spot.")
+        spot = self.parking_lot.get_spot(spot_id)
+        if spot is None or not spot.is_occupied:
+            raise SpotUnavailableError("Invalid spot selection.")
+        return spot
+
+    def user_vehicles(self, user, limit=None):
+        # (spot id, plate, vehicle type, fee so far) per parked vehicle; safe off the writer thread, since
+        # fees are priced from rows the lot reads under its lock
+        if user is None:
+            raise NotLoggedInError("Please log in first")
+        now = self.clock()
+        rows = self.parking_lot.session_rows(user.username, limit)
+        return [(spot_id, plate, vehicle_type, self.tariff.fee(vehicle_type, start_time, now, zone))
+                for spot_id, plate, vehicle_type, start_time, zone in rows]
+
+    def spot_for_plate(self, license_plate):
+        spot = self.parking_lot.find_plate(license_plate)
+        if spot is None:
+            raise SpotUnavailableError(f"Vehicle {license_plate} is not parked here.")
+        return spot
+
+    def exit_quote(self, spot_id):
+        # a preview only: priced at the start of the current PREVIEW_BUCKET, the exit itself charges to the second
+        spot = self.occupied_spot(spot_id)
+        lot, i = spot.lot, spot.index
+        # read the session in one step; another thread may vacate the spot at any time
+        with lot.lock:
+            if not lot.occupied[i]:
+                raise SpotUnavailableError("Invalid spot selection.")
+            vehicle_type, start_time = lot.vehicle_types.values[lot.type_codes[i]], lot.start_times[i]
+        now = self.clock()
+        now -= now % PREVIEW_BUCKET
+        key = ("exit", spot.id, start_time, now, self.tariff_version)
+        return self.quote_cache.get_or_compute(key, lambda: self.tariff.fee(vehicle_type, start_time, now, spot.zone))
+
+    def park(self, user, spot_id, vehicle_type, license_plate, duration):
+        if user is None:
+            raise NotLoggedInError("Please log in first")
+        duration = self.parse_duration(duration)
+        if not spot_id or not license_plate:
+            raise InvalidInputError("Please select a spot and enter a license plate.")
+        spot = self.parking_lot.get_spot(spot_id)
+        if spot is None or spot.is_occupied:
+            raise SpotUnavailableError(f"Spot {spot_id} is not available.")
+        if not self.parking_lot.accepts(spot_id, vehicle_type):
+            raise SpotUnavailableError(f"Spot {spot_id} is reserved for other vehicle types.")
+        self.check_plate(license_plate)
+
+        start_time = self.clock()
+        cost = self.quote(vehicle_type, duration, spot.zone, start_time)
+        if user.balance < cost:
+            raise InsufficientFundsError("Insufficient balance. Please add funds to your account.")
+
+        # another gate may have taken the spot, or parked the plate, since the checks above
+        if not self.parking_lot.try_occupy(spot_id, Vehicle(vehicle_type, license_plate), duration, user, start_time,
+                                           unique_plate=True):
+            raise SpotUnavailableError(f"Spot {spot_id} is not available.")
+        self.journal_park(spot, user, vehicle_type, license_plate, start_time, duration)
+        return spot
+
+    def park_any(self, user, vehicle_type, license_plate, duration):
+        # parks in the first free spot that takes the vehicle; the spot is claimed before it is priced
+        if user is None:
+            raise NotLoggedInError("Please log in first")
+        duration = self.parse_duration(duration)
+        self.rate_for(vehicle_type)
+        if not license_plate:
+            raise InvalidInputError("Please enter a license plate.")
+        self.check_plate(license_plate)
+
+        start_time = self.clock()
+        spot = self.parking_lot.claim_any(Vehicle(vehicle_type, license_plate), duration, user, start_time,
+                                          unique_plate=True)
+        if spot is None:
+            raise SpotUnavailableError("The lot is full.")
+        if user.balance < self.quote(vehicle_type, duration, spot.zone, start_time):
+            self.parking_lot.vacate_spot(spot.id)
+            raise InsufficientFundsError("Insufficient balance. Please add funds to your account.")
+        self.journal_park(spot, user, vehicle_type, license_plate, start_time, duration)
+        return spot
+
+    def check_plate(self, license_plate):
+        # early rejection only; the claim repeats the check under the lot lock, where it cannot race
+        parked = self.parking_lot.find_plate(license_plate)
+        if parked is not None:
+            raise DuplicatePlateError(f"Vehicle {license_plate} is already parked in spot {parked.id}.")
+
+    def journal_park(self, spot, user, vehicle_type, license_plate, start_time, duration):
+        # the spot is already held in memory; give it back if the session cannot be made durable
+        try:
+            self.db.record_park(spot.id, user.username, vehicle_type, license_plate, start_time, duration)
+        except Exception:
+            self.parking_lot.vacate_spot(spot.id)
+            raise
+        if self.ledger is not None:
+            self.ledger.park(spot.id, user.username, vehicle_type, license_plate, start_time, duration)
+
+    def exit_and_charge(self, user, spot_id):
+        if user is None:
+            raise NotLoggedInError("Please log in first")
+        spot = self.occupied_spot(spot_id)
+        # claim the session before charging it: of two gates, or a gate and enforce(), exiting the same
+        # vehicle only the one holding the claim debits. The spot stays taken until the claim ends
+        session = self.parking_lot.begin_exit(spot_id, user.username)
+        if session is None:
+            if self.parking_lot.is_owner(spot_id, user.username):
+                raise SpotUnavailableError(f"The vehicle in spot {spot_id} is already exiting.")
+            raise PermissionDeniedError("Invalid spot selection or you don't have permission to exit this vehicle.")
+
+        vehicle_type, start_time = session
+        paid = False
+        try:
+            fee = self.tariff.fee(vehicle_type, start_time, self.clock(), spot.zone)
+            # the debit and the journaled exit commit together: a failure between them would leave the
+            # vehicle parked, and restored after a restart, with its fee already taken
+            balances = self.db.settle_exits([(user.username, fee, [spot_id])])
+            if user.username not in balances:
+                raise InsufficientFundsError("Insufficient balance. Please add funds to your account.")
+            user.balance = balances[user.username]
+            paid = True
+        finally:
+            self.parking_lot.end_exit(spot_id, paid)
+        if self.ledger is not None:
+            self.ledger.exits([(spot_id, user.username, fee)], self.clock())
+        return fee
+
+    def exit_all(self, user):
+        # fleet checkout: one debit for every vehicle the user has parked; returns (spot ids, total fee)
+        if user is None:
+            raise NotLoggedInError("Please log in first")
+        positions = self.parking_lot.positions_for_user(user.username)
+        if not positions:
+            raise InvalidInputError("You have no parked vehicles.")
+        # only the user's sessions: another driver may have parked at one of these spots since
+        spot_ids, total, unpaid, balances = self.settle_batch(positions, None, user.username)
+        if unpaid:
+            raise InsufficientFundsError("Insufficient balance. Please add funds to your account.")
+        if not spot_ids:
+            raise SpotUnavailableError("Your vehicles are already exiting.")
+        user.balance = balances[user.username]
+        return spot_ids, total
+
+    def batch_fees(self, positions=None, now=None):
+        # fees for the sessions at the given positions (default: every occupied spot), one pass per shard;
+        # returns [(shard, shard positions, fees), ...]
+        now = now or self.clock()
+        return [(shard, shard_positions,
+                 compute_fees(self.tariff, shard.vehicle_types.values, shard.start_times, shard.type_codes, now,
+                              shard_positions, (shard.zone_starts, shard.zone_names)))
+                for shard, shard_positions in self.parking_lot.partition(positions)]
+
+    def checkout_batch(self, positions=None, now=None):
+        # mass checkout / end-of-day settlement: every owner is debited once for all of their sessions.
+        # Owners who cannot cover their total keep their vehicles parked.
+        # Returns (exited spot ids, total charged, spot ids left unpaid).
+        exited, charged, unpaid, _ = self.settle_batch(positions, now)
+        return exited, charged, unpaid
+
+    def settle_batch(self, positions=None, now=None, username=None):
+        # checkout_batch, limited to username's sessions if given, and also returning the new balances.
+        # The sessions are claimed first, as in exit_and_charge; those another exit already holds are skipped
+        now = now or self.clock()
+        lot = self.parking_lot
+        # claimed comes back grouped by shard, so partition(claimed) walks it in the same order
+        claimed = lot.begin_exits(positions, username)
+        totals, spot_ids, owner_positions, owners, unpaid, spot_fees = {}, {}, {}, {}, [], {}
+        exited, charged, exits, paid_positions = [], 0.0, [], []
+        try:
+            k = 0
+            for shard, shard_positions in lot.partition(claimed):
+                fees = compute_fees(self.tariff, shard.vehicle_types.values, shard.start_times, shard.type_codes,
+                                    now, shard_positions, (shard.zone_starts, shard.zone_names))
+                owner_ids = [shard.user_ids[i] for i in shard_positions]
+                shard_totals = totals_by_owner(owner_ids, fees, len(shard.users.values))
+                for i, position, owner_id, fee in zip(shard_positions, claimed[k:k + len(shard_positions)],
+                                                      owner_ids, fees):
+                    spot_id = shard.spot_id(i)
+                    if owner_id == 0:
+                        unpaid.append(spot_id)
+                        continue
+                    owner_name = shard.users.values[owner_id].username
+                    if owner_name not in spot_ids:
+                        spot_ids[owner_name], owner_positions[owner_name], owners[owner_name] = [], [], []
+                    spot_ids[owner_name].append(spot_id)
+                    owner_positions[owner_name].append(position)
+                    spot_fees[spot_id] = float(fee)
+                k += len(shard_positions)
+                for owner_id in set(owner_ids) - {0}:
+                    owner = shard.users.values[owner_id]
+                    totals[owner.username] = totals.get(owner.username, 0.0) + shard_totals[owner_id]
+                    owners[owner.username].append(owner)
+            charges = [(owner_name, totals[owner_name], spot_ids[owner_name]) for owner_name in spot_ids]
+            balances = self.db.settle_exits(charges)
+
+            for owner_name, total, owner_spot_ids in charges:
+                if owner_name not in balances:
+                    unpaid.extend(owner_spot_ids)
+                    continue
+                for owner in owners[owner_name]:
+                    owner.balance = balances[owner_name]
+                charged += total
+                exited.extend(owner_spot_ids)
+                paid_positions.extend(owner_positions[owner_name])
+                exits.extend((spot_id, owner_name, spot_fees[spot_id]) for spot_id in owner_spot_ids)
+        finally:
+            # paid sessions leave the lot, the rest stay parked with their claims dropped
+            lot.end_exits(paid_positions, True)
+            lot.end_exits(claimed, False)
+        if self.ledger is not None:
+            self.ledger.exits(exits, now)
+        return exited, charged, unpaid, balances
+
+    def enforce(self, now=None):
+        # fires the overstay, grace-expiry and auto-charge events that are due. Auto-charged sessions are
+        # settled in one checkout batch; those whose owner cannot pay stay listed as unpaid.
+        if self.expiry is None:
+            return []
+        now = now or self.clock()
+        events = self.expiry.poll(now)
+        due = [self.parking_lot.index_of(spot_id) for stage, spot_id, _ in events if stage == AUTO_CHARGE]
+        if due:
+            _, _, unpaid = self.checkout_batch(due, now)
+            self.expiry.mark_unpaid(unpaid)
+        return events
+
+    def top_up(self, user, amount, method):
+        if user is None:
+            raise NotLoggedInError("Please log in first")
+        try:
+            amount = float(amount)
+        except (TypeError, ValueError):
+            raise InvalidInputError("Please enter a valid amount")
+        # NaN would be stored as a NULL balance and Infinity cannot be sent back as JSON
+        if not math.isfinite(amount) or amount <= 0:
+            raise InvalidInputError("Please enter a valid amount")
+
+        balance = self.db.credit(user.username, amount)
+        if balance is None:
+            raise NotLoggedInError("Unknown account. Please log in again.")
+        user.balance = balance
+        if self.ledger is not None:
+            self.ledger.top_up(user.username, amount, method, self.clock())
+        return amount
+
+# quotes are mostly cache hits, cheaper than the timer; the transactions around them are timed
+metrics.instrument(ParkingEngine, "engine", ("authenticate", "register", "login", "authenticate_token", "park",
+                                             "park_any", "exit_and_charge", "exit_all", "batch_fees",
+                                             "checkout_batch", "top_up", "exit_quote", "restore_sessions", "enforce"))
@@ -1,38 +1,646 @@
 #parking_spot.py
+import heapq
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from array import array
 from datetime import datetime
+from itertools import compress, islice
+import metrics
+from errors import DuplicatePlateError
+from vehicle import Vehicle
+
+FLIP = bytes([1, 0]) + bytes(254)  # translate table turning the occupancy map into a free map
+# characters plate cameras commonly misread for one another, folded onto one representative
+CONFUSABLE = str.maketrans("OQDILZSGB", "000112568")
+
+def normalize_plate(plate):
+    return "".join(c for c in plate.upper() if c.isalnum()) if plate else ""
+
+def fold_plate(normalized):
+    return normalized.translate(CONFUSABLE)
+
+# every character a folded plate can hold
+FOLDED_CHARS = "".join(sorted(set("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789".translate(CONFUSABLE))))
+
+def one_edit_keys(folded):
+    # the folded plate itself and every string one substitution, insertion or deletion away from it
+    keys = set()
+    for k in range(len(folded) + 1):
+        head, tail = folded[:k], folded[k:]
+        keys.update([head + c + tail for c in FOLDED_CHARS])
+        if tail:
+            keys.add(head + tail[1:])
+            keys.update([head + c + tail[1:] for c in FOLDED_CHARS])
+    return keys
+
+def plate_match_rank(normalized, candidate):
+    # how a parked plate (normalized) differs from a camera read: 0 the same, 1 confusable characters
+    # only, 2 one other misread character, 3 one dropped or extra character; None if further apart
+    if candidate == normalized:
+        return 0
+    a, b = fold_plate(normalized), fold_plate(candidate)
+    if a == b:
+        return 1
+    if len(a) == len(b):
+        return 2 if sum(x != y for x, y in zip(a, b)) == 1 else None
+    if abs(len(a) - len(b)) != 1:
+        return None
+    if len(a) > len(b):
+        a, b = b, a
+    k = 0
+    while k < len(a) and a[k] == b[k]:
+        k += 1
+    return 3 if a[k:] == b[k + 1:] else None
+
+def add_held(index, key, value):
+    # index maps a key to one value, or to a tuple of values when several share the key
+    held = index.get(key)
+    index[key] = value if held is None else (held + (value,) if type(held) is tuple else (held, value))
+
+def remove_held(index, key, value):
+    held = index.get(key)
+    if type(held) is tuple:
+        rest = list(held)
+        rest.remove(value)
+        index[key] = rest[0] if len(rest) == 1 else tuple(rest)
+    elif held == value:
+        del index[key]
 
 class ParkingSpot:
-    def __init__(self, id):
-        self.id = id
-        self.is_occupied = False
-        self.vehicle = None
-        self.start_time = None
-        self.duration = None
-        self.user = None
+    # lightweight view onto one position of a ParkingLot's arrays
+    __slots__ = ("lot", "index")
+
+    def __init__(self, lot, index):
+        self.lot = lot
+        self.index = index
+
+    @property
+    def id(self):
+        return self.lot.spot_id(self.index)
+
+    @property
+    def is_occupied(self):
+        return self.lot.occupied[self.index] == 1
+
+    @property
+    def vehicle(self):
+        lot, i = self.lot, self.index
+        if not lot.occupied[i]:
+            return None
+        return Vehicle(lot.vehicle_types.values[lot.type_codes[i]], lot.plates.values[lot.plate_ids[i]])
+
+    @property
+    def start_time(self):
+        if not self.lot.occupied[self.index]:
+            return None
+        return datetime.fromtimestamp(self.lot.start_times[self.index])
+
+    @property
+    def duration(self):
+        if not self.lot.occupied[self.index]:
+            return None
+        return self.lot.durations[self.index]
+
+    @property
+    def user(self):
+        return self.lot.users.values[self.lot.user_ids[self.index]]
+
+    @property
+    def zone(self):
+        return self.lot.zone_of(self.index)
+
+class InternTable:
+    # maps values to small integer ids; id 0 is reserved for None
+    def __init__(self):
+        self.values = [None]
+        self.ids = {}
+        self.refs = [0]
+        self.free_ids = []
+
+    def intern(self, key, value=None):
+        if key is None:
+            return 0
+        value = key if value is None else value
+        i = self.ids.get(key)
+        if i is None:
+            if self.free_ids:
+                i = self.free_ids.pop()
+                self.values[i] = value
+                self.refs[i] = 0
+            else:
+                i = len(self.values)
+                self.values.append(value)
+                self.refs.append(0)
+            self.ids[key] = i
+        else:
+            self.values[i] = value
+        self.refs[i] += 1
+        return i
+
+    def release(self, i, key):
+        if i == 0:
+            return
+        self.refs[i] -= 1
+        if self.refs[i] == 0:
+            del self.ids[key]
+            self.values[i] = None
+            self.free_ids.append(i)
+
+class SpotList:
+    # sequence of ParkingSpot views, built on access instead of stored
+    def __init__(self, lot):
+        self.lot = lot
+
+    def __len__(self):
+        return self.lot.num_spots
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [ParkingSpot(self.lot, j) for j in range(*i.indices(self.lot.num_spots))]
+        if i < 0:
+            i += self.lot.num_spots
+        if not 0 <= i < self.lot.num_spots:
+            raise IndexError("spot index out of range")
+        return ParkingSpot(self.lot, i)
+
+    def __iter__(self):
+        lot = self.lot
+        return (ParkingSpot(lot, i) for i in range(lot.num_spots))
 
 class ParkingLot:
-    def __init__(self, num_spots):
-        self.spots = [ParkingSpot(f"A{i+1}") for i in range(num_spots)]
+    def __init__(self, num_spots, prefix="A", zones=None, vehicle_types=None):
+        self.num_spots = num_spots
+        self.prefix = prefix
+        self.accepted_types = tuple(vehicle_types) if vehicle_types else None  # None: every vehicle type
+        # zones are consecutive runs of spots given as [(name, size), ...]; default is one zone
+        zones = zones or [(prefix, num_spots)]
+        if sum(size for _, size in zones) != num_spots:
+            raise ValueError("zone sizes must add up to num_spots")
+        self.zone_names = [name for name, _ in zones]
+        self.zone_starts = []
+        start = 0
+        for _, size in zones:
+            self.zone_starts.append(start)
+            start += size
+        self.spots = SpotList(self)
+        # one slot per spot in each array
+        self.occupied = bytearray(num_spots)
+        self.start_times = array('d', bytes(8 * num_spots))
+        self.durations = array('i', bytes(4 * num_spots))
+        self.type_codes = bytearray(num_spots)
+        self.plate_ids = array('i', bytes(4 * num_spots))
+        self.user_ids = array('i', bytes(4 * num_spots))
+        self.vehicle_types = InternTable()
+        self.plates = InternTable()
+        self.users = InternTable()
+        # positions >= free_cursor are candidates; freed positions below it go on the heap
+        self.free_cursor = 0
+        self.free_heap = []
+        self.in_heap = bytearray(num_spots)
+        self.free_count = num_spots
+        # Fenwick tree over the occupancy map, for range counts and k-th spot selection
+        self.occupied_tree = array('i', bytes(4 * (num_spots + 1)))
+        self.type_positions = {}  # vehicle type code -> sorted occupied positions
+        # plate indexes: exact, sorted for prefix search, and folded for misreads. A folded plate maps to
+        # its position, or to a tuple of positions when several parked plates fold the same way
+        self.plate_index = {}
+        self.sorted_plates = []
+        self.folded_plates = {}
+        self.user_positions = {}  # username -> sorted positions of that user's parked vehicles
+        self.listeners = []  # called as listener(spot_id, is_occupied) after every change
+        self.exiting = set()  # positions claimed by begin_exit(s) whose checkout is still being charged
+        # guards every change to the arrays and indexes; gates on other threads claim spots through
+        # try_occupy / claim_any, which check and take a spot in one step
+        self.lock = threading.RLock()
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
+    def notify(self, i, occupied):
+        if self.listeners:
+            spot_id = self.spot_id(i)
+            for listener in self.listeners:
+                listener(spot_id, occupied)
+
+    def spot_id(self, i):
+        return f"{self.prefix}{i+1}"
+
+    def spot_ids(self, positions):
+        # ids are formatted on demand rather than stored (a million id strings would outweigh the arrays),
+        # so list them in one pass with the prefix bound once
+        prefix = self.prefix
+        return [f"{prefix}{i + 1}" for i in positions]
+
+    def zone_of(self, i):
+        return self.zone_names[bisect_right(self.zone_starts, i) - 1]
+
+    def zone_range(self, zone):
+        z = self.zone_names.index(zone)
+        end = self.zone_starts[z + 1] if z + 1 < len(self.zone_starts) else self.num_spots
+        return self.zone_starts[z], end
+
+    def tree_add(self, i, delta):
+        tree, n = self.occupied_tree, self.num_spots
+        i += 1
+        while i <= n:
+            tree[i] += delta
+            i += i & -i
+
+    def occupied_before(self, i):
+        # number of occupied spots among positions [0, i)
+        tree, total = self.occupied_tree, 0
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def select(self, k, occupied):
+        # position of the k-th (0-based) occupied or free spot, walking down the Fenwick tree
+        tree, n = self.occupied_tree, self.num_spots
+        pos, step = 0, 1 << n.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= n:
+                count = tree[nxt] if occupied else step - tree[nxt]
+                if count <= k:
+                    pos, k = nxt, k - count
+            step >>= 1
+        return pos if pos < n else None
+
+    def spots_for_user(self, username, limit=None):
+        positions = self.user_positions.get(username, [])
+        return [ParkingSpot(self, i) for i in positions[:limit]]
+
+    def session_rows(self, username, limit=None):
+        # (spot id, plate, vehicle type, start time, zone) of the user's parked vehicles, read under the
+        # lock so a spot vacated meanwhile is simply not listed
+        with self.lock:
+            return [self.vehicle_row(i) + (self.start_times[i], self.zone_of(i))
+                    for i in self.user_positions.get(username, ())[:limit]]
+
+    def positions_for_user(self, username):
+        return list(self.user_positions.get(username, ()))
+
+    def is_owner(self, spot_id, username):
+        i = self.index_of(spot_id)
+        return i is not None and self.occupied[i] == 1 and self.users.ids.get(username, 0) == self.user_ids[i] != 0
+
+    def find_plate(self, plate):
+        i = self.plate_index.get(normalize_plate(plate))
+        return ParkingSpot(self, i) if i is not None else None
+
+    def search_plates(self, prefix, limit=20):
+        prefix = normalize_plate(prefix)
+        with self.lock:
+            plates = self.sorted_plates
+            k = bisect_left(plates, prefix)
+            matches = []
+            while k < len(plates) and len(matches) < limit and plates[k].startswith(prefix):
+                matches.append(ParkingSpot(self, self.plate_index[plates[k]]))
+                k += 1
+        return matches
+
+    def fuzzy_find_plate(self, plate, limit=20):
+        # spots whose plate matches up to confusable characters and at most one dropped, extra or
+        # misread character, ranked by plate_match_rank. One-edit variants of the read are generated and
+        # looked up, a few hundred dict probes, instead of indexing variants of every parked plate
+        normalized = normalize_plate(plate)
+        if not normalized:
+            return []
+        found = {}
+        with self.lock:
+            for key in one_edit_keys(fold_plate(normalized)):
+                held = self.folded_plates.get(key)
+                if held is None:
+                    continue
+                for i in held if type(held) is tuple else (held,):
+                    rank = plate_match_rank(normalized, normalize_plate(self.plates.values[self.plate_ids[i]]))
+                    if rank is not None:
+                        found[i] = rank
+        ranked = sorted(found, key=lambda i: (found[i], i))[:limit]
+        return [ParkingSpot(self, i) for i in ranked]
+
+    def plate_rows(self, plate, match="exact", limit=20):
+        # (spot id, plate, vehicle type) of the matches for match "exact", "prefix" or "fuzzy". The lookup
+        # and the reads happen under one hold of the lock, so readers off the writer thread never see a
+        # spot that was vacated in between
+        with self.lock:
+            if match == "prefix":
+                spots = self.search_plates(plate, limit)
+            elif match == "fuzzy":
+                spots = self.fuzzy_find_plate(plate, limit)
+            else:
+                spot = self.find_plate(plate)
+                spots = [spot] if spot is not None else []
+            return [self.vehicle_row(spot.index) for spot in spots]
+
+    def vehicle_row(self, i):
+        # callers hold the lock and know position i is occupied
+        return self.spot_id(i), self.plates.values[self.plate_ids[i]], self.vehicle_types.values[self.type_codes[i]]
+
+    def index_plate(self, i, plate):
+        normalized = normalize_plate(plate)
+        if not normalized:
+            return
+        if normalized not in self.plate_index:
+            insort(self.sorted_plates, normalized)
+        self.plate_index[normalized] = i
+        add_held(self.folded_plates, fold_plate(normalized), i)
+
+    def unindex_plate(self, i, plate):
+        normalized = normalize_plate(plate)
+        if not normalized:
+            return
+        if self.plate_index.get(normalized) == i:
+            del self.plate_index[normalized]
+            del self.sorted_plates[bisect_left(self.sorted_plates, normalized)]
+        remove_held(self.folded_plates, fold_plate(normalized), i)
+
+    def type_positions_for(self, vehicle_type):
+        return self.type_positions.get(self.vehicle_types.ids.get(vehicle_type), [])
+
+    def filtered_count(self, status=None, vehicle_type=None, zone=None):
+        # status is None, "Available" or "Occupied"; a vehicle type implies occupied spots
+        lo, hi = self.zone_range(zone) if zone else (0, self.num_spots)
+        if vehicle_type:
+            if status == "Available":
+                return 0
+            positions = self.type_positions_for(vehicle_type)
+            return bisect_left(positions, hi) - bisect_left(positions, lo)
+        if status is None:
+            return hi - lo
+        occupied = self.occupied_before(hi) - self.occupied_before(lo)
+        return occupied if status == "Occupied" else hi - lo - occupied
+
+    def filtered_positions(self, start, size, status=None, vehicle_type=None, zone=None):
+        # positions start .. start + size - 1 of the spots matching the filters, in spot order
+        lo, hi = self.zone_range(zone) if zone else (0, self.num_spots)
+        if vehicle_type:
+            if status == "Available":
+                return []
+            positions = self.type_positions_for(vehicle_type)
+            first = bisect_left(positions, lo) + start
+            return positions[first:min(bisect_left(positions, hi), first + size)]
+        if status is None:
+            return list(range(lo + start, min(hi, lo + start + size)))
+        occupied = status == "Occupied"
+        end = min(self.filtered_count(status, None, zone), start + size)
+        if start >= end:
+            return []
+        before = self.occupied_before(lo)
+        if not occupied:
+            before = lo - before
+        # one tree walk for the first row, then byte scans for the rest
+        positions = [self.select(before + start, occupied)]
+        flag = 1 if occupied else 0
+        for _ in range(end - start - 1):
+            positions.append(self.occupied.find(flag, positions[-1] + 1))
+        return positions
+
+    def counters(self):
+        occupied = self.num_spots - self.free_count
+        result = {"total": self.num_spots, "available": self.free_count, "occupied": occupied,
+                  "by_vehicle_type": {}, "by_zone": {}}
+        for code, positions in self.type_positions.items():
+            if positions:
+                result["by_vehicle_type"][self.vehicle_types.values[code]] = len(positions)
+        for zone in self.zone_names:
+            lo, hi = self.zone_range(zone)
+            zone_occupied = self.occupied_before(hi) - self.occupied_before(lo)
+            result["by_zone"][zone] = {"total": hi - lo, "occupied": zone_occupied,
+                                       "available": hi - lo - zone_occupied}
+        return result
+
+    def index_of(self, spot_id):
+        if not isinstance(spot_id, str) or not spot_id.startswith(self.prefix):
+            return None
+        number = spot_id[len(self.prefix):]
+        if not number.isdigit() or number[0] == "0":
+            return None
+        i = int(number) - 1
+        return i if i < self.num_spots else None
+
+    def get_spot(self, spot_id):
+        i = self.index_of(spot_id)
+        return ParkingSpot(self, i) if i is not None else None
+
+    def free_positions(self):
+        return list(compress(range(self.num_spots), self.occupied.translate(FLIP)))
+
+    def occupied_positions(self):
+        return list(compress(range(self.num_spots), self.occupied))
+
+    def free_spot_ids(self, limit=None):
+        # a limited listing stops at the limit-th free spot instead of listing them all first
+        with self.lock:
+            free_map = self.occupied.translate(FLIP)
+        free = compress(range(self.num_spots), free_map)
+        return self.spot_ids(free if limit is None else islice(free, limit))
+
+    def partition(self, positions=None):
+        # (lot, positions) pairs for batch work; a single lot is its own only shard
+        return [(self, self.occupied_positions() if positions is None else positions)]
+
+    def accepts_type(self, vehicle_type):
+        return self.accepted_types is None or vehicle_type in self.accepted_types
+
+    def accepts(self, spot_id, vehicle_type):
+        return self.accepts_type(vehicle_type)
 
     def get_available_spots(self):
-        return [spot for spot in self.spots if not spot.is_occupied]
-
-    def occupy_spot(self, spot_id, vehicle, duration, user):
-        for spot in self.spots:
-            if spot.id == spot_id:
-                spot.is_occupied = True
-                spot.vehicle = vehicle
-                spot.start_time = datetime.now()
-                spot.duration = duration
-                spot.user = user
-                break
+        return [ParkingSpot(self, i) for i in self.free_positions()]
+
+    def first_free_position(self):
+        occupied, heap = self.occupied, self.free_heap
+        while heap and occupied[heap[0]]:
+            self.in_heap[heapq.heappop(heap)] = 0
+        if self.free_cursor < self.num_spots and occupied[self.free_cursor]:
+            cursor = occupied.find(0, self.free_cursor)
+            self.free_cursor = self.num_spots if cursor == -1 else cursor
+        best = self.free_cursor if self.free_cursor < self.num_spots else None
+        if heap and (best is None or heap[0] < best):
+            best = heap[0]
+        return best
+
+    def first_available_spot(self, vehicle_type=None):
+        if vehicle_type is not None and not self.accepts_type(vehicle_type):
+            return None
+        with self.lock:
+            i = self.first_free_position()
+        return ParkingSpot(self, i) if i is not None else None
+
+    def available_count(self, vehicle_type=None):
+        return self.free_count if vehicle_type is None or self.accepts_type(vehicle_type) else 0
+
+    def occupy_spot(self, spot_id, vehicle, duration, user, start_time=None):
+        # replaces whatever is parked at the spot; gates should use try_occupy
+        i = self.index_of(spot_id)
+        if i is None:
+            return False
+        with self.lock:
+            self.occupy_position(i, vehicle, duration, user, start_time)
+        return True
+
+    def try_occupy(self, spot_id, vehicle, duration, user, start_time=None, unique_plate=False):
+        # compare-and-set: takes the spot only if it is still free; returns whether it did. With
+        # unique_plate, a plate already parked here raises DuplicatePlateError instead
+        i = self.index_of(spot_id)
+        if i is None:
+            return False
+        with self.lock:
+            if unique_plate:
+                self.check_plate(vehicle)
+            if self.occupied[i]:
+                return False
+            self.occupy_position(i, vehicle, duration, user, start_time)
+        return True
+
+    def claim_any(self, vehicle, duration, user, start_time=None, unique_plate=False):
+        # takes the first free spot; returns it, or None when the lot is full or does not take the vehicle
+        if vehicle is not None and not self.accepts_type(vehicle.type):
+            return None
+        with self.lock:
+            if unique_plate:
+                self.check_plate(vehicle)
+            i = self.first_free_position()
+            if i is None:
+                return None
+            self.occupy_position(i, vehicle, duration, user, start_time)
+        return ParkingSpot(self, i)
+
+    def check_plate(self, vehicle):
+        # callers hold the lock, so no other gate can park the plate between this check and their claim
+        i = self.plate_index.get(normalize_plate(vehicle.license_plate)) if vehicle is not None else None
+        if i is not None:
+            raise DuplicatePlateError(f"Vehicle {vehicle.license_plate} is already parked in spot {self.spot_id(i)}.")
+
+    def begin_exit(self, spot_id, username):
+        # claims username's session at the spot for checkout; returns (vehicle type, start time), or None if
+        # the spot is not theirs or another exit already claimed it. The vehicle stays parked, so the
+        # spot cannot be handed out, until end_exit
+        i = self.index_of(spot_id)
+        if i is None:
+            return None
+        with self.lock:
+            if i in self.exiting or not self.is_owner(spot_id, username):
+                return None
+            self.exiting.add(i)
+            return self.vehicle_types.values[self.type_codes[i]], self.start_times[i]
+
+    def begin_exits(self, positions=None, username=None):
+        # batch begin_exit over positions (default: every occupied spot), only username's sessions if given;
+        # returns the positions claimed, in order
+        with self.lock:
+            if positions is None:
+                positions = compress(range(self.num_spots), self.occupied)
+            owner_id = self.users.ids.get(username, 0) if username is not None else None
+            occupied, user_ids, exiting = self.occupied, self.user_ids, self.exiting
+            claimed = [i for i in positions if occupied[i] and i not in exiting
+                       and (owner_id is None or user_ids[i] == owner_id)]
+            exiting.update(claimed)
+        return claimed
+
+    def end_exit(self, spot_id, vacate):
+        # releases a begin_exit(s) claim, vacating the spot if the checkout was paid; returns whether it
+        # vacated. A claim already dropped by a forced vacate or occupy leaves the spot alone
+        i = self.index_of(spot_id)
+        if i is None:
+            return False
+        with self.lock:
+            if i not in self.exiting:
+                return False
+            self.exiting.discard(i)
+            if vacate:
+                self.vacate_position(i)
+            return vacate
+
+    def end_exits(self, positions, vacate):
+        # batch end_exit under one hold of the lock; returns how many spots were vacated
+        vacated = 0
+        with self.lock:
+            exiting = self.exiting
+            for i in positions:
+                if i in exiting:
+                    exiting.discard(i)
+                    if vacate:
+                        self.vacate_position(i)
+                        vacated += 1
+        return vacated
+
+    def occupy_position(self, i, vehicle, duration, user, start_time):
+        # convert the values first, as the arrays would: one out of range (a duration past int32, a 256th
+        # vehicle type) raises here, before anything in the lot has changed
+        start_time = array('d', [time.time() if start_time is None else start_time])[0]
+        duration = array('i', [duration or 0])[0]
+        if vehicle is not None and vehicle.type not in self.vehicle_types.ids and len(self.vehicle_types.values) > 255:
+            raise ValueError("too many vehicle types")
+        if self.occupied[i]:
+            self.release(i)
+        else:
+            self.free_count -= 1
+            self.tree_add(i, 1)
+        self.occupied[i] = 1
+        self.start_times[i] = start_time
+        self.durations[i] = duration
+        if vehicle is not None:
+            self.type_codes[i] = self.vehicle_types.intern(vehicle.type)
+            self.plate_ids[i] = self.plates.intern(vehicle.license_plate)
+            insort(self.type_positions.setdefault(self.type_codes[i], []), i)
+            self.index_plate(i, vehicle.license_plate)
+        if user is not None:
+            self.user_ids[i] = self.users.intern(user.username, user)
+            insort(self.user_positions.setdefault(user.username, []), i)
+        self.notify(i, True)
 
     def vacate_spot(self, spot_id):
-        for spot in self.spots:
-            if spot.id == spot_id:
-                spot.is_occupied = False
-                spot.vehicle = None
-                spot.start_time = None
-                spot.duration = None
-                spot.user = None
-                break
+        # returns whether a vehicle was there to remove
+        i = self.index_of(spot_id)
+        if i is None:
+            return False
+        with self.lock:
+            if not self.occupied[i]:
+                return False
+            self.vacate_position(i)
+        return True
+
+    def vacate_position(self, i):
+        # callers hold the lock and know position i is occupied
+        self.release(i)
+        self.occupied[i] = 0
+        self.free_count += 1
+        self.tree_add(i, -1)
+        if i < self.free_cursor and not self.in_heap[i]:
+            self.in_heap[i] = 1
+            heapq.heappush(self.free_heap, i)
+        self.notify(i, False)
+
+    def release(self, i):
+        # drop the interned references held by position i, and any exit claim on the session that ends
+        # here; vehicle type codes are never recycled
+        self.exiting.discard(i)
+        positions = self.type_positions.get(self.type_codes[i])
+        if positions:
+            del positions[bisect_left(positions, i)]
+        plate = self.plates.values[self.plate_ids[i]]
+        self.unindex_plate(i, plate)
+        self.plates.release(self.plate_ids[i], plate)
+        user = self.users.values[self.user_ids[i]]
+        if user is not None:
+            positions = self.user_positions[user.username]
+            del positions[bisect_left(positions, i)]
+            if not positions:
+                del self.user_positions[user.username]
+            self.users.release(self.user_ids[i], user.username)
+        self.type_codes[i] = 0
+        self.plate_ids[i] = 0
+        self.user_ids[i] = 0
+        self.start_times[i] = 0.0
+        self.durations[i] = 0
+
+# the calls that search or scan; claims and the O(1) updates cost less than the timer would
+metrics.instrument(ParkingLot, "lot", ("first_available_spot", "filtered_positions", "filtered_count", "counters",
+                                      "search_plates", "fuzzy_find_plate", "free_positions", "occupied_positions"))
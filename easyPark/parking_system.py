@@ -1,22 +1,92 @@
 # parking_system.py
+import logging
 import tkinter as tk
-import hashlib
-from datetime import datetime
 from tkinter import ttk, messagebox
-from database import Database
-from vehicle import Vehicle
-from parking_spot import ParkingLot
+import metrics
+from errors import ParkingError
+
+WATCH_ROWS = 20  # rows materialized in the Watch Spots view
+DROPDOWN_LIMIT = 500  # spot ids listed in a dropdown; any other id can still be typed in
+OVERSTAY_ROWS = 200  # longest-overdue sessions shown in the Overstays tab
+EXPIRY_POLL_MS = 1000  # how often due overstay events are fired
+SERVICES_FALLBACK_MS = 500  # start the services anyway if the window has not been mapped by then
+
+log = logging.getLogger("easypark.ui")
 
 class ParkingSystem(tk.Tk):
-    def __init__(self):
+    def __init__(self, num_spots=10, db_path='parking_system.db', tariff_path=None, ledger_path=None,
+                 overstay_grace=900, auto_charge_after=None):
         super().__init__()
         self.title("EasyPark")
         self.geometry("800x600")
-        self.parking_lot = ParkingLot(10)
-        self.rates = {"car": 5, "motorcycle": 3}
-        self.db = Database()
+        self.num_spots = num_spots
+        self.db_path = db_path
+        self.tariff_path = tariff_path
+        self.ledger_path = ledger_path
+        self.overstay_grace = overstay_grace
+        self.auto_charge_after = auto_charge_after
+        # the lot, database and engine are set up by start_services once the window is on screen
+        self.parking_lot = self.db = self.engine = self.background = None
+        self.services_started = False
+        self.service_buttons = []  # disabled until start_services has finished
         self.current_user = None
         self.create_widgets()
+        self.bind("<Map>", self.on_map)
+        # a window started withdrawn or iconified is never mapped
+        self.after(SERVICES_FALLBACK_MS, self.start_services)
+
+    def on_map(self, event):
+        # the toplevel's bindings also see its children being mapped
+        if event.widget is self:
+            self.unbind("<Map>")
+            self.after_idle(self.start_services)
+
+    def start_services(self):
+        # the engine's imports (NumPy too, when installed), opening the database and the ledger and
+        # restoring parked vehicles all wait until the first paint; runs once, from <Map> or the fallback
+        if self.services_started:
+            return
+        self.services_started = True
+        from concurrent.futures import ThreadPoolExecutor
+        from database import Database
+        from expiry import ExpiryScheduler
+        from ledger import Ledger
+        from parking_engine import ParkingEngine
+        from parking_spot import ParkingLot
+        from tariff import load_tariff
+        self.update_idletasks()
+        self.parking_lot = ParkingLot(self.num_spots)
+        self.db = Database(self.db_path)
+        self.engine = ParkingEngine(self.parking_lot, self.db,
+                                    tariff=load_tariff(self.tariff_path) if self.tariff_path else None,
+                                    ledger=Ledger(self.ledger_path) if self.ledger_path else None)
+        self.engine.restore_sessions()
+        # after the restore, so the restored sessions go into its heap with one heapify
+        self.engine.expiry = ExpiryScheduler(self.parking_lot, self.overstay_grace, self.auto_charge_after)
+        self.after(EXPIRY_POLL_MS, self.check_expiry)
+        self.background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="easypark-ui")
+        # widgets follow the lot through change events instead of full rebuilds
+        self.parking_lot.subscribe(self.on_spot_changed)
+        self.build_tab(self.notebook.select())
+        for button in self.service_buttons:
+            button.configure(state="normal")
+
+    def service_button(self, parent, **options):
+        # a button whose command needs the engine: disabled until the services are up
+        button = ttk.Button(parent, state="normal" if self.engine is not None else "disabled", **options)
+        if self.engine is None:
+            self.service_buttons.append(button)
+        return button
+
+    def run_in_background(self, fn, on_done, *args):
+        # slow work (password hashing) runs off the Tk thread; on_done gets the Future back on it
+        future = self.background.submit(fn, *args)
+        def poll():
+            if future.done():
+                on_done(future)
+            else:
+                self.after(20, poll)
+        self.after(20, poll)
 
     def create_widgets(self):
         self.notebook = ttk.Notebook(self)
@@ -28,6 +98,7 @@ class ParkingSystem(tk.Tk):
         self.watch_frame = ttk.Frame(self.notebook)
         self.exit_frame = ttk.Frame(self.notebook)
         self.account_frame = ttk.Frame(self.notebook)
+        self.overstay_frame = ttk.Frame(self.notebook)
 
         self.notebook.add(self.login_frame, text="Login")
         self.notebook.add(self.signup_frame, text="Sign Up")
@@ -35,13 +106,35 @@ class ParkingSystem(tk.Tk):
         self.notebook.add(self.watch_frame, text="Watch Spots")
         self.notebook.add(self.exit_frame, text="Exit Parking")
         self.notebook.add(self.account_frame, text="Account")
+        self.notebook.add(self.overstay_frame, text="Overstays")
 
+        # only the login tab is built up front; the others are built the first time they are shown
         self.create_login_widgets()
-        self.create_signup_widgets()
-        self.create_parking_widgets()
-        self.create_watch_widgets()
-        self.create_exit_widgets()
-        self.create_account_widgets()
+        self.tab_builders = {str(self.signup_frame): self.create_signup_widgets,
+                             str(self.parking_frame): self.create_parking_widgets,
+                             str(self.watch_frame): self.create_watch_widgets,
+                             str(self.exit_frame): self.create_exit_widgets,
+                             str(self.account_frame): self.create_account_widgets,
+                             str(self.overstay_frame): self.create_overstay_widgets}
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+        self.refresh_scheduled = False
+
+    def on_tab_changed(self, event):
+        if self.engine is not None:
+            self.build_tab(self.notebook.select())
+
+    def build_tab(self, tab):
+        builder = self.tab_builders.pop(tab, None)
+        if builder is not None:
+            builder()
+
+    def is_built(self, frame):
+        return str(frame) not in self.tab_builders
+
+    def show_tab(self, index):
+        # select() only queues <<NotebookTabChanged>>; build now so callers can use the tab's widgets
+        self.notebook.select(index)
+        self.build_tab(self.notebook.select())
 
     def create_login_widgets(self): #login tab
         ttk.Label(self.login_frame, text="Username:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
@@ -52,7 +145,7 @@ class ParkingSystem(tk.Tk):
         self.login_password_var = tk.StringVar()
         ttk.Entry(self.login_frame, textvariable=self.login_password_var, show="*").grid(row=1, column=1, padx=5, pady=5)
 
-        ttk.Button(self.login_frame, text="Login", command=self.login).grid(row=2, column=0, columnspan=2, padx=5, pady=5)
+        self.service_button(self.login_frame, text="Login", command=self.login).grid(row=2, column=0, columnspan=2, padx=5, pady=5)
 
     def create_signup_widgets(self): #signup tab
         ttk.Label(self.signup_frame, text="Username:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
@@ -63,12 +156,13 @@ class ParkingSystem(tk.Tk):
         self.signup_password_var = tk.StringVar()
         ttk.Entry(self.signup_frame, textvariable=self.signup_password_var, show="*").grid(row=1, column=1, padx=5, pady=5)
 
-        ttk.Button(self.signup_frame, text="Sign Up", command=self.signup).grid(row=2, column=0, columnspan=2, padx=5, pady=5)
+        self.service_button(self.signup_frame, text="Sign Up", command=self.signup).grid(row=2, column=0, columnspan=2, padx=5, pady=5)
 
     def create_parking_widgets(self): #show available spots
         ttk.Label(self.parking_frame, text="Available Spots:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
         self.available_spots_var = tk.StringVar()
-        self.available_spots_dropdown = ttk.Combobox(self.parking_frame, textvariable=self.available_spots_var)
+        self.available_spots_dropdown = ttk.Combobox(self.parking_frame, textvariable=self.available_spots_var,
+                                                     postcommand=self.fill_available_spots)
         self.available_spots_dropdown.grid(row=0, column=1, padx=5, pady=5)
         self.update_available_spots()
 
@@ -93,19 +187,43 @@ class ParkingSystem(tk.Tk):
         ttk.Button(self.parking_frame, text="Park Vehicle", command=self.park_vehicle).grid(row=6, column=0, columnspan=2, padx=5, pady=5)
 
     def create_watch_widgets(self):
-        self.watch_tree = ttk.Treeview(self.watch_frame, columns=("Spot", "Status"), show="headings")
-        self.watch_tree.heading("Spot", text="Spot")
-        self.watch_tree.heading("Status", text="Status")
-        self.watch_tree.grid(row=0, column=0, padx=5, pady=5)
-
-        ttk.Button(self.watch_frame, text="Refresh", command=self.update_watch_list).grid(row=2, column=0, padx=5, pady=5)
-
+        filters = ttk.Frame(self.watch_frame)
+        filters.grid(row=0, column=0, columnspan=2, padx=5, pady=5, sticky="w")
+        self.watch_status_var = tk.StringVar(value="All")
+        self.watch_vehicle_var = tk.StringVar(value="All")
+        self.watch_zone_var = tk.StringVar(value="All")
+        for column, (label, var, values) in enumerate([
+                ("Status:", self.watch_status_var, ["All", "Available", "Occupied"]),
+                ("Vehicle:", self.watch_vehicle_var, ["All"] + list(self.engine.rates)),
+                ("Zone:", self.watch_zone_var, ["All"] + self.parking_lot.zone_names)]):
+            ttk.Label(filters, text=label).grid(row=0, column=2 * column, padx=5, sticky="w")
+            ttk.Combobox(filters, textvariable=var, values=values, state="readonly", width=10).grid(row=0, column=2 * column + 1, padx=5)
+            var.trace_add("write", self.reset_watch_view)
+
+        self.watch_counts_var = tk.StringVar()
+        ttk.Label(self.watch_frame, textvariable=self.watch_counts_var).grid(row=1, column=0, columnspan=2, padx=5, sticky="w")
+
+        # only WATCH_ROWS rows exist; scrolling re-fills them from the lot's indexes
+        self.watch_tree = ttk.Treeview(self.watch_frame, columns=("Spot", "Status", "Vehicle", "Zone"),
+                                       show="headings", height=WATCH_ROWS)
+        for column in ("Spot", "Status", "Vehicle", "Zone"):
+            self.watch_tree.heading(column, text=column)
+        self.watch_tree.grid(row=2, column=0, padx=5, pady=5)
+        self.watch_scrollbar = ttk.Scrollbar(self.watch_frame, orient="vertical", command=self.scroll_watch_view)
+        self.watch_scrollbar.grid(row=2, column=1, pady=5, sticky="ns")
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.watch_tree.bind(sequence, self.on_watch_wheel)
+
+        ttk.Button(self.watch_frame, text="Refresh", command=self.update_watch_list).grid(row=3, column=0, padx=5, pady=5)
+
+        self.watch_offset = 0
         self.update_watch_list()
 
     def create_exit_widgets(self):
-        ttk.Label(self.exit_frame, text="Occupied Spots:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
+        ttk.Label(self.exit_frame, text="My Vehicles:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
         self.exit_spots_var = tk.StringVar()
-        self.exit_spots_dropdown = ttk.Combobox(self.exit_frame, textvariable=self.exit_spots_var)
+        self.exit_spots_dropdown = ttk.Combobox(self.exit_frame, textvariable=self.exit_spots_var,
+                                                postcommand=self.fill_exit_spots)
         self.exit_spots_dropdown.grid(row=0, column=1, padx=5, pady=5)
 
         ttk.Button(self.exit_frame, text="Calculate Fee", command=self.calculate_exit_fee).grid(row=1, column=0, columnspan=2, padx=5, pady=5)
@@ -114,6 +232,7 @@ class ParkingSystem(tk.Tk):
         ttk.Label(self.exit_frame, textvariable=self.exit_fee_var).grid(row=2, column=0, columnspan=2, padx=5, pady=5)
 
         ttk.Button(self.exit_frame, text="Pay and Exit", command=self.pay_and_exit).grid(row=3, column=0, columnspan=2, padx=5, pady=5)
+        ttk.Button(self.exit_frame, text="Pay and Exit All", command=self.pay_and_exit_all).grid(row=4, column=0, columnspan=2, padx=5, pady=5)
 
         self.update_exit_spots()
 
@@ -132,42 +251,56 @@ class ParkingSystem(tk.Tk):
         # Logout
         ttk.Button(self.account_frame, text="Logout", command=self.logout).grid(row=3, column=0, columnspan=2, padx=5, pady=5)
 
+        self.update_balance_display()
+
+    def create_overstay_widgets(self): #live overstay list for enforcement staff
+        self.overstay_count_var = tk.StringVar()
+        ttk.Label(self.overstay_frame, textvariable=self.overstay_count_var).grid(row=0, column=0, padx=5, sticky="w")
+        columns = ("Spot", "Plate", "User", "Overdue", "Status")
+        self.overstay_tree = ttk.Treeview(self.overstay_frame, columns=columns, show="headings", height=WATCH_ROWS)
+        for column in columns:
+            self.overstay_tree.heading(column, text=column)
+        self.overstay_tree.grid(row=1, column=0, padx=5, pady=5)
+        self.update_overstay_list()
+
     def login(self):
         username = self.login_username_var.get()
         password = self.login_password_var.get()
-        user = self.db.get_user(username)
-        if user and user.password_hash == self.hash_password(password):
-            self.current_user = user
-            self.update_balance_display()
-            messagebox.showinfo("Success", f"Welcome, {username}!")
-            self.notebook.select(2)  # Switch to parking tab
-        else:
-            messagebox.showerror("Error", "Invalid username or password")
+        self.run_in_background(self.engine.authenticate, self.login_finished, username, password)
+
+    def login_finished(self, future):
+        try:
+            self.current_user = future.result()
+        except ParkingError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.update_balance_display()
+        self.update_exit_spots()
+        messagebox.showinfo("Success", f"Welcome, {self.current_user.username}!")
+        self.show_tab(2)  # Switch to parking tab
 
     def signup(self):
         username = self.signup_username_var.get()
         password = self.signup_password_var.get()
-        if not username or not password:
-            messagebox.showerror("Error", "Username and password are required")
-            return
-        if self.db.get_user(username):
-            messagebox.showerror("Error", "Username already exists")
+        self.run_in_background(self.engine.register, self.signup_finished, username, password)
+
+    def signup_finished(self, future):
+        try:
+            future.result()
+        except ParkingError as e:
+            messagebox.showerror("Error", str(e))
             return
-        password_hash = self.hash_password(password)
-        self.db.add_user(username, password_hash)
         messagebox.showinfo("Success", "Account created successfully")
-        self.notebook.select(0)  # Switch to login tab
+        self.show_tab(0)  # Switch to login tab
 
     def logout(self):
         self.current_user = None  # Clear the logged-in user
+        self.update_exit_spots()
         messagebox.showinfo("Logout", "You have been logged out successfully.")
-        self.notebook.select(0)  # Switch back to the login tab
-
-    def hash_password(self, password):
-        return hashlib.sha256(password.encode()).hexdigest()
+        self.show_tab(0)  # Switch back to the login tab
 
     def update_balance_display(self):
-        if self.current_user:
+        if self.current_user and self.is_built(self.account_frame):
             self.balance_var.set(f"${self.current_user.balance:.2f}")
 
     def add_funds_gcash(self):
@@ -177,125 +310,191 @@ class ParkingSystem(tk.Tk):
         self.add_funds("Card")
 
     def add_funds(self, method):
-        if not self.current_user:
-            messagebox.showerror("Error", "Please log in first")
-            return
         try:
-            amount = float(self.add_funds_var.get())
-            if amount <= 0:
-                raise ValueError
-            self.current_user.balance += amount
-            self.db.update_balance(self.current_user.username, self.current_user.balance)
-            self.update_balance_display()
-            messagebox.showinfo("Success", f"${amount:.2f} added to your account via {method}")
-            self.add_funds_var.set("")
-        except ValueError:
-            messagebox.showerror("Error", "Please enter a valid amount")
+            amount = self.engine.top_up(self.current_user, self.add_funds_var.get(), method)
+        except ParkingError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.update_balance_display()
+        messagebox.showinfo("Success", f"${amount:.2f} added to your account via {method}")
+        self.add_funds_var.set("")
 
     def update_available_spots(self):
-        available_spots = self.parking_lot.get_available_spots()
-        self.available_spots_dropdown['values'] = [spot.id for spot in available_spots]
-        if available_spots:
-            self.available_spots_dropdown.set(available_spots[0].id)
-        else:
-            self.available_spots_dropdown.set('')
+        # the dropdown list is rebuilt only when it is opened; here just keep a valid selection
+        if not self.is_built(self.parking_frame):
+            return
+        self.available_spots_stale = True
+        spot = self.parking_lot.get_spot(self.available_spots_var.get())
+        if spot is None or spot.is_occupied:
+            first_spot = self.parking_lot.first_available_spot()
+            self.available_spots_dropdown.set(first_spot.id if first_spot else '')
+
+    def fill_available_spots(self):
+        if self.available_spots_stale:
+            lot = self.parking_lot
+            positions = lot.filtered_positions(0, DROPDOWN_LIMIT, status="Available")
+            self.available_spots_dropdown['values'] = lot.spot_ids(positions)
+            self.available_spots_stale = False
 
     def calculate_cost(self):
         try:
-            duration = int(self.duration_var.get())
-            vehicle_type = self.vehicle_type_var.get()
-            cost = self.rates[vehicle_type] * duration
-            self.cost_var.set(f"Estimated Cost: ${cost:.2f}")
-        except ValueError:
-            messagebox.showerror("Error", "Please enter a valid duration.")
+            spot = self.parking_lot.get_spot(self.available_spots_var.get())
+            cost = self.engine.quote(self.vehicle_type_var.get(), self.duration_var.get(), spot.zone if spot else None)
+        except ParkingError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.cost_var.set(f"Estimated Cost: ${cost:.2f}")
 
     def park_vehicle(self):
-        if not self.current_user:
-            messagebox.showerror("Error", "Please log in first")
-            return
         spot_id = self.available_spots_var.get()
-        vehicle_type = self.vehicle_type_var.get()
-        license_plate = self.license_plate_var.get()
         try:
-            duration = int(self.duration_var.get())
-        except ValueError:
-            messagebox.showerror("Error", "Please enter a valid duration.")
+            self.engine.park(self.current_user, spot_id, self.vehicle_type_var.get(),
+                             self.license_plate_var.get(), self.duration_var.get())
+        except ParkingError as e:
+            messagebox.showerror("Error", str(e))
             return
+        messagebox.showinfo("Success", f"Vehicle parked in spot {spot_id}.")
 
-        if not spot_id or not license_plate:
-            messagebox.showerror("Error", "Please select a spot and enter a license plate.")
-            return
+    def on_spot_changed(self, spot_id, occupied):
+        if not self.refresh_scheduled:
+            self.refresh_scheduled = True
+            self.after_idle(self.refresh_after_change)
 
-        cost = self.rates[vehicle_type] * duration
-        if self.current_user.balance < cost:
-            messagebox.showerror("Error", "Insufficient balance. Please add funds to your account.")
-            return
-
-        vehicle = Vehicle(vehicle_type, license_plate)
-        self.parking_lot.occupy_spot(spot_id, vehicle, duration, self.current_user)
-        messagebox.showinfo("Success", f"Vehicle parked in spot {spot_id}.")
-        self.update_available_spots()
+    def refresh_after_change(self):
         self.update_watch_list()
+        self.update_available_spots()
         self.update_exit_spots()
+        self.update_overstay_list()
 
-    def update_watch_list(self):
-        for item in self.watch_tree.get_children():
-            self.watch_tree.delete(item)
+    def check_expiry(self):
+        # due events come off the engine's deadline heap; the list only redraws when something fired.
+        # A failed run is logged and the next one still scheduled, so enforcement never stops quietly
+        try:
+            if self.engine.enforce():
+                self.update_overstay_list()
+        except Exception:
+            log.exception("overstay enforcement failed")
+        finally:
+            self.after(EXPIRY_POLL_MS, self.check_expiry)
+
+    def update_overstay_list(self):
+        if not self.is_built(self.overstay_frame):
+            return
+        overstays = self.engine.expiry.overstays(OVERSTAY_ROWS)
+        now = self.engine.clock()
+        self.overstay_tree.delete(*self.overstay_tree.get_children())
+        for record in overstays:
+            overdue = int(now - record["deadline"]) // 60
+            self.overstay_tree.insert("", "end", values=(record["spot"], record["plate"], record["user"] or "",
+                                                         f"{overdue // 60}h {overdue % 60:02d}m",
+                                                         record["stage"].replace("_", " ")))
+        self.overstay_count_var.set(f"Overstaying: {len(self.engine.expiry.live)}")
+
+    def watch_filters(self):
+        return tuple(None if var.get() == "All" else var.get()
+                     for var in (self.watch_status_var, self.watch_vehicle_var, self.watch_zone_var))
+
+    def reset_watch_view(self, *args):
+        self.watch_offset = 0
+        self.update_watch_list()
+
+    def scroll_watch_view(self, action, amount, unit=None):
+        if action == "moveto":
+            self.watch_offset = int(float(amount) * self.parking_lot.filtered_count(*self.watch_filters()))
+        else:
+            self.watch_offset += int(amount) * (WATCH_ROWS if unit == "pages" else 1)
+        self.update_watch_list()
 
-        for spot in self.parking_lot.spots:
-            status = "Occupied" if spot.is_occupied else "Available"
-            self.watch_tree.insert("", "end", values=(spot.id, status))
+    def on_watch_wheel(self, event):
+        direction = -1 if event.num == 4 or getattr(event, "delta", 0) > 0 else 1
+        self.scroll_watch_view("scroll", 3 * direction, "units")
+        return "break"
 
-    def update_exit_spots(self):
-        occupied_spots = [spot.id for spot in self.parking_lot.spots if spot.is_occupied]
-        self.exit_spots_dropdown['values'] = occupied_spots
-        if occupied_spots:
-            self.exit_spots_dropdown.set(occupied_spots[0])
+    def update_watch_list(self):
+        # re-fills the visible window from the lot's indexes: O(WATCH_ROWS log n), whatever the lot size
+        self.refresh_scheduled = False
+        if not self.is_built(self.watch_frame):
+            return
+        lot = self.parking_lot
+        filters = self.watch_filters()
+        total = lot.filtered_count(*filters)
+        self.watch_offset = max(0, min(self.watch_offset, total - WATCH_ROWS))
+        positions = lot.filtered_positions(self.watch_offset, WATCH_ROWS, *filters)
+
+        rows = self.watch_tree.get_children()
+        for row, i in zip(rows, positions):
+            self.watch_tree.item(row, values=self.watch_row(i))
+        for i in positions[len(rows):]:
+            self.watch_tree.insert("", "end", values=self.watch_row(i))
+        if len(rows) > len(positions):
+            self.watch_tree.delete(*rows[len(positions):])
+
+        if total:
+            self.watch_scrollbar.set(self.watch_offset / total, (self.watch_offset + len(positions)) / total)
         else:
+            self.watch_scrollbar.set(0, 1)
+        counters = lot.counters()
+        by_type = "  ".join(f"{vehicle_type}: {count}" for vehicle_type, count in counters["by_vehicle_type"].items())
+        self.watch_counts_var.set(f"Total: {counters['total']}  Available: {counters['available']}  "
+                                  f"Occupied: {counters['occupied']}  {by_type}  |  Matching: {total}")
+
+    def watch_row(self, i):
+        spot = self.parking_lot.spots[i]
+        vehicle = spot.vehicle
+        return (spot.id, "Occupied" if spot.is_occupied else "Available", vehicle.type if vehicle else "", spot.zone)
+
+    # the Exit tab only lists the logged-in user's own vehicles
+    def update_exit_spots(self):
+        if not self.is_built(self.exit_frame):
+            return
+        self.exit_spots_stale = True
+        if self.current_user is None:
             self.exit_spots_dropdown.set('')
+        elif not self.parking_lot.is_owner(self.exit_spots_var.get(), self.current_user.username):
+            spots = self.parking_lot.spots_for_user(self.current_user.username, 1)
+            self.exit_spots_dropdown.set(spots[0].id if spots else '')
+
+    def fill_exit_spots(self):
+        if self.exit_spots_stale:
+            if self.current_user is None:
+                self.exit_spots_dropdown['values'] = []
+            else:
+                spots = self.parking_lot.spots_for_user(self.current_user.username, DROPDOWN_LIMIT)
+                self.exit_spots_dropdown['values'] = [spot.id for spot in spots]
+            self.exit_spots_stale = False
 
     def calculate_exit_fee(self):
-        spot_id = self.exit_spots_var.get()
-        if not spot_id:
-            messagebox.showerror("Error", "Please select an occupied spot.")
+        try:
+            fee = self.engine.exit_quote(self.exit_spots_var.get())
+        except ParkingError as e:
+            messagebox.showerror("Error", str(e))
             return
-
-        spot = next((spot for spot in self.parking_lot.spots if spot.id == spot_id), None)
-        if spot and spot.is_occupied:
-            elapsed_time = datetime.now() - spot.start_time
-            hours_parked = elapsed_time.total_seconds() / 3600
-            fee = self.rates[spot.vehicle.type] * hours_parked
-            self.exit_fee_var.set(f"Parking Fee: ${fee:.2f}")
-        else:
-            messagebox.showerror("Error", "Invalid spot selection.")
+        self.exit_fee_var.set(f"Parking Fee: ${fee:.2f}")
 
     def pay_and_exit(self):
-        if not self.current_user:
-            messagebox.showerror("Error", "Please log in first")
-            return
         spot_id = self.exit_spots_var.get()
-        if not spot_id:
-            messagebox.showerror("Error", "Please select an occupied spot.")
+        try:
+            fee = self.engine.exit_and_charge(self.current_user, spot_id)
+        except ParkingError as e:
+            messagebox.showerror("Error", str(e))
             return
+        self.update_balance_display()
+        messagebox.showinfo("Success", f"Vehicle has exited from spot {spot_id}. ${fee:.2f} deducted from your account.")
+        self.exit_fee_var.set("")
 
-        spot = next((spot for spot in self.parking_lot.spots if spot.id == spot_id), None)
-        if spot and spot.is_occupied and spot.user == self.current_user:
-            elapsed_time = datetime.now() - spot.start_time
-            hours_parked = elapsed_time.total_seconds() / 3600
-            fee = self.rates[spot.vehicle.type] * hours_parked
-
-            if self.current_user.balance < fee:
-                messagebox.showerror("Error", "Insufficient balance. Please add funds to your account.")
-                return
-
-            self.current_user.balance -= fee
-            self.db.update_balance(self.current_user.username, self.current_user.balance)
-            self.update_balance_display()
-            self.parking_lot.vacate_spot(spot_id)
-            messagebox.showinfo("Success", f"Vehicle has exited from spot {spot_id}. ${fee:.2f} deducted from your account.")
-            self.update_available_spots()
-            self.update_watch_list()
-            self.update_exit_spots()
-            self.exit_fee_var.set("")
-        else:
-            messagebox.showerror("Error", "Invalid spot selection or you don't have permission to exit this vehicle.")
+    def pay_and_exit_all(self):
+        try:
+            spot_ids, total = self.engine.exit_all(self.current_user)
+        except ParkingError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.update_balance_display()
+        messagebox.showinfo("Success", f"{len(spot_ids)} vehicles have exited. ${total:.2f} deducted from your account.")
+        self.exit_fee_var.set("")
+
+# the Tk thread's view of a transaction: button handlers and the refreshes that redraw after them
+metrics.instrument(ParkingSystem, "ui", ("login", "login_finished", "signup_finished", "add_funds", "park_vehicle",
+                                         "pay_and_exit", "pay_and_exit_all", "calculate_cost", "calculate_exit_fee",
+                                         "refresh_after_change", "update_watch_list", "update_available_spots",
+                                         "fill_available_spots", "update_exit_spots", "fill_exit_spots",
+                                         "update_overstay_list"))
@@ -0,0 +1,50 @@
+#passwords.py
+# salted, versioned password hashes: "scheme$cost$salt$hash"
+import hashlib
+import hmac
+import secrets
+import metrics
+
+SCHEMES = ("scrypt", "pbkdf2_sha256")
+DEFAULT_COSTS = {"scrypt": 14, "pbkdf2_sha256": 600000}  # log2(N) for scrypt, iterations for PBKDF2
+
+def derive(scheme, cost, password, salt):
+    if scheme == "scrypt":
+        # 128 * r * N bytes of memory: 16 MB at cost 14
+        return hashlib.scrypt(password.encode(), salt=salt, n=2 ** cost, r=8, p=1, maxmem=2 ** (cost + 11), dklen=32)
+    if scheme == "pbkdf2_sha256":
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, cost)
+    raise ValueError(f"unknown password scheme: {scheme}")
+
+def is_legacy(stored):
+    # the original format: unsalted sha256 hex digest
+    return len(stored) == 64 and "$" not in stored
+
+class PasswordHasher:
+    def __init__(self, scheme="scrypt", cost=None):
+        if scheme not in SCHEMES:
+            raise ValueError(f"unknown password scheme: {scheme}")
+        self.scheme = scheme
+        self.cost = cost if cost is not None else DEFAULT_COSTS[scheme]
+
+    def hash(self, password):
+        salt = secrets.token_bytes(16)
+        return f"{self.scheme}${self.cost}${salt.hex()}${derive(self.scheme, self.cost, password, salt).hex()}"
+
+    def verify(self, password, stored):
+        if not stored:
+            return False
+        password = password or ""
+        if is_legacy(stored):
+            return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+        try:
+            scheme, cost, salt, digest = stored.split("$")
+            return hmac.compare_digest(derive(scheme, int(cost), password, bytes.fromhex(salt)).hex(), digest)
+        except ValueError:
+            return False
+
+    def needs_upgrade(self, stored):
+        # legacy hashes and hashes made with another scheme or cost are rehashed on the next login
+        return is_legacy(stored) or not stored.startswith(f"{self.scheme}${self.cost}$")
+
+metrics.instrument(PasswordHasher, "password", ("hash", "verify"), inner=True)
@@ -0,0 +1,390 @@
+#server.py - asyncio HTTP/JSON gate API
+import argparse
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+import metrics
+from database import Database
+from expiry import ExpiryScheduler
+from parking_engine import (ParkingEngine, ParkingError, AuthenticationError, DuplicatePlateError,
+                            InvalidInputError, InsufficientFundsError, NotLoggedInError,
+                            PermissionDeniedError, SpotUnavailableError)
+from parking_spot import ParkingLot
+from passwords import SCHEMES, PasswordHasher
+from topology import ParkingNetwork, load_topology
+from ledger import Ledger
+from tariff import load_tariff
+
+ERROR_STATUS = [
+    (AuthenticationError, 401),
+    (NotLoggedInError, 401),
+    (InsufficientFundsError, 402),
+    (PermissionDeniedError, 403),
+    (SpotUnavailableError, 409),
+    (DuplicatePlateError, 409),
+    (InvalidInputError, 400),
+    (ParkingError, 400),
+]
+
+REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 402: "Payment Required",
+           403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+MAX_BODY = 64 * 1024
+# JSON body fields and the types the engine expects; query string values are always strings
+STRING_FIELDS = ("username", "password", "token", "spot_id", "license_plate", "plate", "vehicle_type", "method")
+NUMBER_FIELDS = ("duration", "amount", "limit")
+ENFORCE_INTERVAL = 1.0  # seconds between runs of the overstay timer
+
+log = logging.getLogger("easypark.server")
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def check_fields(payload):
+    # a list or object where the engine expects a string or number is the client's error, not a 500
+    for name, value in payload.items():
+        if value is None:
+            continue
+        if name in STRING_FIELDS and not isinstance(value, str):
+            raise InvalidInputError(f"{name} must be a string")
+        if name in NUMBER_FIELDS and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise InvalidInputError(f"{name} must be a number")
+
+class GateServer:
+    # lot mutations and balance writes run on one writer thread, balance reads on a
+    # small reader pool; quotes and availability are answered on the event loop. Password checks
+    # run the KDF on their own pool so login storms don't stall writes or balance reads
+    def __init__(self, engine, executor, read_executor=None, auth_executor=None):
+        self.engine = engine
+        self.executor = executor
+        self.read_executor = read_executor or executor
+        self.auth_executor = auth_executor or self.read_executor
+        self.enforce_failures = 0  # enforce() runs that raised, exported with the metrics
+        self.routes = {
+            ("GET", "/spots"): self.spots,
+            ("GET", "/quote"): self.quote,
+            ("GET", "/plate"): self.plate,
+            ("GET", "/stats"): self.stats,
+            ("GET", "/metrics"): self.prometheus,
+            ("GET", "/overstays"): self.overstays,
+            ("POST", "/login"): self.login,
+            ("POST", "/logout"): self.logout,
+            ("POST", "/park"): self.park,
+            ("POST", "/exit"): self.exit,
+            ("POST", "/balance"): self.balance,
+            ("POST", "/vehicles"): self.vehicles,
+            ("POST", "/topup"): self.top_up,
+        }
+
+    async def run_blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def run_read(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.read_executor, fn, *args)
+
+    async def run_auth(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.auth_executor, fn, *args)
+
+    async def spots(self, params):
+        # ?site=&level= narrow the counts on a multi-site topology; ?vehicle_type= counts spots that type may use
+        lot = self.engine.parking_lot
+        vehicle_type = params.get("vehicle_type")
+        if params.get("site") or params.get("level"):
+            if not isinstance(lot, ParkingNetwork):
+                raise InvalidInputError("site and level filters need a multi-site topology")
+            try:
+                node = {"site": params.get("site"), "level": params.get("level")}
+                return {"total": lot.total_count(**node), "available": lot.available_count(vehicle_type, **node)}
+            except KeyError:
+                raise InvalidInputError("unknown site or level")
+        first_spot = lot.first_available_spot(vehicle_type)
+        result = {"total": lot.num_spots, "available": lot.available_count(vehicle_type),
+                  "first_available": first_spot.id if first_spot else None}
+        if "limit" in params:
+            try:
+                limit = max(0, int(params["limit"]))
+            except ValueError:
+                raise InvalidInputError("limit must be an integer")
+            result["spots"] = lot.free_spot_ids(limit)
+        return result
+
+    async def quote(self, params):
+        if params.get("spot_id"):
+            return {"spot_id": params["spot_id"], "fee": self.engine.exit_quote(params["spot_id"])}
+        return {"cost": self.engine.quote(params.get("vehicle_type", "car"), params.get("duration"))}
+
+    async def stats(self, params):
+        return {"quote_cache": self.engine.quote_cache.stats(), "user_cache": self.engine.db.user_cache.stats(),
+                "enforce_failures": self.enforce_failures, "calls": metrics.summary()}
+
+    async def prometheus(self, params):
+        # Prometheus scrape target; call timings are only collected when the server runs with --metrics
+        lot, quotes, users = self.engine.parking_lot, self.engine.quote_cache, self.engine.db.user_cache
+        return metrics.render({"easypark_spots_total": lot.num_spots, "easypark_spots_available": lot.available_count(),
+                               "easypark_quote_cache_hits": quotes.hits, "easypark_quote_cache_misses": quotes.misses,
+                               "easypark_user_cache_hits": users.hits, "easypark_user_cache_misses": users.misses,
+                               "easypark_overstays": len(self.engine.expiry.live) if self.engine.expiry else 0,
+                               "easypark_enforce_failures": self.enforce_failures})
+
+    async def overstays(self, params):
+        # the live list for enforcement staff, longest overdue first
+        expiry = self.engine.expiry
+        if expiry is None:
+            return {"count": 0, "overstays": []}
+        try:
+            limit = max(0, int(params.get("limit", 100)))
+        except ValueError:
+            raise InvalidInputError("limit must be an integer")
+        now = self.engine.clock()
+        records = expiry.overstays(limit)
+        for record in records:
+            record["overdue_seconds"] = now - record["deadline"]
+        return {"count": len(expiry.live), "overstays": records}
+
+    async def enforce_loop(self):
+        # fires due overstay events; auto-charges write balances, so this runs on the writer thread
+        while True:
+            try:
+                await self.run_blocking(self.engine.enforce)
+            except Exception:
+                # logged and counted; the loop carries on so one bad run doesn't stop enforcement
+                self.enforce_failures += 1
+                log.exception("overstay enforcement failed")
+            await asyncio.sleep(ENFORCE_INTERVAL)
+
+    async def plate(self, params):
+        # exact lookup, or ranked candidates for camera misreads with fuzzy=1
+        # rows are read under the lot's lock; the writer thread may vacate any spot at any time
+        plate = params.get("plate", "")
+        if params.get("fuzzy") in ("1", "true", True):
+            match = "fuzzy"
+        elif params.get("prefix") in ("1", "true", True):
+            match = "prefix"
+        else:
+            match = "exact"
+        rows = self.engine.parking_lot.plate_rows(plate, match)
+        if match == "exact" and not rows:
+            raise SpotUnavailableError(f"Vehicle {plate} is not parked here.")
+        return {"matches": [{"spot_id": spot_id, "license_plate": license_plate, "vehicle_type": vehicle_type}
+                            for spot_id, license_plate, vehicle_type in rows]}
+
+    def exit_spot_id(self, params):
+        # plate cameras identify the car by plate instead of spot
+        if not params.get("spot_id") and params.get("license_plate"):
+            return self.engine.spot_for_plate(params["license_plate"]).id
+        return params.get("spot_id")
+
+    async def authenticated(self, params):
+        # a token from POST /login, or username and password on every request
+        if params.get("token"):
+            return await self.run_read(self.engine.authenticate_token, params["token"])
+        return await self.run_auth(self.engine.authenticate, params.get("username"), params.get("password"))
+
+    async def login(self, params):
+        user, token = await self.run_auth(self.engine.login, params.get("username"), params.get("password"))
+        return {"token": token, "expires_in": self.engine.token_ttl, "balance": user.balance}
+
+    async def logout(self, params):
+        self.engine.logout(params.get("token"))
+        return {}
+
+    def park_blocking(self, user, params):
+        if params.get("spot_id"):
+            spot = self.engine.park(user, params["spot_id"], params.get("vehicle_type", "car"),
+                                    params.get("license_plate"), params.get("duration", 1))
+        else:
+            spot = self.engine.park_any(user, params.get("vehicle_type", "car"),
+                                        params.get("license_plate"), params.get("duration", 1))
+        return {"spot_id": spot.id, "balance": user.balance}
+
+    def exit_blocking(self, user, params):
+        spot_id = self.exit_spot_id(params)
+        fee = self.engine.exit_and_charge(user, spot_id)
+        return {"spot_id": spot_id, "fee": fee, "balance": user.balance}
+
+    def vehicles_blocking(self, user, params):
+        return {"vehicles": [{"spot_id": spot_id, "license_plate": license_plate, "vehicle_type": vehicle_type,
+                              "fee": fee}
+                             for spot_id, license_plate, vehicle_type, fee in self.engine.user_vehicles(user)]}
+
+    def top_up_blocking(self, user, params):
+        amount = self.engine.top_up(user, params.get("amount"), params.get("method", "Card"))
+        return {"amount": amount, "balance": user.balance}
+
+    async def park(self, params):
+        return await self.run_blocking(self.park_blocking, await self.authenticated(params), params)
+
+    async def exit(self, params):
+        return await self.run_blocking(self.exit_blocking, await self.authenticated(params), params)
+
+    async def balance(self, params):
+        user = await self.authenticated(params)
+        return {"username": user.username, "balance": user.balance}
+
+    async def vehicles(self, params):
+        return await self.run_read(self.vehicles_blocking, await self.authenticated(params), params)
+
+    async def top_up(self, params):
+        return await self.run_blocking(self.top_up_blocking, await self.authenticated(params), params)
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            if any(path == url.path for _, path in self.routes):
+                raise HTTPError(405, "method not allowed")
+            raise HTTPError(404, "not found")
+        params = dict(parse_qsl(url.query))
+        if body:
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                raise HTTPError(400, "body must be JSON")
+            if not isinstance(payload, dict):
+                raise HTTPError(400, "body must be a JSON object")
+            check_fields(payload)
+            params.update(payload)
+        return await handler(params)
+
+    async def handle_request(self, method, target, body):
+        if metrics.enabled:
+            start = time.perf_counter()
+            status, result = await self.respond(method, target, body)
+            # keyed by route, so clients cannot grow the histograms with made-up paths or methods
+            path = urlsplit(target).path
+            name = f"http.{method} {path}" if (method, path) in self.routes else "http.unmatched"
+            metrics.histogram(name).observe(time.perf_counter() - start, status >= 500)
+            return status, result
+        return await self.respond(method, target, body)
+
+    async def respond(self, method, target, body):
+        try:
+            return 200, await self.dispatch(method, target, body)
+        except HTTPError as e:
+            return e.status, {"error": str(e)}
+        except ParkingError as e:
+            status = next(code for error_type, code in ERROR_STATUS if isinstance(e, error_type))
+            return status, {"error": str(e), "type": type(e).__name__}
+        except Exception as e:
+            # the path only: query strings may carry credentials
+            log.exception("%s %s failed", method, urlsplit(target).path)
+            return 500, {"error": f"internal error: {type(e).__name__}"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    name, sep, value = line.partition(":")
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                except ValueError:
+                    break
+                if length < 0:
+                    break
+                if length > MAX_BODY:
+                    status, result = 413, {"error": "request body too large"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, result = await self.handle_request(method, target, body)
+                    connection = headers.get("connection", "").lower()
+                    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+                if isinstance(result, str):
+                    payload, content_type = result.encode(), b"text/plain; version=0.0.4"
+                else:
+                    payload, content_type = json.dumps(result).encode(), b"application/json"
+                writer.write(b"%s %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n%s\r\n" % (
+                    version.encode(), status, REASONS.get(status, "").encode(), content_type, len(payload),
+                    b"" if keep_alive else b"Connection: close\r\n") + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(host="127.0.0.1", port=8080, num_spots=10, db_path='parking_system.db', readers=4, tariff_path=None,
+                auth_workers=2, hash_scheme="scrypt", hash_cost=None, topology_path=None, ledger_path=None,
+                profile_path=None, overstay_grace=900, auto_charge_after=None):
+    sampler = metrics.Sampler().start() if profile_path else None
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="easypark-writer")
+    read_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="easypark-reader")
+    # hashlib's KDFs release the GIL, so threads are enough to keep hashing off the event loop
+    auth_executor = ThreadPoolExecutor(max_workers=auth_workers, thread_name_prefix="easypark-auth")
+    db = Database(db_path, pool_size=readers + auth_workers + 1)
+    lot = load_topology(topology_path) if topology_path else ParkingLot(num_spots)
+    engine = ParkingEngine(lot, db, tariff=load_tariff(tariff_path) if tariff_path else None,
+                           hasher=PasswordHasher(hash_scheme, hash_cost),
+                           ledger=Ledger(ledger_path) if ledger_path else None)
+    restored = engine.restore_sessions()
+    # built after the restore, so the restored sessions go into its heap with one heapify
+    engine.expiry = ExpiryScheduler(lot, overstay_grace, auto_charge_after)
+    gate = GateServer(engine, executor, read_executor, auth_executor)
+    enforcer = asyncio.create_task(gate.enforce_loop())
+    server = await asyncio.start_server(gate.handle_connection, host, port, backlog=1024)
+    log.info("EasyPark gate API listening on http://%s:%d (%d parked vehicles restored)", host, port, restored)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        enforcer.cancel()
+        executor.shutdown(wait=True)
+        read_executor.shutdown(wait=True)
+        auth_executor.shutdown(wait=True)
+        db.close()
+        if engine.ledger is not None:
+            engine.ledger.close()
+        if sampler is not None:
+            sampler.stop(profile_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EasyPark gate API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--spots", type=int, default=10)
+    parser.add_argument("--db", default='parking_system.db')
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--ledger", help="append every top-up, park, exit and charge to this event log")
+    parser.add_argument("--tariff", help="tariff config (JSON); defaults to the built-in hourly rates")
+    parser.add_argument("--topology", help="site/level/zone layout (JSON); overrides --spots")
+    parser.add_argument("--metrics", action="store_true", help="time every instrumented call for GET /metrics")
+    parser.add_argument("--metrics-nested", action="store_true",
+                        help="with --metrics, also time the queries and password checks inside each transaction")
+    parser.add_argument("--profile", help="sample thread stacks while serving and write them here on shutdown")
+    parser.add_argument("--overstay-grace", type=float, default=15, help="minutes past the booked time before "
+                        "an overstay's grace expires")
+    parser.add_argument("--auto-charge", type=float, help="minutes after grace expiry to end and charge an overstaying "
+                        "session; by default overstayers are charged when they exit")
+    parser.add_argument("--auth-workers", type=int, default=2)
+    parser.add_argument("--hash-scheme", choices=SCHEMES, default="scrypt")
+    parser.add_argument("--hash-cost", type=int, help="log2(N) for scrypt, iterations for pbkdf2_sha256")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.metrics:
+        metrics.enable(args.metrics_nested)
+    try:
+        asyncio.run(serve(args.host, args.port, args.spots, args.db, args.readers, args.tariff,
+                          args.auth_workers, args.hash_scheme, args.hash_cost, args.topology, args.ledger,
+                          args.profile, args.overstay_grace * 60,
+                          args.auto_charge * 60 if args.auto_charge is not None else None))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,357 @@
+#simulator.py - seeded discrete-event traffic simulator and load generator
+# Replays days of gate traffic (arrival peaks, event egress surges, mixed fleets, top-up bursts) against
+# ParkingEngine, its lot and the database in simulated time, running each event as soon as the last one
+# is done. Reports wall-clock ops/s, p50/p99 latency per operation and the occupancy curve.
+#
+#   python simulator.py --spots 10000 --days 30
+#   python simulator.py --traffic traffic.example.json --curve occupancy.csv --output run.json
+import argparse
+import calendar
+import heapq
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+from array import array
+from database import Database
+from ledger import Ledger
+from parking_engine import MAX_DURATION, InsufficientFundsError, ParkingEngine, SpotUnavailableError
+from parking_spot import ParkingLot
+from tariff import load_tariff, parse_clock
+from topology import load_topology
+from user import User
+
+# rates are per 1000 spots so one profile fits any site; everything can be overridden from a JSON file
+DEFAULT_TRAFFIC = {
+    "seed": 1,
+    "days": 7,
+    "start": "2026-01-05",  # local midnight of a Monday
+    "drivers_per_spot": 2,
+    "fleet": {"car": 0.85, "motorcycle": 0.15},
+    # weekday arrivals per hour of the day per 1000 spots: a morning peak, a lunch plateau, an evening tail
+    "arrivals_per_hour": [8, 6, 5, 5, 8, 25, 100, 240, 250, 170, 140, 140, 150, 135, 110, 100, 110, 120, 95, 70, 55, 40,
+                          25, 12],
+    "weekend_factor": 0.6,
+    "stay_hours": {"distribution": "lognormal", "median": 3, "sigma": 1.0, "max": 24},
+    # a crowd arriving for an event that all leaves within egress_minutes of its end
+    "events": [{"weekdays": [4, 5], "arrive_from": "17:00", "arrive_to": "19:30", "arrivals_per_1000": 300,
+                "ends": "22:30", "egress_minutes": 30}],
+    "top_ups": {"initial": [20, 300], "low_balance": 20, "amounts": [100, 200, 500],
+                "methods": {"GCash": 0.6, "Card": 0.4},
+                # paydays: a share of all drivers tops up within a few minutes of each other
+                "bursts": [{"month_days": [15, 30], "at": "12:00", "minutes": 60, "fraction": 0.25}]},
+    "sample_minutes": 15,
+}
+
+# event kinds, in the order they run when they fall on the same second
+DAY, LEAVE, ARRIVE, TOP_UP, SAMPLE = range(5)
+OPS = ("park", "exit", "top_up")
+
+def merged(defaults, overrides):
+    # overrides on top of defaults, nested dicts merged key by key, so {"top_ups": {"amounts": [50]}}
+    # keeps the default top-up methods; give a default fleet or method a weight of 0 to leave it out
+    result = dict(defaults)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            value = merged(result[key], value)
+        result[key] = value
+    return result
+
+def distribution(spec, rng):
+    # a sampler for {"distribution": "lognormal" | "exponential" | "uniform" | "fixed", ...}, clipped to "max"
+    kind = spec.get("distribution", "lognormal")
+    if kind == "lognormal":
+        mu, sigma = math.log(spec["median"]), spec["sigma"]
+        draw = lambda: rng.lognormvariate(mu, sigma)
+    elif kind == "exponential":
+        rate = 1 / spec["mean"]
+        draw = lambda: rng.expovariate(rate)
+    elif kind == "uniform":
+        low, high = spec["min"], spec["max"]
+        draw = lambda: rng.uniform(low, high)
+    elif kind == "fixed":
+        draw = lambda: spec["value"]
+    else:
+        raise ValueError(f"unknown distribution: {kind}")
+    cap = spec.get("max", float("inf"))
+    return lambda: min(draw(), cap)
+
+def chooser(weights, rng):
+    # {"car": 0.85, ...} -> a function returning a key with those relative weights
+    keys, cumulative, total = list(weights), [], 0.0
+    for key in keys:
+        total += weights[key]
+        cumulative.append(total)
+    return lambda: rng.choices(keys, cum_weights=cumulative)[0]
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+class Simulator:
+    def __init__(self, engine, traffic=None):
+        self.engine = engine
+        self.lot = engine.parking_lot
+        self.traffic = traffic = merged(DEFAULT_TRAFFIC, traffic or {})
+        self.rng = rng = random.Random(traffic["seed"])
+        self.scale = self.lot.num_spots / 1000
+        self.stay = distribution(traffic["stay_hours"], rng)
+        self.vehicle_type = chooser(traffic["fleet"], rng)
+        top_ups = traffic["top_ups"]
+        self.method = chooser(top_ups["methods"], rng)
+        self.low_balance = top_ups["low_balance"]
+        self.amounts = top_ups["amounts"]
+        year, month, day = map(int, traffic["start"].split("-"))
+        # local midnight in the tariff's time zone, so tariff bands and the arrival profile line up
+        self.start = calendar.timegm((year, month, day, 0, 0, 0)) - engine.tariff.utc_offset
+        self.first_weekday = calendar.weekday(year, month, day)
+        self.now = self.start
+        engine.clock = lambda: self.now
+        self.queue = []
+        self.seq = 0
+        self.sessions = 0
+        self.users = []
+        self.latencies = {op: array('d') for op in OPS}
+        self.outcomes = {"parked": 0, "turned_away": 0, "declined_at_entry": 0, "declined_at_exit": 0,
+                         "burst_top_ups": 0}
+        self.curve = []  # (simulated time, occupied spots)
+        self.days = []  # per simulated day: counts, wall seconds, peak occupancy
+        self.day_started = None  # (wall clock, op count) when the current day began
+
+    def add_drivers(self, count=None):
+        # seeds accounts straight into the database; drivers never log in, gates act on their behalf
+        count = count or int(self.traffic["drivers_per_spot"] * self.lot.num_spots)
+        low, high = self.traffic["top_ups"]["initial"]
+        rows = []
+        for i in range(count):
+            user = User(f"driver{i}", "!")
+            user.balance = round(self.rng.uniform(low, high), 2)
+            self.users.append(user)
+            rows.append((user.username, user.password_hash, user.balance))
+        with self.engine.db.connection() as conn, conn:
+            conn.executemany("INSERT INTO users (username, password_hash, balance) VALUES (?, ?, ?)", rows)
+
+    def schedule(self, when, kind, *args):
+        self.seq += 1
+        heapq.heappush(self.queue, (when, kind, self.seq, args))
+
+    def timed(self, op, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.latencies[op].append(time.perf_counter() - start)
+
+    def clock_time(self, day, text):
+        return self.start + day * 86400 + parse_clock(text) * 60
+
+    def matches(self, spec, day):
+        date = time.gmtime(self.start + self.engine.tariff.utc_offset + day * 86400)
+        return ((self.first_weekday + day) % 7 in spec.get("weekdays", ()) or
+                date.tm_mday in spec.get("month_days", ()))
+
+    def arrival_rate(self, day, hour):
+        # arrivals per second
+        rate = self.traffic["arrivals_per_hour"][hour] * self.scale / 3600
+        return rate * self.traffic["weekend_factor"] if (self.first_weekday + day) % 7 >= 5 else rate
+
+    def next_arrival(self, now, end):
+        # piecewise Poisson: the rate is constant within an hour, so a gap crossing the hour is redrawn from there
+        while now < end:
+            day, second = divmod(now - self.start, 86400)
+            hour_end = now - second % 3600 + 3600
+            rate = self.arrival_rate(int(day), int(second // 3600))
+            if rate > 0:
+                arrival = now + self.rng.expovariate(rate)
+                if arrival < hour_end:
+                    return arrival
+            now = hour_end
+        return None
+
+    def start_day(self, day):
+        for event in self.traffic["events"]:
+            if self.matches(event, day):
+                first, last = self.clock_time(day, event["arrive_from"]), self.clock_time(day, event["arrive_to"])
+                ends = self.clock_time(day, event["ends"])
+                for _ in range(int(event["arrivals_per_1000"] * self.scale)):
+                    self.schedule(self.rng.uniform(first, last), ARRIVE,
+                                  ends + self.rng.uniform(0, event["egress_minutes"] * 60))
+        for burst in self.traffic["top_ups"]["bursts"]:
+            if self.matches(burst, day):
+                at = self.clock_time(day, burst["at"])
+                for user in self.rng.sample(self.users, int(burst["fraction"] * len(self.users))):
+                    self.schedule(at + self.rng.uniform(0, burst["minutes"] * 60), TOP_UP, user)
+        self.days.append({"day": day, "parked": 0, "turned_away": 0, "peak": 0})
+        self.day_started = (time.perf_counter(), self.op_count())
+
+    def top_up(self, user):
+        self.timed("top_up", self.engine.top_up, user, self.rng.choice(self.amounts), self.method())
+
+    def arrive(self, leave_at=None):
+        # a random driver enters; regular stays are drawn, event crowds leave at their egress time
+        user = self.users[self.rng.randrange(len(self.users))]
+        stay = max(60, leave_at - self.now) if leave_at is not None else self.stay() * 3600
+        self.sessions += 1
+        # stays past the longest booking are booked for MAX_DURATION and overstay
+        args = (user, self.vehicle_type(), f"S{self.sessions}", min(MAX_DURATION, max(1, math.ceil(stay / 3600))))
+        try:
+            spot = self.timed("park", self.engine.park_any, *args)
+        except SpotUnavailableError:
+            self.outcomes["turned_away"] += 1
+            self.days[-1]["turned_away"] += 1
+            return
+        except InsufficientFundsError:
+            # tops up at the gate and tries once more
+            self.outcomes["declined_at_entry"] += 1
+            self.top_up(user)
+            try:
+                spot = self.timed("park", self.engine.park_any, *args)
+            except (SpotUnavailableError, InsufficientFundsError):
+                self.outcomes["turned_away"] += 1
+                self.days[-1]["turned_away"] += 1
+                return
+        self.outcomes["parked"] += 1
+        self.days[-1]["parked"] += 1
+        self.schedule(self.now + stay, LEAVE, user, spot.id)
+
+    def leave(self, user, spot_id):
+        # a driver who cannot pay tops up until the exit goes through
+        while True:
+            try:
+                self.timed("exit", self.engine.exit_and_charge, user, spot_id)
+                break
+            except InsufficientFundsError:
+                self.outcomes["declined_at_exit"] += 1
+                self.top_up(user)
+        if user.balance < self.low_balance:
+            self.top_up(user)
+
+    def sample(self):
+        occupied = self.lot.num_spots - self.lot.available_count()
+        self.curve.append((self.now, occupied))
+        self.days[-1]["peak"] = max(self.days[-1]["peak"], occupied)
+
+    def run(self, days=None):
+        days = days or self.traffic["days"]
+        end = self.start + days * 86400
+        for day in range(days):
+            self.schedule(self.start + day * 86400, DAY, day)
+        for k in range(int(days * 1440 / self.traffic["sample_minutes"])):
+            self.schedule(self.start + k * self.traffic["sample_minutes"] * 60, SAMPLE)
+        first = self.next_arrival(self.start, end)
+        if first is not None:
+            self.schedule(first, ARRIVE, None)
+        queue, started = self.queue, time.perf_counter()
+        while queue:
+            when, kind, _, args = heapq.heappop(queue)
+            if when >= end:
+                break  # vehicles still parked at the end stay parked
+            self.now = when
+            if kind == LEAVE:
+                self.leave(*args)
+            elif kind == ARRIVE:
+                self.arrive(*args)
+                if args[0] is None:  # a regular arrival draws the next one
+                    following = self.next_arrival(when, end)
+                    if following is not None:
+                        self.schedule(following, ARRIVE, None)
+            elif kind == TOP_UP:
+                self.outcomes["burst_top_ups"] += 1
+                self.top_up(*args)
+            elif kind == SAMPLE:
+                self.sample()
+            elif kind == DAY:
+                self.close_day()
+                self.start_day(*args)
+        self.close_day()
+        return self.report(days, time.perf_counter() - started)
+
+    def op_count(self):
+        return sum(len(latencies) for latencies in self.latencies.values())
+
+    def close_day(self):
+        if self.days and "seconds" not in self.days[-1]:
+            started, ops = self.day_started
+            self.days[-1]["seconds"] = time.perf_counter() - started
+            self.days[-1]["ops"] = self.op_count() - ops
+
+    def report(self, days, seconds):
+        ops = {}
+        for op, latencies in self.latencies.items():
+            ordered = sorted(latencies)
+            ops[op] = {"count": len(ordered), "p50_us": percentile(ordered, 0.5) * 1e6,
+                       "p99_us": percentile(ordered, 0.99) * 1e6, "max_us": (ordered[-1] if ordered else 0) * 1e6}
+        total = self.op_count()
+        hourly = [[] for _ in range(24)]
+        for when, occupied in self.curve:
+            hourly[int((when - self.start) % 86400 // 3600)].append(occupied)
+        return {"spots": self.lot.num_spots, "drivers": len(self.users), "days": days, "seed": self.traffic["seed"],
+                "wall_seconds": seconds, "ops": total, "ops_per_s": total / seconds if seconds else 0.0,
+                "slowest_day_ops_per_s": min((day["ops"] / day["seconds"] for day in self.days if day["seconds"]),
+                                             default=0.0),
+                "latency": ops, "outcomes": self.outcomes, "daily": self.days,
+                "occupancy_by_hour": [sum(h) / len(h) / self.lot.num_spots if h else 0.0 for h in hourly],
+                "peak_occupancy": max((occupied for _, occupied in self.curve), default=0) / self.lot.num_spots}
+
+def print_report(report):
+    print(f"{report['days']} simulated days, {report['spots']} spots, {report['drivers']} drivers, "
+          f"seed {report['seed']}: {report['ops']} ops in {report['wall_seconds']:.1f} s wall")
+    print(f"  sustained {report['ops_per_s']:.0f} ops/s (slowest day {report['slowest_day_ops_per_s']:.0f} ops/s)")
+    for op, stat in report["latency"].items():
+        print(f"  {op:8s} {stat['count']:9d}  p50 {stat['p50_us']:8.1f} us  p99 {stat['p99_us']:8.1f} us  "
+              f"max {stat['max_us'] / 1000:8.1f} ms")
+    print("  " + ", ".join(f"{name} {count}" for name, count in report["outcomes"].items()))
+    print(f"  peak occupancy {report['peak_occupancy']:.0%}; mean by hour of day:")
+    for hour, share in enumerate(report["occupancy_by_hour"]):
+        print(f"    {hour:02d}:00 {share:5.0%} {'#' * round(share * 50)}")
+
+def write_curve(path, simulator):
+    with open(path, "w") as f:
+        f.write("time,occupied,occupancy\n")
+        for when, occupied in simulator.curve:
+            f.write(f"{time.strftime('%Y-%m-%dT%H:%M', time.gmtime(when + simulator.engine.tariff.utc_offset))},{occupied},"
+                    f"{occupied / simulator.lot.num_spots:.4f}\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EasyPark traffic simulator")
+    parser.add_argument("--traffic", help="traffic profile (JSON) laid over the built-in one")
+    parser.add_argument("--spots", type=int, default=1000)
+    parser.add_argument("--topology", help="site/level/zone layout (JSON); overrides --spots")
+    parser.add_argument("--tariff", help="tariff config (JSON); defaults to the built-in hourly rates")
+    parser.add_argument("--days", type=int, help="overrides the profile's days")
+    parser.add_argument("--seed", type=int, help="overrides the profile's seed")
+    parser.add_argument("--db", help="database file; a temporary one is used and removed by default")
+    parser.add_argument("--synchronous", default="NORMAL", help="SQLite synchronous setting")
+    parser.add_argument("--ledger", help="append every event to this ledger as well")
+    parser.add_argument("--curve", help="write the occupancy samples here as CSV")
+    parser.add_argument("--output", help="write the report here as JSON")
+    args = parser.parse_args()
+    traffic = {}
+    if args.traffic:
+        with open(args.traffic) as f:
+            traffic = json.load(f)
+    if args.seed is not None:
+        traffic["seed"] = args.seed
+    tmp = tempfile.mkdtemp()
+    try:
+        db = Database(args.db or os.path.join(tmp, "simulation.db"), synchronous=args.synchronous)
+        engine = ParkingEngine(load_topology(args.topology) if args.topology else ParkingLot(args.spots), db,
+                               tariff=load_tariff(args.tariff) if args.tariff else None,
+                               ledger=Ledger(args.ledger, sync=args.synchronous.upper() != "OFF")
+                               if args.ledger else None)
+        simulator = Simulator(engine, traffic)
+        simulator.add_drivers()
+        report = simulator.run(args.days)
+        print_report(report)
+        if args.curve:
+            write_curve(args.curve, simulator)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        if engine.ledger is not None:
+            engine.ledger.close()
+        db.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
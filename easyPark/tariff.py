@@ -0,0 +1,92 @@
+#tariff.py
+# parking tariffs loaded from config and compiled into per-minute lookup tables
+import json
+import time
+from itertools import chain
+
+SECONDS_PER_DAY = 86400
+MINUTES_PER_DAY = 1440
+DEFAULT_TARIFF = {"vehicles": {"car": {"rate": 5}, "motorcycle": {"rate": 3}}}
+
+def parse_clock(text):
+    hours, minutes = text.split(":")
+    minute = int(hours) * 60 + int(minutes)
+    if not 0 <= minute <= MINUTES_PER_DAY:
+        raise ValueError(f"invalid time of day: {text}")
+    return minute
+
+class VehicleTariff:
+    # one vehicle type over a local day: rates[m] is the hourly rate during minute m and
+    # cumulative[m] the cost in rate-seconds from midnight to the start of minute m
+    def __init__(self, rate, bands=(), daily_cap=None):
+        self.rate = rate
+        self.daily_cap = daily_cap
+        self.flat = not bands and daily_cap is None  # plain hourly rate, no table needed
+        self.rates = [rate] * MINUTES_PER_DAY
+        for band in bands:
+            start, end = parse_clock(band["from"]), parse_clock(band["to"])
+            if start < end:
+                minutes = range(start, end)
+            else:  # band wraps past midnight
+                minutes = chain(range(start, MINUTES_PER_DAY), range(0, end))
+            for m in minutes:
+                self.rates[m] = band["rate"]
+        self.cumulative = [0.0] * (MINUTES_PER_DAY + 1)
+        for m, r in enumerate(self.rates):
+            self.cumulative[m + 1] = self.cumulative[m] + r * 60
+        self.cap = daily_cap * 3600 if daily_cap is not None else float("inf")  # in rate-seconds
+
+    def cost_to(self, second):
+        # rate-seconds from midnight to a second of the day
+        m = int(second // 60)
+        return self.cumulative[m] + self.rates[m] * (second - m * 60)
+
+    def fee(self, start, end, utc_offset):
+        # any interval costs at most three table lookups; daily caps apply per calendar day
+        if self.flat:
+            return self.rate * (end - start) / 3600
+        day0, second0 = divmod(start + utc_offset, SECONDS_PER_DAY)
+        day1, second1 = divmod(end + utc_offset, SECONDS_PER_DAY)
+        cap = self.cap
+        if day0 == day1:
+            cost = min(self.cost_to(second1) - self.cost_to(second0), cap)
+        else:
+            day = self.cumulative[MINUTES_PER_DAY]
+            cost = (min(day - self.cost_to(second0), cap) + (day1 - day0 - 1) * min(day, cap)
+                    + min(self.cost_to(second1), cap))
+        return round(cost / 3600, 10)  # drops float noise from the day/minute split
+
+class Tariff:
+    # config: {"version": 1, "grace_minutes": 10, "utc_offset_minutes": 480,
+    #          "zone_multipliers": {"HQ-2-B": 1.5},
+    #          "vehicles": {"car": {"rate": 5, "daily_cap": 40,
+    #                               "bands": [{"from": "18:00", "to": "06:00", "rate": 2}]}}}
+    # rates are per hour; everything but "vehicles" is optional. Zone multipliers are keyed by zone name,
+    # which on a multi-site topology is the zone's full prefix (e.g. "HQ-2-B") so names never clash
+    def __init__(self, config=None):
+        config = config or DEFAULT_TARIFF
+        self.config = config
+        self.version = config.get("version", 1)
+        self.grace = config.get("grace_minutes", 0) * 60
+        self.zone_multipliers = dict(config.get("zone_multipliers", {}))
+        if "utc_offset_minutes" in config:
+            self.utc_offset = config["utc_offset_minutes"] * 60
+        else:
+            self.utc_offset = time.localtime().tm_gmtoff  # fixed at load time; reload across DST changes
+        self.vehicles = {vehicle_type: VehicleTariff(spec["rate"], spec.get("bands", ()), spec.get("daily_cap"))
+                         for vehicle_type, spec in config["vehicles"].items()}
+        self.rates = {vehicle_type: vehicle.rate for vehicle_type, vehicle in self.vehicles.items()}
+
+    @classmethod
+    def from_rates(cls, rates):
+        return cls({"vehicles": {vehicle_type: {"rate": rate} for vehicle_type, rate in rates.items()}})
+
+    def fee(self, vehicle_type, start, end, zone=None):
+        # start and end are epoch seconds
+        if end - start <= self.grace or end <= start:
+            return 0.0
+        return self.vehicles[vehicle_type].fee(start, end, self.utc_offset) * self.zone_multipliers.get(zone, 1)
+
+def load_tariff(path):
+    with open(path) as f:
+        return Tariff(json.load(f))
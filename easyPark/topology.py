@@ -0,0 +1,394 @@
+#topology.py
+# site -> level -> zone hierarchy; every zone is its own ParkingLot shard, so gates working in
+# different zones never wait on the same lock
+import json
+import threading
+from bisect import bisect_right
+from errors import DuplicatePlateError
+from parking_spot import (ParkingLot, add_held, fold_plate, normalize_plate, one_edit_keys, plate_match_rank,
+                          remove_held)
+
+DIGITS = "0123456789"
+RESERVED = object()  # plate_zones value for a plate a gate is still claiming a spot for
+
+class Counters:
+    # spots under one node of the hierarchy, split by the vehicle types their zones accept
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = 0
+        self.free = {}  # accepted vehicle types (a tuple, or None for any) -> free spots
+
+    def add(self, accepts, total, free):
+        with self.lock:
+            self.total += total
+            self.free[accepts] = self.free.get(accepts, 0) + free
+
+    def available(self, vehicle_type=None):
+        return sum(count for accepts, count in self.free.items()
+                   if vehicle_type is None or accepts is None or vehicle_type in accepts)
+
+class Zone:
+    def __init__(self, network, site, level, name, num_spots, vehicle_types=None):
+        if not name or name[-1] in DIGITS:
+            raise ValueError(f"zone names must not end in a digit: {name!r}")
+        self.site = site
+        self.level = level
+        self.name = name
+        self.prefix = f"{site.name}-{level.name}-{name}"
+        # the lot's one zone is named by the full prefix, so tariff zone multipliers can tell apart the
+        # "A" zones of different levels and sites
+        self.lot = ParkingLot(num_spots, prefix=self.prefix, zones=[(self.prefix, num_spots)],
+                              vehicle_types=vehicle_types)
+        self.offset = 0  # global position of the zone's first spot, set by the network
+        self.accepts = self.lot.accepted_types
+        self.plates = [None] * num_spots  # normalized plate parked at each position, for the network's index
+        self.counters = (level.counters, site.counters, network.counters)
+        for counters in self.counters:
+            counters.add(self.accepts, num_spots, num_spots)
+
+    def accepts_type(self, vehicle_type):
+        return self.lot.accepts_type(vehicle_type)
+
+    def taken(self, delta):
+        for counters in self.counters:
+            counters.add(self.accepts, 0, -delta)
+
+    def occupy_spot(self, spot_id, vehicle, duration, user, start_time=None):
+        with self.lot.lock:
+            i = self.lot.index_of(spot_id)
+            was_free = i is not None and not self.lot.occupied[i]
+            if not self.lot.occupy_spot(spot_id, vehicle, duration, user, start_time):
+                return False
+        if was_free:
+            self.taken(1)
+        return True
+
+    def try_occupy(self, spot_id, vehicle, duration, user, start_time=None):
+        if not self.lot.try_occupy(spot_id, vehicle, duration, user, start_time):
+            return False
+        self.taken(1)
+        return True
+
+    def claim_any(self, vehicle, duration, user, start_time=None):
+        spot = self.lot.claim_any(vehicle, duration, user, start_time)
+        if spot is not None:
+            self.taken(1)
+        return spot
+
+    def vacate_spot(self, spot_id):
+        if not self.lot.vacate_spot(spot_id):
+            return False
+        self.taken(-1)
+        return True
+
+    def end_exit(self, spot_id, vacate):
+        if not self.lot.end_exit(spot_id, vacate):
+            return False
+        self.taken(-1)
+        return True
+
+    def end_exits(self, positions, vacate):
+        vacated = self.lot.end_exits(positions, vacate)
+        if vacated:
+            self.taken(-vacated)
+        return vacated
+
+class Level:
+    def __init__(self, site, name):
+        self.site = site
+        self.name = name
+        self.zones = {}
+        self.counters = Counters()
+
+class Site:
+    def __init__(self, name):
+        self.name = name
+        self.levels = {}
+        self.counters = Counters()
+
+class ParkingNetwork:
+    # mirrors the ParkingLot interface the engine and server use; positions are global, numbered
+    # shard by shard, and spot ids carry their shard's prefix (e.g. "HQ-3-A12")
+    def __init__(self, config):
+        self.counters = Counters()
+        self.sites = {}
+        self.shards = []
+        self.offsets = []
+        self.by_prefix = {}
+        self.num_spots = 0
+        # normalized plate -> zone, and folded plate -> zone (or a tuple of zones), kept by listeners on
+        # every shard, so a plate lookup asks one shard instead of all of them
+        self.plate_zones = {}
+        self.folded_zones = {}
+        self.plate_lock = threading.Lock()
+        for site_config in config["sites"]:
+            site = self.sites[site_config["name"]] = Site(site_config["name"])
+            for level_config in site_config["levels"]:
+                level = site.levels[str(level_config["name"])] = Level(site, str(level_config["name"]))
+                for zone_config in level_config["zones"]:
+                    zone = Zone(self, site, level, zone_config["name"], zone_config["spots"],
+                                zone_config.get("vehicle_types"))
+                    if zone.prefix in self.by_prefix:
+                        raise ValueError(f"duplicate zone: {zone.prefix}")
+                    level.zones[zone.name] = zone
+                    self.by_prefix[zone.prefix] = zone
+                    zone.offset = self.num_spots
+                    self.offsets.append(self.num_spots)
+                    self.shards.append(zone)
+                    self.num_spots += zone_config["spots"]
+                    zone.lot.subscribe(lambda spot_id, occupied, zone=zone:
+                                       self.on_zone_changed(zone, spot_id, occupied))
+
+    def on_zone_changed(self, zone, spot_id, occupied):
+        # runs under the zone's lock after every change, so the position's arrays are settled
+        lot = zone.lot
+        i = lot.index_of(spot_id)
+        with self.plate_lock:
+            old = zone.plates[i]
+            if old is not None:
+                zone.plates[i] = None
+                if self.plate_zones.get(old) is zone:
+                    del self.plate_zones[old]
+                remove_held(self.folded_zones, fold_plate(old), zone)
+            plate = normalize_plate(lot.plates.values[lot.plate_ids[i]]) if occupied else None
+            if plate:
+                zone.plates[i] = plate
+                self.plate_zones[plate] = zone
+                add_held(self.folded_zones, fold_plate(plate), zone)
+
+    def node(self, site=None, level=None):
+        if site is None:
+            if level is not None:
+                raise KeyError("a level needs its site")
+            return self
+        site = self.sites[site]
+        return site.levels[str(level)] if level is not None else site
+
+    def available_count(self, vehicle_type=None, site=None, level=None):
+        # answered from the aggregated counters; no spot is looked at
+        return self.node(site, level).counters.available(vehicle_type)
+
+    def total_count(self, site=None, level=None):
+        return self.node(site, level).counters.total
+
+    def counters_summary(self):
+        return {"total": self.counters.total, "available": self.counters.available(),
+                "by_site": {site.name: {"total": site.counters.total, "available": site.counters.available(),
+                                        "by_level": {level.name: {"total": level.counters.total,
+                                                                  "available": level.counters.available()}
+                                                     for level in site.levels.values()}}
+                            for site in self.sites.values()}}
+
+    def zone_for(self, spot_id):
+        if not isinstance(spot_id, str):
+            return None
+        return self.by_prefix.get(spot_id.rstrip(DIGITS))
+
+    def shard_of(self, position):
+        k = bisect_right(self.offsets, position) - 1
+        return self.shards[k], position - self.offsets[k]
+
+    def spot_id(self, position):
+        zone, i = self.shard_of(position)
+        return zone.lot.spot_id(i)
+
+    def index_of(self, spot_id):
+        # global position of a spot id
+        zone = self.zone_for(spot_id)
+        i = zone.lot.index_of(spot_id) if zone is not None else None
+        return zone.offset + i if i is not None else None
+
+    def get_spot(self, spot_id):
+        zone = self.zone_for(spot_id)
+        return zone.lot.get_spot(spot_id) if zone is not None else None
+
+    def accepts(self, spot_id, vehicle_type):
+        zone = self.zone_for(spot_id)
+        return zone is not None and zone.accepts_type(vehicle_type)
+
+    def occupy_spot(self, spot_id, vehicle, duration, user, start_time=None):
+        zone = self.zone_for(spot_id)
+        return zone is not None and zone.occupy_spot(spot_id, vehicle, duration, user, start_time)
+
+    def try_occupy(self, spot_id, vehicle, duration, user, start_time=None, unique_plate=False):
+        zone = self.zone_for(spot_id)
+        if zone is None:
+            return False
+        plate = self.reserve_plate(vehicle) if unique_plate else None
+        taken = False
+        try:
+            taken = zone.try_occupy(spot_id, vehicle, duration, user, start_time)
+        finally:
+            if plate and not taken:
+                self.release_plate(plate)
+        return taken
+
+    def claim_any(self, vehicle, duration, user, start_time=None, unique_plate=False):
+        # first free spot in a zone that takes the vehicle; a zone filled up by another gate is skipped
+        plate = self.reserve_plate(vehicle) if unique_plate else None
+        spot = None
+        try:
+            for zone in self.shards:
+                if zone.lot.free_count and (vehicle is None or zone.accepts_type(vehicle.type)):
+                    spot = zone.claim_any(vehicle, duration, user, start_time)
+                    if spot is not None:
+                        return spot
+        finally:
+            if plate and spot is None:
+                self.release_plate(plate)
+        return None
+
+    def reserve_plate(self, vehicle):
+        # the plate may be parked in any shard, so the network index holds it for the gate while the gate
+        # claims a spot; the shard's listener replaces the reservation once the vehicle is in
+        plate = normalize_plate(vehicle.license_plate) if vehicle is not None else ""
+        if not plate:
+            return None
+        with self.plate_lock:
+            zone = self.plate_zones.get(plate)
+            if zone is None:
+                self.plate_zones[plate] = RESERVED
+                return plate
+        spot = zone.lot.find_plate(plate) if zone is not RESERVED else None
+        where = f"in spot {spot.id}" if spot is not None else "at another gate"
+        raise DuplicatePlateError(f"Vehicle {vehicle.license_plate} is already parked {where}.")
+
+    def release_plate(self, plate):
+        with self.plate_lock:
+            if self.plate_zones.get(plate) is RESERVED:
+                del self.plate_zones[plate]
+
+    def vacate_spot(self, spot_id):
+        zone = self.zone_for(spot_id)
+        return zone is not None and zone.vacate_spot(spot_id)
+
+    def begin_exit(self, spot_id, username):
+        zone = self.zone_for(spot_id)
+        return zone.lot.begin_exit(spot_id, username) if zone is not None else None
+
+    def end_exit(self, spot_id, vacate):
+        zone = self.zone_for(spot_id)
+        return zone is not None and zone.end_exit(spot_id, vacate)
+
+    def begin_exits(self, positions=None, username=None):
+        # global positions (default: every occupied spot) in, the claimed ones out, grouped by shard in the
+        # order partition() gives them
+        groups = [(zone, None) for zone in self.shards] if positions is None else self.zone_groups(positions)
+        return [zone.offset + i for zone, local in groups for i in zone.lot.begin_exits(local, username)]
+
+    def end_exits(self, positions, vacate):
+        return sum(zone.end_exits(local, vacate) for zone, local in self.zone_groups(positions))
+
+    def is_owner(self, spot_id, username):
+        zone = self.zone_for(spot_id)
+        return zone is not None and zone.lot.is_owner(spot_id, username)
+
+    def first_available_spot(self, vehicle_type=None):
+        for zone in self.shards:
+            if zone.lot.free_count and (vehicle_type is None or zone.accepts_type(vehicle_type)):
+                spot = zone.lot.first_available_spot()
+                if spot is not None:
+                    return spot
+        return None
+
+    def free_spot_ids(self, limit=None):
+        spot_ids = []
+        for zone in self.shards:
+            if limit is not None and len(spot_ids) >= limit:
+                break
+            spot_ids.extend(zone.lot.free_spot_ids(None if limit is None else limit - len(spot_ids)))
+        return spot_ids
+
+    def occupied_positions(self):
+        return [offset + i for zone, offset in zip(self.shards, self.offsets) for i in zone.lot.occupied_positions()]
+
+    def partition(self, positions=None):
+        # global positions grouped into (shard lot, local positions) pairs for batch work
+        if positions is None:
+            return [(zone.lot, zone.lot.occupied_positions()) for zone in self.shards
+                    if zone.lot.free_count < zone.lot.num_spots]
+        return [(zone.lot, local) for zone, local in self.zone_groups(positions)]
+
+    def zone_groups(self, positions):
+        # (zone, local positions) pairs; groups come in order of first appearance and keep their positions'
+        # order, so positions already grouped by shard come back as the same sequence
+        groups = {}
+        lo = hi = 0
+        for position in positions:
+            if not lo <= position < hi:
+                # runs of one shard's positions, the usual case, skip the bisect
+                zone, _ = self.shard_of(position)
+                lo, hi = zone.offset, zone.offset + zone.lot.num_spots
+                local = groups.setdefault(zone, [])
+            local.append(position - lo)
+        return list(groups.items())
+
+    def positions_for_user(self, username):
+        return [offset + i for zone, offset in zip(self.shards, self.offsets)
+                for i in zone.lot.user_positions.get(username, ())]
+
+    def spots_for_user(self, username, limit=None):
+        spots = []
+        for zone in self.shards:
+            if limit is not None and len(spots) >= limit:
+                break
+            spots.extend(zone.lot.spots_for_user(username, None if limit is None else limit - len(spots)))
+        return spots
+
+    def session_rows(self, username, limit=None):
+        rows = []
+        for zone in self.shards:
+            if limit is not None and len(rows) >= limit:
+                break
+            rows.extend(zone.lot.session_rows(username, None if limit is None else limit - len(rows)))
+        return rows
+
+    def zone_for_plate(self, plate):
+        zone = self.plate_zones.get(normalize_plate(plate))
+        return zone if zone is not RESERVED else None
+
+    def find_plate(self, plate):
+        zone = self.zone_for_plate(plate)
+        return zone.lot.find_plate(plate) if zone is not None else None
+
+    def search_plates(self, prefix, limit=20):
+        return [self.get_spot(row[0]) for row in self.plate_rows(prefix, "prefix", limit)]
+
+    def fuzzy_find_plate(self, plate, limit=20):
+        return [self.get_spot(row[0]) for row in self.plate_rows(plate, "fuzzy", limit)]
+
+    def plate_rows(self, plate, match="exact", limit=20):
+        # every shard answers under its own lock; prefix matches merge in plate order and fuzzy ones by
+        # plate_match_rank, as on a single lot. Exact and fuzzy lookups only ask the shards the plate
+        # indexes point at; a prefix search asks every shard, whose sorted plates it bisects
+        if match == "exact":
+            zone = self.zone_for_plate(plate)
+            return zone.lot.plate_rows(plate) if zone is not None else []
+        if match == "fuzzy":
+            zones = set()
+            for key in one_edit_keys(fold_plate(normalize_plate(plate))):
+                held = self.folded_zones.get(key)
+                if held is not None:
+                    zones.update(held if type(held) is tuple else (held,))
+            shards = [zone for zone in self.shards if zone in zones]
+        else:
+            shards = self.shards
+        rows = [row for zone in shards for row in zone.lot.plate_rows(plate, match, limit)]
+        if match == "prefix":
+            rows.sort(key=lambda row: normalize_plate(row[1]))
+        else:
+            normalized = normalize_plate(plate)
+            rows.sort(key=lambda row: plate_match_rank(normalized, normalize_plate(row[1])))
+        return rows[:limit]
+
+    def subscribe(self, listener):
+        for zone in self.shards:
+            zone.lot.subscribe(listener)
+
+    def unsubscribe(self, listener):
+        for zone in self.shards:
+            zone.lot.unsubscribe(listener)
+
+def load_topology(path):
+    with open(path) as f:
+        return ParkingNetwork(json.load(f))
@@ -3,6 +3,7 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 from datetime import datetime
 import hashlib
+import heapq
 import sqlite3
 
 class User:
@@ -28,29 +29,55 @@ class Vehicle:
 class ParkingLot:
     def __init__(self, num_spots):
         self.spots = [ParkingSpot(f"A{i+1}") for i in range(num_spots)]
+        self.spot_index = {spot.id: i for i, spot in enumerate(self.spots)}  # spot id -> position
+        self.free_heap = list(range(num_spots))  # min-heap of free positions, stale entries skipped lazily
+        self.in_heap = [True] * num_spots
+        self.free_count = num_spots
+
+    def get_spot(self, spot_id):
+        i = self.spot_index.get(spot_id)
+        return self.spots[i] if i is not None else None
 
     def get_available_spots(self):
+        # a plain scan: the heap only answers first-free lookups, sorting it here would cost more
         return [spot for spot in self.spots if not spot.is_occupied]
 
+    def first_available_spot(self):
+        heap = self.free_heap
+        while heap and self.spots[heap[0]].is_occupied:
+            self.in_heap[heapq.heappop(heap)] = False
+        return self.spots[heap[0]] if heap else None
+
+    def available_count(self):
+        return self.free_count
+
     def occupy_spot(self, spot_id, vehicle, duration, user):
-        for spot in self.spots:
-            if spot.id == spot_id:
-                spot.is_occupied = True
-                spot.vehicle = vehicle
-                spot.start_time = datetime.now()
-                spot.duration = duration
-                spot.user = user
-                break
+        spot = self.get_spot(spot_id)
+        if spot is None:
+            return
+        if not spot.is_occupied:
+            self.free_count -= 1
+        spot.is_occupied = True
+        spot.vehicle = vehicle
+        spot.start_time = datetime.now()
+        spot.duration = duration
+        spot.user = user
 
     def vacate_spot(self, spot_id):
-        for spot in self.spots:
-            if spot.id == spot_id:
-                spot.is_occupied = False
-                spot.vehicle = None
-                spot.start_time = None
-                spot.duration = None
-                spot.user = None
-                break
+        i = self.spot_index.get(spot_id)
+        if i is None:
+            return
+        spot = self.spots[i]
+        if spot.is_occupied:
+            self.free_count += 1
+            if not self.in_heap[i]:
+                self.in_heap[i] = True
+                heapq.heappush(self.free_heap, i)
+        spot.is_occupied = False
+        spot.vehicle = None
+        spot.start_time = None
+        spot.duration = None
+        spot.user = None
 class Database:
     def __init__(self):
         self.conn = sqlite3.connect('parking_system.db')
@@ -271,10 +298,10 @@ class ParkingSystem(tk.Tk):
             messagebox.showerror("Error", "Please enter a valid amount")
 
     def update_available_spots(self):
-        available_spots = self.parking_lot.get_available_spots()
-        self.available_spots_dropdown['values'] = [spot.id for spot in available_spots]
-        if available_spots:
-            self.available_spots_dropdown.set(available_spots[0].id)
+        self.available_spots_dropdown['values'] = [spot.id for spot in self.parking_lot.get_available_spots()]
+        first_spot = self.parking_lot.first_available_spot()
+        if first_spot:
+            self.available_spots_dropdown.set(first_spot.id)
         else:
             self.available_spots_dropdown.set('')
 
@@ -338,7 +365,7 @@ class ParkingSystem(tk.Tk):
             messagebox.showerror("Error", "Please select an occupied spot.")
             return
 
-        spot = next((spot for spot in self.parking_lot.spots if spot.id == spot_id), None)
+        spot = self.parking_lot.get_spot(spot_id)
         if spot and spot.is_occupied:
             elapsed_time = datetime.now() - spot.start_time
             hours_parked = elapsed_time.total_seconds() / 3600
@@ -356,7 +383,7 @@ class ParkingSystem(tk.Tk):
             messagebox.showerror("Error", "Please select an occupied spot.")
             return
 
-        spot = next((spot for spot in self.parking_lot.spots if spot.id == spot_id), None)
+        spot = self.parking_lot.get_spot(spot_id)
         if spot and spot.is_occupied and spot.user == self.current_user:
             elapsed_time = datetime.now() - spot.start_time
             hours_parked = elapsed_time.total_seconds() / 3600